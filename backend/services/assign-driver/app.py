@@ -2,15 +2,25 @@ from flask import Flask, request, jsonify
 from flask_cors import CORS
 import os
 import json
-from invokes import invoke_http  
+from invokes import invoke_http, invoke_many, invoke_async, configure_cache
+from invokes.stats import stats_blueprint
+from scheduler import get_scheduler
+from jobs import get_delayed_jobs
+from pending import PendingOrders
+from driver_index import DriverIndex, DRIVER_INDEX_REFRESH_INTERVAL
+from matching import build_cost_matrix, solve
+from reservations import get_reservations
+from timing import StepTimer
 import rabbitmq.amqp_lib as amqp_lib
 import pika 
+import re
 import threading  
 import time  
 from datetime import datetime, timezone, timedelta  
 
 app = Flask(__name__)
 CORS(app)
+app.register_blueprint(stats_blueprint)
 
 # Service URLs
 ORDER_URL = os.environ.get('orderURL', "http://order-service:5001")
@@ -18,6 +28,38 @@ DRIVER_URL = os.environ.get('driverURL', "https://personal-shkrtsry.outsystemscl
 WALLET_URL = os.environ.get('walletURL', "http://wallet-service:5002")
 CUSTOMER_URL = os.environ.get('customerURL', "http://customer-service:4000")
 
+# Cache order and customer lookups, repeated several times per assignment
+# orders change status often so their entries only live for a few seconds
+ORDER_CACHE_TTL = float(os.environ.get('ORDER_CACHE_TTL', 5))
+CUSTOMER_CACHE_TTL = float(os.environ.get('CUSTOMER_CACHE_TTL', 300))
+configure_cache({
+    rf"^{re.escape(ORDER_URL)}/orders/[^/?]+$": ORDER_CACHE_TTL,
+    rf"^{re.escape(CUSTOMER_URL)}/customers/[^/?]+$": CUSTOMER_CACHE_TTL,
+})
+
+# Most ids the order service accepts per /orders:batchGet
+ORDER_BATCH_GET_MAX = 300
+
+# Seconds between driver availability checks for an order waiting for a driver
+# driver.available events and driver index refreshes that find freed drivers
+# trigger a check at once; drivers freed in the driver service itself, e.g. when
+# a delivery is finished, publish no event, so the poll stays short
+PENDING_CHECK_INTERVAL = float(os.environ.get('PENDING_CHECK_INTERVAL', 30))
+
+# "single" assigns the nearest driver to each order as it comes in, "batch"
+# queues orders and matches all pending orders with all available drivers
+# every MATCH_INTERVAL seconds, minimising the total distance
+ASSIGNMENT_MODE = os.environ.get('ASSIGNMENT_MODE', 'single')
+MATCH_INTERVAL = float(os.environ.get('MATCH_INTERVAL', 2))
+
+# Drivers tried per assignment when the nearest ones are leased by other assignments
+RESERVATION_MAX_CANDIDATES = int(os.environ.get('RESERVATION_MAX_CANDIDATES', 5))
+
+# Seconds an order may wait for a driver before it is cancelled and refunded
+ORDER_CANCEL_DELAY = float(os.environ.get('ORDER_CANCEL_DELAY', 900))
+# Times a cancellation is retried when the order changes under it
+CANCEL_MAX_ATTEMPTS = int(os.environ.get('CANCEL_MAX_ATTEMPTS', 3))
+
 # Rabbit MQ variable
 RABBITMQ_PORT = int(os.environ.get('RABBITMQ_PORT', 5672))
 RABBITMQ_HOST = os.environ.get('RABBITMQ_HOST', 'rabbitmq')
@@ -26,26 +68,68 @@ PORT = int(os.environ.get('PORT', 5002))
 exchange_name = "order_topic"
 exchange_type = "topic"
 queue_name = "notification_queue"  
+driver_available_queue = "driver_available_queue"
+
+# Orders waiting for a driver, matched against driver.available events
+pending_orders = PendingOrders()
 
 
-def fetch_and_update_driver(restaurant_id):
+def fetch_restaurant_drivers(restaurant_id):
+    """Driver list of a restaurant from the driver service, used to refresh driver_index"""
+    available_drivers = invoke_http(f"{DRIVER_URL}/status/{restaurant_id}", method="GET")
+    if not isinstance(available_drivers, dict):
+        raise Exception(f"Unexpected driver status response: {available_drivers}")
+    if 'FullResult' not in available_drivers and 'code' in available_drivers:
+        raise Exception(available_drivers.get('message', 'Unknown error'))
+    return available_drivers.get('FullResult') or []
+
+def on_drivers_found(restaurant_id, driver_ids):
+    """The driver index refresh found drivers that became available without a
+    driver.available event, give them to pending orders right away
+    """
+    if ASSIGNMENT_MODE == 'batch':
+        # bring the next matching round forward if matching is running
+        if "batch-match" in get_scheduler():
+            get_scheduler().schedule("batch-match", 0, match_pending_orders)
+        return
+    check_pending_orders_now(restaurant_id, len(driver_ids))
+
+# Available drivers per restaurant, nearest first
+driver_index = DriverIndex(fetch_restaurant_drivers, on_available=on_drivers_found)
+
+def start_driver_index_refresh():
+    if "driver-index-refresh" not in get_scheduler():
+        get_scheduler().schedule("driver-index-refresh", DRIVER_INDEX_REFRESH_INTERVAL, driver_index.refresh_all)
+
+def busy_driver_update(driver):
+    """Request body setting a driver Busy"""
+    return {
+        "DriverId": driver['DriverId'],
+        "DriverStatus": "Busy",
+        "DriverName": driver.get("DriverName", ""),
+        "DriverNumber": driver.get("DriverNumber", 0),
+        "DriverLocation": driver.get("DriverLocation", ""),
+        "DriverEmail": driver.get("DriverEmail", "")
+    }
+
+def fetch_and_update_driver(restaurant_id, order_id=None):
     # Update the driver availability check
     try:
-        # Get available drivers for the restaurant using new endpoint
-        available_drivers = invoke_http(f"{DRIVER_URL}/status/{restaurant_id}", method="GET")
-        if not available_drivers or not available_drivers.get('FullResult'):
-            return None, {"message": "No available drivers"}, 404
-            
-        sorted_drivers = sorted(available_drivers['FullResult'], key=lambda x: float(x.get('Distance', float('inf'))))
-        
+        start_driver_index_refresh()
+
+        # Take the nearest available driver of the restaurant from the index,
+        # skipping drivers leased by a concurrent assignment
         available_driver = None
-        for driver in sorted_drivers:
-            if driver.get('DriverStatus', '').upper() == 'AVAILABLE':
-                available_driver = driver
+        for _ in range(RESERVATION_MAX_CANDIDATES):
+            candidate = driver_index.pop_nearest(restaurant_id)
+            if not candidate:
+                break
+            if get_reservations().acquire(candidate['DriverId'], order_id):
+                available_driver = candidate
                 break
-                
+            print(f"Driver {candidate['DriverId']} is reserved by another assignment")
         if not available_driver:
-            return None, {"message": "No available drivers found"}, 404
+            return None, {"message": "No available drivers"}, 404
             
         driver_id = available_driver['DriverId']
         
@@ -53,17 +137,13 @@ def fetch_and_update_driver(restaurant_id):
         driver_update = invoke_http(
             f"{DRIVER_URL}/drivers",
             method="PUT",
-            json={
-                "DriverId": driver_id,
-                "DriverStatus": "Busy",
-                "DriverName": available_driver.get("DriverName", ""),
-                "DriverNumber": available_driver.get("DriverNumber", 0),
-                "DriverLocation": available_driver.get("DriverLocation", ""),
-                "DriverEmail": available_driver.get("DriverEmail", "")
-            }
+            json=busy_driver_update(available_driver)
         )
 
         if not driver_update or not driver_update.get('Success', False):
+            # the driver's real status is unknown, reload the list on the next attempt
+            driver_index.invalidate(restaurant_id)
+            get_reservations().release(driver_id, order_id)
             return None, {
                 "message": f"Failed to update driver status: {driver_update.get('ErrorMessage', 'Unknown error')}"
             }, 500
@@ -75,27 +155,145 @@ def fetch_and_update_driver(restaurant_id):
     
 def schedule_order_cancellation(order_id):
     """Schedule order cancellation after 15 minutes if still pending"""
-    def cancel_after_delay():
-        time.sleep(900)  #15 minutes
-        # time.sleep(120) # 2 mins for testing
-        # Check current order status
-        try:
-            order_result = invoke_http(
-                f"{ORDER_URL}/orders/{order_id}",
-                method="GET"
-            )
-            
-            if order_result.get('status') == 'PREPARING':
-                # Cancel the order
-                cancel_order(order_id)
-        except Exception as e:
-            print(f"Error in scheduled cancellation for order {order_id}: {str(e)}")
-    
-    # Start cancellation thread
-    thread = threading.Thread(target=cancel_after_delay, daemon=True)
-    thread.start()
+    get_delayed_jobs().add(f"cancel:{order_id}", "cancel_order", {"order_id": order_id}, ORDER_CANCEL_DELAY)
+
+def run_order_cancellation(payload):
+    """Delayed job: cancel the order if it is still waiting for a driver, and
+    refund it. Raises when the order could not be read, cancelled or refunded,
+    so that the job stays stored and is retried.
+    """
+    order_id = payload["order_id"]
+    order_result = invoke_http(
+        f"{ORDER_URL}/orders/{order_id}",
+        method="GET"
+    )
+    if order_read_failed(order_result):
+        raise Exception(f"Could not read order {order_id}: {order_result}")
+
+    waiting = order_result.get('status') == 'PREPARING' and order_result.get('driverStatus') == 'PENDING'
+    # a retry after the order was cancelled but its refund failed
+    if waiting or refund_pending(order_result):
+        get_scheduler().cancel(f"assign:{order_id}")
+        pending_orders.remove(order_id)
+        # cancel_order builds Flask responses
+        with app.app_context():
+            response = cancel_order(order_id, order_result)
+        response, code = response if isinstance(response, tuple) else (response, response.status_code)
+        # 409: a driver was assigned in the meantime, there is nothing left to do
+        if code not in range(200, 300) and code != 409:
+            raise Exception(f"Order {order_id} not cancelled and refunded: {response.get_json().get('message')}")
+
+def refund_pending(order_result):
+    """Whether an order was cancelled but its refund was not made yet"""
+    return order_result.get('status') == 'CANCELLED' and order_result.get('paymentStatus') == 'REFUND_PENDING'
+
+def mark_order_cancelled(order_id, order_result):
+    """Set an order waiting for a driver CANCELLED with its refund pending, only
+    if it is still at the version that was read. On a version conflict the
+    order is read again, and the update retried while it still waits for a driver.
+    Returns (order_update, None), or (None, (message, code)) when the order was
+    not cancelled.
+    """
+    for attempt in range(CANCEL_MAX_ATTEMPTS):
+        if order_result.get('status') != 'PREPARING' or order_result.get('driverStatus') != 'PENDING':
+            return None, (f"Order {order_id} is no longer waiting for a driver.", 409)
 
-def update_order(order_id, driver_id):
+        sg_timezone = timezone(timedelta(hours=8)) # Define the Singapore timezone
+        timestamp = datetime.now(sg_timezone).strftime('%Y-%m-%d %H:%M:%S')
+        version = order_result.get('version')
+        order_update = invoke_http(
+            f"{ORDER_URL}/orders/{order_id}/status",
+            method="PUT",
+            json={
+                "status": "CANCELLED",
+                "driverStatus": "CANCELLED",
+                "paymentStatus": "REFUND_PENDING",
+                "updatedAt": timestamp
+            },
+            headers={"If-Match": version} if version else None
+        )
+        if not (isinstance(order_update, dict) and order_update.get('code') == 412):
+            if not isinstance(order_update, dict) or 'error' in order_update or 'code' in order_update:
+                return None, (f"Failed to update order status: {order_update}", 500)
+            return order_update, None
+
+        # the order changed since it was read, e.g. a driver was just assigned;
+        # the PUT dropped the cached order so this read is fresh
+        print(f"Order {order_id} changed before it could be cancelled, reading it again")
+        order_result = invoke_http(f"{ORDER_URL}/orders/{order_id}", method="GET")
+        if order_read_failed(order_result):
+            return None, (f"Order {order_id} not found or error occurred.", 404)
+
+    # still waiting for a driver, try again later
+    return None, (f"Order {order_id} kept changing, not cancelled.", 503)
+
+def order_read_failed(order_result):
+    """Whether an order GET failed: invoke_http answers {"code", "message"}
+    when the call failed and the order service {"error"} when it errored
+    """
+    return not isinstance(order_result, dict) or 'code' in order_result or 'error' in order_result
+
+def get_orders(order_ids):
+    """Read orders with /orders:batchGet, return one result per id in order.
+
+    Each result is the order with its version, or a failure order_read_failed
+    recognises when the order is missing or its batch could not be read.
+    """
+    results = []
+    for start in range(0, len(order_ids), ORDER_BATCH_GET_MAX):
+        chunk = order_ids[start:start + ORDER_BATCH_GET_MAX]
+        batch = invoke_http(f"{ORDER_URL}/orders:batchGet", method='POST', json={"ids": chunk})
+        if order_read_failed(batch) or not isinstance(batch.get('orders'), list):
+            results.extend([batch if isinstance(batch, dict) else {'error': batch}] * len(chunk))
+            continue
+        found = {order.get('orderId'): order for order in batch['orders']}
+        results.extend(found.get(order_id, {'error': 'Order not found'}) for order_id in chunk)
+    return results
+
+def release_driver(driver_id, order_id, restaurant_id, driver=None):
+    """Set a driver Available again when its order could not be updated"""
+    released = False
+    try:
+        if driver is None:
+            driver = invoke_http(f"{DRIVER_URL}/getDriversById?Id={driver_id}", method="GET").get('Driver')
+        if driver:
+            driver_update = invoke_http(
+                f"{DRIVER_URL}/drivers",
+                method="PUT",
+                json=dict(busy_driver_update(driver), DriverStatus="Available")
+            )
+            released = isinstance(driver_update, dict) and driver_update.get('Success', False)
+        driver_index.mark_available(driver_id)
+    except Exception as e:
+        print(f"Error releasing driver {driver_id}: {str(e)}")
+    get_reservations().release(driver_id, order_id)
+    # let a pending order take the driver, on this replica or another one
+    if released:
+        publish_driver_available(driver_id, restaurant_id)
+
+def publish_driver_available(driver_id, restaurant_id):
+    """Tell every assign-driver replica a driver is free so a pending order can take it right away"""
+    queued = amqp_lib.publish_async(
+        hostname=RABBITMQ_HOST,
+        port=RABBITMQ_PORT,
+        exchange_name=exchange_name,
+        exchange_type=exchange_type,
+        routing_key='driver.available',
+        body={
+            "driver_id": driver_id,
+            "restaurant_id": restaurant_id,
+            "available_at": datetime.now().isoformat()
+        },
+        properties=pika.BasicProperties(delivery_mode=2)
+    )
+    if not queued:
+        print(f"driver.available event for driver {driver_id} dropped, publish buffer is full")
+
+def update_order(order_id, driver_id, version=None):
+    """Set the order's driver, only if the order is still at version when given.
+    Returns (order_update, None) or ({"message": ...}, code), code is 412 when
+    the order changed since version was read.
+    """
     # Extract OrderID from the request payload
     try:
         # request_data = request.get_json()
@@ -112,11 +310,16 @@ def update_order(order_id, driver_id):
                 "status": "PREPARING",
                 "driverId": driver_id,
                 "driverStatus": "PENDING" if driver_id is None else "ASSIGNED"
-            }
+            },
+            headers={"If-Match": version} if version else None
         )
 
-        if 'error' in order_update:
-            return {"message": f"Failed to update order: {order_update['error']}"}, 500
+        if not isinstance(order_update, dict):
+            return {"message": f"Failed to update order: {order_update}"}, 500
+        # the order service answers {"error"}, invoke_http {"code", "message"} when the call failed
+        if 'error' in order_update or 'code' in order_update:
+            error = order_update.get('error') or order_update.get('message')
+            return {"message": f"Failed to update order: {error}"}, order_update.get('code', 500)
             
         return order_update, None
         
@@ -126,21 +329,20 @@ def update_order(order_id, driver_id):
 
 
 # RabbitMQ  - for successful driver assignment
-def send_notification(driver_id, order_id, customer_id): 
+def send_notification(driver_id, order_id, customer_id, order_result=None, customer_result=None): 
     try:
-        print(f"\n=== Retrieving order {order_id} ===")
-        order_result = invoke_http(
-            f"{ORDER_URL}/orders/{order_id}",
-            method="GET"
-        )
+        # Reuse the order and customer the caller already read, fetch the rest concurrently
+        calls = {}
+        if order_result is None:
+            calls["order"] = f"{ORDER_URL}/orders/{order_id}"
+        if customer_result is None:
+            calls["customer"] = f"{CUSTOMER_URL}/customers/{customer_id}"
+        if calls:
+            print(f"\n=== Retrieving order {order_id} and customer {customer_id} ===")
+            results = dict(zip(calls, invoke_many(list(calls.values()))))
+            order_result = results.get("order", order_result)
+            customer_result = results.get("customer", customer_result)
         print("Order result:", order_result)
-
-        # Get customer details
-        print(f"\nFetching customer details from {CUSTOMER_URL}/customers/{customer_id}")
-        customer_result = invoke_http(
-            f"{CUSTOMER_URL}/customers/{customer_id}",
-            method="GET"
-        )
         print("Customer result:", customer_result)
         
         if not order_result or 'error' in order_result:
@@ -160,10 +362,10 @@ def send_notification(driver_id, order_id, customer_id):
             "order_id": order_id,
             "driver_id": driver_id,
             "subject": "Thanks for your order",
-            "subtotal": f"{subtotal:.2f}",  
+            "subtotal": round(subtotal, 2),
             "payment_status": payment_status,
-            "delivery_fee": f"{delivery_fee:.2f}",  
-            "total": f"{order_amount:.2f}",            
+            "delivery_fee": round(delivery_fee, 2),
+            "total": round(order_amount, 2),
             "items": [
                 {
                     "item_name": item.get("name"),
@@ -175,42 +377,53 @@ def send_notification(driver_id, order_id, customer_id):
             ]
         }
 
-        print("  Connecting to AMQP broker...")
-        connection, channel = amqp_lib.connect(
+        print("Publishing driver assignment message to notification queue")
+        queued = amqp_lib.publish_async(
             hostname=RABBITMQ_HOST,
             port=RABBITMQ_PORT,
-            exchange_name='order_topic',
-            exchange_type='topic',
-        )
-
-        print("Publishing driver assignment message to notification queue")
-        channel.basic_publish(
-            exchange='order_topic',
+            exchange_name=exchange_name,
+            exchange_type=exchange_type,
             routing_key='driver.assigned.notification',
-            body=json.dumps(order_info),
+            body=order_info,
             properties=pika.BasicProperties(delivery_mode=2)
         )
+        if not queued:
+            print("Notification dropped, publish buffer is full")
+            return None
 
-        connection.close()
-
-        print("Message sent successfully")
+        print("Message queued successfully")
         return True
     except Exception as e:
         print(f"Error sending notification: {str(e)}")  
         return None
 
+def order_update_failed(order_id, order_update, code):
+    """assign_driver response when update_order failed with code"""
+    if code == 412:
+        return jsonify({
+            "code": 409,
+            "message": f"Order {order_id} changed while a driver was being assigned."
+        }), 409
+    return jsonify({
+        "code": 500,
+        "message": order_update['message']
+    }), 500
+
 # Main endpoint
 @app.route("/assign/<order_id>", methods=['POST'])
 def assign_driver(order_id):
     """
     Main endpoint to assign a driver to an order
     """
+    timer = StepTimer()
     try:
         # First get the order details to get restaurant_id
+        # the order is read once here and passed to every later step
         order_details = invoke_http(
             f"{ORDER_URL}/orders/{order_id}",
             method="GET"
         )
+        timer.step("get_order")
         
         if 'error' in order_details:
             return jsonify({
@@ -225,14 +438,34 @@ def assign_driver(order_id):
                 "message": "Order does not have a restaurant ID"
             }), 400
             
+        if ASSIGNMENT_MODE == 'batch':
+            # Set order to pending and leave it to the next matching round
+            order_update, error = update_order(order_id, None, order_details.get('version'))
+            if error:
+                return order_update_failed(order_id, order_update, error)
+            schedule_order_cancellation(order_id)
+            check_and_assign_driver(order_id, restaurant_id)
+            return jsonify({
+                "code": 202,
+                "message": "Order queued for driver matching."
+            }), 202
+
+        # Look the customer up while the driver and the order are updated
+        customer_future = invoke_async(f"{CUSTOMER_URL}/customers/{order_details.get('customerId')}")
+
         # Step 1: Fetch and update driver status
-        driver_id, error_response, error_code = fetch_and_update_driver(restaurant_id)
+        driver_id, error_response, error_code = fetch_and_update_driver(restaurant_id, order_id)
+        timer.step("reserve_driver")
         if error_response and error_code == 404:
 
             # No available drivers - set order to pending and schedule auto-cancellation
-            update_order(order_id, None)
+            order_update, error = update_order(order_id, None, order_details.get('version'))
+            if error:
+                return order_update_failed(order_id, order_update, error)
             schedule_order_cancellation(order_id)
             check_and_assign_driver(order_id, restaurant_id)
+            timer.step("set_pending")
+            print(f"Assignment latency for order {order_id}: {timer}")
             return jsonify({
                 "code": 202,
                 "message": "No drivers currently available. Will assign when one becomes available."
@@ -243,16 +476,22 @@ def assign_driver(order_id):
                 "message": error_response['message']
             }), error_code
         
-        # Step 2: Update order with driver information
-        order_update, error = update_order(order_id, driver_id)
+        # Step 2: Update order with driver information, unless it changed since it was read
+        order_update, error = update_order(order_id, driver_id, order_details.get('version'))
+        timer.step("update_order")
         if error:
-            return jsonify({
-                "code": 500,
-                "message": error['message']
-            }), 500
+            release_driver(driver_id, order_id, restaurant_id)
+            return order_update_failed(order_id, order_update, error)
         
         # Step 3: Send notification 
-        send_notification(driver_id, order_id, order_details.get('customerId'))
+        customer_result = customer_future.result()
+        timer.step("wait_customer")
+        send_notification(
+            driver_id, order_id, order_details.get('customerId'),
+            order_result=order_details, customer_result=customer_result
+        )
+        timer.step("notify")
+        print(f"Assignment latency for order {order_id}: {timer}")
         
         return jsonify({
             "code": 200,
@@ -271,20 +510,23 @@ def assign_driver(order_id):
             "message": f"An error occurred while assigning driver: {str(e)}"
         }), 500
 
-def cancel_order(order_id):
+def cancel_order(order_id, order_result=None):
     """
-    Cancel an order and process refund
+    Cancel an order still waiting for a driver and process refund.
+    The order is cancelled with its refund pending in one write, an order
+    already in that state is only refunded, so a failed refund can be retried
     """
     try:
         print(f"\n=== Starting order cancellation for order {order_id} ===")
         
         # Step 1: Get the order details 
-        print(f"Fetching order details from {ORDER_URL}/orders/{order_id}")
-        order_result = invoke_http(
-            f"{ORDER_URL}/orders/{order_id}",
-            method="GET"
-        )
-        print("Order result:", order_result)
+        if order_result is None:
+            print(f"Fetching order details from {ORDER_URL}/orders/{order_id}")
+            order_result = invoke_http(
+                f"{ORDER_URL}/orders/{order_id}",
+                method="GET"
+            )
+            print("Order result:", order_result)
         
         if not order_result or 'error' in order_result:
             print(f"Order not found or error: {order_result}")
@@ -293,7 +535,19 @@ def cancel_order(order_id):
                 "message": f"Order {order_id} not found or error occurred."
             }), 404
 
-        # Step 2: Process refund to customer's wallet
+        # Step 2: Cancel the order first, so that an order assigned in the
+        # meantime is neither cancelled nor refunded
+        if not refund_pending(order_result):
+            _, error = mark_order_cancelled(order_id, order_result)
+            if error:
+                message, code = error
+                print(f"Order {order_id} not cancelled: {message}")
+                return jsonify({
+                    "code": code,
+                    "message": message
+                }), code
+
+        # Step 3: Process refund to customer's wallet
         customer_id = order_result.get('customerId')
         order_amount = float(order_result.get('price', 0))
         
@@ -307,11 +561,12 @@ def cancel_order(order_id):
         )
         print("Wallet result:", wallet_result)
         
-        if not wallet_result or 'error' in wallet_result:
+        # 'code': the wallet service could not be reached
+        if not wallet_result or 'error' in wallet_result or 'code' in wallet_result:
             print(f"Wallet error: {wallet_result}")
             return jsonify({
                 "code": 500,
-                "message": f"Failed to get wallet information: {wallet_result.get('error', 'Unknown error')}"
+                "message": f"Failed to get wallet information: {wallet_result.get('error') or wallet_result.get('message', 'Unknown error')}"
             }), 500
 
         current_balance = float(wallet_result.get('balance', 0))
@@ -326,21 +581,21 @@ def cancel_order(order_id):
         )
         print("Refund result:", refund_result)
         
-        if not refund_result or 'error' in refund_result:
+        if not refund_result or 'error' in refund_result or 'code' in refund_result:
             print(f"Refund error: {refund_result}")
             return jsonify({
                 "code": 500,
-                "message": f"Failed to process refund: {refund_result.get('error', 'Unknown error')}"
+                "message": f"Failed to process refund: {refund_result.get('error') or refund_result.get('message', 'Unknown error')}"
             }), 500
 
-        # Step 3: Update order status
+        # Step 4: Record the refund, the order is already cancelled. The wallet
+        # PUT sets a balance rather than adding to it, so if this write fails
+        # the retry credits the wallet again
         sg_timezone = timezone(timedelta(hours=8)) # Define the Singapore timezone
         current_sg_time = datetime.now(sg_timezone)
         timestamp = current_sg_time.strftime('%Y-%m-%d %H:%M:%S')
         update_data = {
-            "status": "CANCELLED",
             "paymentStatus": "REFUNDED",
-            "driverStatus": 'CANCELLED',  
             "updatedAt": timestamp
         }
         
@@ -352,14 +607,14 @@ def cancel_order(order_id):
         )
         print("Order update result:", final_update)
 
-        if not final_update or 'error' in final_update:
+        if not final_update or 'error' in final_update or 'code' in final_update:
             print(f"Order update error: {final_update}")
             return jsonify({
                 "code": 500,
-                "message": f"Failed to update order status: {final_update.get('error', 'Unknown error')}"
+                "message": f"Failed to update order status: {final_update.get('error') or final_update.get('message', 'Unknown error')}"
             }), 500
 
-        # Step 4: Send notification
+        # Step 5: Send notification
         try:
             # Get customer details
             print(f"\nFetching customer details from {CUSTOMER_URL}/customers/{customer_id}")
@@ -387,24 +642,16 @@ def cancel_order(order_id):
                     """
                 }
 
-                # Publish notification
-                print("  Connecting to AMQP broker...")
-                connection, channel = amqp_lib.connect(
+                # Publish notification to RabbitMQ in the background
+                amqp_lib.publish_async(
                     hostname=RABBITMQ_HOST,
                     port=RABBITMQ_PORT,
-                    exchange_name='order_topic',
-                    exchange_type='topic',
-                )
-
-                # Publish to RabbitMQ
-                channel.basic_publish(
-                    exchange='order_topic',
+                    exchange_name=exchange_name,
+                    exchange_type=exchange_type,
                     routing_key='order.cancel.notification',
-                    body=json.dumps(notification_data),
+                    body=notification_data,
                     properties=pika.BasicProperties(delivery_mode=2)
                 )
-
-                connection.close()
                 print("Notification queued successfully")
 
         except Exception as notification_error:
@@ -427,46 +674,274 @@ def cancel_order(order_id):
             "message": f"An error occurred while cancelling the order: {str(e)}"
         }), 500
 
-def check_and_assign_driver(order_id, restaurant_id):
-    """Continuously check for available drivers and assign when found"""
-    def check_driver_loop():
-        while True:
-            try:
-                # Get current order status
-                order_result = invoke_http(
-                    f"{ORDER_URL}/orders/{order_id}",
-                    method="GET"
+def check_pending_order(order_id, restaurant_id):
+    """Try once to assign a driver to a pending order.
+    Returns the delay before the next check, or None once the order is settled
+    """
+    timer = StepTimer()
+    try:
+        # Get current order status
+        order_result = invoke_http(
+            f"{ORDER_URL}/orders/{order_id}",
+            method="GET"
+        )
+        timer.step("get_order")
+
+        # The order service failed or could not be reached, the order is
+        # still unknown so keep it and its auto-cancellation for the next check
+        if order_read_failed(order_result):
+            print(f"Could not read pending order {order_id}: {order_result}")
+            pending_orders.release(order_id)
+            return PENDING_CHECK_INTERVAL
+
+        # If order is cancelled or already has a driver, stop checking
+        if (order_result.get('status') in ['CANCELLED', 'DELIVERED', 'COMPLETED'] or 
+            order_result.get('driverStatus') != 'PENDING'):
+            get_delayed_jobs().remove(f"cancel:{order_id}")
+            pending_orders.remove(order_id)
+            return None
+
+        # Look the customer up while the driver and the order are updated
+        customer_future = invoke_async(f"{CUSTOMER_URL}/customers/{order_result.get('customerId')}")
+
+        # Try to get an available driver
+        driver_id, error_response, error_code = fetch_and_update_driver(restaurant_id, order_id)
+        timer.step("reserve_driver")
+
+        if driver_id:  # If we found an available driver
+            # Update order with the new driver, unless it changed since it was read
+            order_update, error = update_order(order_id, driver_id, order_result.get('version'))
+            timer.step("update_order")
+            if error:
+                # give the driver back, the next check sees what happened to the order
+                print(f"Could not assign driver {driver_id} to order {order_id}: {order_update['message']}")
+                release_driver(driver_id, order_id, restaurant_id)
+            else:
+                get_delayed_jobs().remove(f"cancel:{order_id}")
+                pending_orders.remove(order_id)
+                print(f"Successfully assigned driver {driver_id} to order {order_id}")
+                customer_result = customer_future.result()
+                timer.step("wait_customer")
+                send_notification(
+                    driver_id, order_id, order_result.get('customerId'),
+                    order_result=order_result, customer_result=customer_result
                 )
-                
-                # If order is cancelled or already has a driver, stop checking
-                if (order_result.get('status') in ['CANCELLED', 'DELIVERED', 'COMPLETED'] or 
-                    order_result.get('driverStatus') != 'PENDING'):
-                    break
-                
-                # Try to get an available driver
-                driver_id, error_response, error_code = fetch_and_update_driver(restaurant_id)
-                
-                if driver_id:  # If we found an available driver
-                    # Update order with the new driver
-                    update_order(order_id, driver_id)
-                    print(f"Successfully assigned driver {driver_id} to order {order_id}")
-                    send_notification(driver_id, order_id, order_result.get('customerId'))
-
-                    break
-                    
-                # Wait before checking again
-                time.sleep(30)  # Check every 30 seconds
-                
-            except Exception as e:
-                print(f"Error in check_driver_loop for order {order_id}: {str(e)}")
-                time.sleep(30)  # Wait before retrying after error
-    
-    # Start the checking thread
-    thread = threading.Thread(target=check_driver_loop, daemon=True)
+                timer.step("notify")
+                print(f"Assignment latency for pending order {order_id}: {timer}")
+                return None
+
+    except Exception as e:
+        print(f"Error checking pending order {order_id}: {str(e)}")
+
+    # Still pending, let the next driver.available event pick it again
+    pending_orders.release(order_id)
+
+    # Wait before checking again
+    return PENDING_CHECK_INTERVAL
+
+def check_and_assign_driver(order_id, restaurant_id):
+    """Check for available drivers every PENDING_CHECK_INTERVAL seconds and assign when found"""
+    pending_orders.add(order_id, restaurant_id)
+    if ASSIGNMENT_MODE == 'batch':
+        start_batch_matching()
+        return
+    # the caller just found no driver, so the first check waits a full interval
+    # unless a driver.available event brings it forward
+    get_scheduler().schedule(f"assign:{order_id}", PENDING_CHECK_INTERVAL, check_pending_order, order_id, restaurant_id)
+
+def start_batch_matching():
+    start_driver_index_refresh()
+    if "batch-match" not in get_scheduler():
+        get_scheduler().schedule("batch-match", MATCH_INTERVAL, match_pending_orders)
+
+def match_pending_orders():
+    """Match every pending order with the available drivers in one round.
+    Returns the delay before the next round.
+    """
+    started = time.time()
+    batch = pending_orders.claim_all()
+    try:
+        if not batch:
+            return MATCH_INTERVAL
+
+        distances = {}
+        drivers = {}
+        for restaurant_id in dict.fromkeys(restaurant_id for _, restaurant_id in batch):
+            available = driver_index.available(restaurant_id)
+            distances[restaurant_id] = {driver_id: distance for driver_id, (distance, _) in available.items()}
+            drivers.update((driver_id, driver) for driver_id, (_, driver) in available.items())
+
+        driver_ids = list(drivers)
+        cost = build_cost_matrix([restaurant_id for _, restaurant_id in batch], driver_ids, distances)
+        pairs = solve(cost)
+
+        matches = []
+        for row, column in pairs:
+            driver_id = driver_ids[column]
+            # skip drivers taken by the single-order path since available() was read
+            if driver_index.take(driver_id):
+                order_id, restaurant_id = batch[row]
+                matches.append((order_id, restaurant_id, drivers[driver_id]))
+
+        assigned = assign_matches(matches)
+        print(
+            f"Matched {assigned} of {len(batch)} pending orders with {len(driver_ids)} drivers "
+            f"in {(time.time() - started) * 1000:.0f}ms"
+        )
+    except Exception as e:
+        print(f"Error in match_pending_orders: {str(e)}")
+    finally:
+        # orders left unassigned wait for the next round
+        for order_id, _ in batch:
+            pending_orders.release(order_id)
+
+    return MATCH_INTERVAL
+
+def assign_matches(matches):
+    """Apply [(order_id, restaurant_id, driver)] with bulk calls, return the number assigned"""
+    if not matches:
+        return 0
+
+    # Skip orders that were cancelled or got a driver since they were queued
+    orders = get_orders([order_id for order_id, _, _ in matches])
+    still_pending = []
+    for (order_id, restaurant_id, driver), order in zip(matches, orders):
+        if order_read_failed(order):
+            driver_index.mark_available(driver['DriverId'])
+            continue
+        if (order.get('status') in ['CANCELLED', 'DELIVERED', 'COMPLETED'] or
+            order.get('driverStatus') != 'PENDING'):
+            get_delayed_jobs().remove(f"cancel:{order_id}")
+            pending_orders.remove(order_id)
+            driver_index.mark_available(driver['DriverId'])
+            continue
+        still_pending.append((order_id, restaurant_id, driver, order))
+
+    # Lease the drivers in one call, drivers leased elsewhere stay busy here
+    leased = get_reservations().acquire_many([
+        (driver['DriverId'], order_id) for order_id, _, driver, _ in still_pending
+    ])
+    still_pending = [match for match in still_pending if match[2]['DriverId'] in leased]
+
+    # Set the drivers busy in bulk, looking the customers up in the same fan-out
+    responses = invoke_many([
+        {"url": f"{DRIVER_URL}/drivers", "method": "PUT", "json": busy_driver_update(driver)}
+        for _, _, driver, _ in still_pending
+    ] + [
+        f"{CUSTOMER_URL}/customers/{order.get('customerId')}"
+        for _, _, _, order in still_pending
+    ])
+    driver_updates = responses[:len(still_pending)]
+    customers = dict(zip([order_id for order_id, _, _, _ in still_pending], responses[len(still_pending):]))
+    reserved = []
+    for match, driver_update in zip(still_pending, driver_updates):
+        if isinstance(driver_update, dict) and driver_update.get('Success', False):
+            reserved.append(match)
+        else:
+            # the driver's real status is unknown, reload the list on the next round
+            driver_index.invalidate(match[1])
+            get_reservations().release(match[2]['DriverId'], match[0])
+
+    # Attach the drivers to their orders in bulk, each only if the order did not change since it was read
+    order_updates = invoke_many([
+        {
+            "url": f"{ORDER_URL}/orders/{order_id}/status",
+            "method": "PUT",
+            "json": {"status": "PREPARING", "driverId": driver['DriverId'], "driverStatus": "ASSIGNED"},
+            "headers": {"If-Match": order['version']} if order.get('version') else None
+        }
+        for order_id, _, driver, order in reserved
+    ])
+    assigned = 0
+    for (order_id, restaurant_id, driver, order), order_update in zip(reserved, order_updates):
+        if not isinstance(order_update, dict) or 'error' in order_update or 'code' in order_update:
+            print(f"Failed to update order {order_id} with driver {driver['DriverId']}: {order_update}")
+            release_driver(driver['DriverId'], order_id, restaurant_id, driver)
+            continue
+        get_delayed_jobs().remove(f"cancel:{order_id}")
+        pending_orders.remove(order_id)
+        send_notification(
+            driver['DriverId'], order_id, order.get('customerId'),
+            order_result=order, customer_result=customers[order_id]
+        )
+        assigned += 1
+    return assigned
+
+def on_driver_available(channel, method, properties, body):
+    """Check the oldest pending order of the driver's restaurant as soon as a driver is free"""
+    try:
+        event = amqp_lib.decode_message(body, properties)
+        print(f"Driver {event.get('driver_id')} available near restaurant {event.get('restaurant_id')}")
+
+        if not driver_index.mark_available(event.get('driver_id')):
+            driver_index.invalidate(event.get('restaurant_id'))
+
+        if ASSIGNMENT_MODE == 'batch':
+            # bring the next matching round forward
+            get_scheduler().schedule("batch-match", 0, match_pending_orders)
+            return
+
+        if not check_pending_orders_now(event.get('restaurant_id')):
+            print("No pending orders waiting for a driver")
+    except Exception as e:
+        print(f"Error handling driver.available event: {str(e)}")
+
+def check_pending_orders_now(restaurant_id, drivers=1):
+    """Check one pending order per freed driver of the restaurant right away,
+    return the number of orders picked
+    """
+    picked = 0
+    for _ in range(drivers):
+        claimed = pending_orders.claim(restaurant_id)
+        if claimed is None:
+            break
+        order_id, order_restaurant_id = claimed
+        # replaces the order's next poll with an immediate check
+        get_scheduler().schedule(f"assign:{order_id}", 0, check_pending_order, order_id, order_restaurant_id)
+        picked += 1
+    return picked
+
+def start_driver_available_consumer():
+    thread = threading.Thread(
+        target=amqp_lib.start_consuming,
+        args=(RABBITMQ_HOST, RABBITMQ_PORT, exchange_name, exchange_type,
+              driver_available_queue, on_driver_available),
+        daemon=True
+    )
     thread.start()
 
+@app.route("/scheduler-stats", methods=['GET'])
+def scheduler_stats():
+    """Expose queue size and lag of the pending order scheduler"""
+    return jsonify({
+        "code": 200,
+        "data": {
+            **get_scheduler().snapshot(),
+            "pending_orders": pending_orders.snapshot()
+        }
+    }), 200
+
+@app.route("/driver-index-stats", methods=['GET'])
+def driver_index_stats():
+    """Expose size and freshness of the available driver index"""
+    return jsonify({
+        "code": 200,
+        "data": {
+            **driver_index.snapshot(),
+            "reservations": get_reservations().snapshot()
+        }
+    }), 200
+
+get_delayed_jobs().register("cancel_order", run_order_cancellation)
+
 if __name__ == "__main__":
     print("This is flask " + os.path.basename(__file__) + " for assigning drivers")
+    # the debug reloader runs this file in two processes, only the one serving
+    # requests reloads the delayed jobs stored before the last shutdown and
+    # listens for free drivers
+    if os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        get_delayed_jobs().start()
+        start_driver_available_consumer()
     app.run(host="0.0.0.0", port=int(os.environ.get('PORT', 5006)), debug=True)
 
     
\ No newline at end of file
@@ -0,0 +1,108 @@
+"""
+Compares the per-order assignment path with batch matching on a synthetic city.
+
+Each scenario places restaurants and drivers at random, queues orders at
+random restaurants and assigns them with:
+- per-order: DriverIndex.pop_nearest for each order in arrival order, what
+  fetch_and_update_driver does;
+- batch optimal / batch greedy: one matching round over all orders, what
+  match_pending_orders does.
+
+No service is called, the driver service is replaced by the generated
+distances. Run from backend/services/assign-driver:
+
+    python benchmark_matching.py --orders 200 --drivers 250 --restaurants 40
+"""
+
+import argparse
+import time
+
+import numpy as np
+
+from driver_index import DriverIndex
+from matching import build_cost_matrix, solve_greedy, solve_optimal
+
+
+def make_city(restaurants, drivers, orders, seed):
+    rng = np.random.default_rng(seed)
+    restaurant_xy = rng.random((restaurants, 2)) * 10
+    driver_xy = rng.random((drivers, 2)) * 10
+    # distance of every driver to every restaurant, in km
+    distance = np.linalg.norm(restaurant_xy[:, None, :] - driver_xy[None, :, :], axis=2)
+    order_restaurants = rng.integers(0, restaurants, size=orders).tolist()
+    return distance, order_restaurants
+
+
+def new_index(distance):
+    def fetch_drivers(restaurant_id):
+        return [
+            {"DriverId": driver_id, "DriverStatus": "Available", "Distance": float(d)}
+            for driver_id, d in enumerate(distance[restaurant_id])
+        ]
+    return DriverIndex(fetch_drivers)
+
+
+def run_per_order(distance, order_restaurants):
+    index = new_index(distance)
+    started = time.perf_counter()
+    total = 0.0
+    assigned = 0
+    for restaurant_id in order_restaurants:
+        driver = index.pop_nearest(restaurant_id)
+        if driver is None:
+            continue
+        total += driver["Distance"]
+        assigned += 1
+    return assigned, total, time.perf_counter() - started
+
+
+def run_batch(distance, order_restaurants, solver):
+    index = new_index(distance)
+    started = time.perf_counter()
+    distances = {}
+    for restaurant_id in dict.fromkeys(order_restaurants):
+        available = index.available(restaurant_id)
+        distances[restaurant_id] = {driver_id: d for driver_id, (d, _) in available.items()}
+    driver_ids = list(range(distance.shape[1]))
+    cost = build_cost_matrix(order_restaurants, driver_ids, distances)
+    pairs = solver(cost)
+    total = float(sum(cost[row, column] for row, column in pairs))
+    return len(pairs), total, time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--orders", type=int, default=200)
+    parser.add_argument("--drivers", type=int, default=250)
+    parser.add_argument("--restaurants", type=int, default=40)
+    parser.add_argument("--rounds", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    modes = [
+        ("per-order", lambda d, o: run_per_order(d, o)),
+        ("batch optimal", lambda d, o: run_batch(d, o, solve_optimal)),
+        ("batch greedy", lambda d, o: run_batch(d, o, solve_greedy)),
+    ]
+    results = {name: [0, 0.0, 0.0] for name, _ in modes}
+    for round_number in range(args.rounds):
+        distance, order_restaurants = make_city(
+            args.restaurants, args.drivers, args.orders, args.seed + round_number
+        )
+        for name, run in modes:
+            assigned, total, elapsed = run(distance, order_restaurants)
+            results[name][0] += assigned
+            results[name][1] += total
+            results[name][2] += elapsed
+
+    print(f"{args.rounds} rounds of {args.orders} orders, {args.drivers} drivers, {args.restaurants} restaurants")
+    print(f"{'mode':<15}{'assigned':>10}{'avg km':>10}{'total km':>12}{'orders/s':>12}")
+    for name, (assigned, total, elapsed) in results.items():
+        print(
+            f"{name:<15}{assigned:>10}{total / max(assigned, 1):>10.3f}"
+            f"{total:>12.1f}{assigned / max(elapsed, 1e-9):>12.0f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
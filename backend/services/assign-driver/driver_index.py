@@ -0,0 +1,231 @@
+import heapq
+import itertools
+import os
+import threading
+import time
+
+# Seconds between background refreshes of the restaurants in the index
+DRIVER_INDEX_REFRESH_INTERVAL = float(os.environ.get('DRIVER_INDEX_REFRESH_INTERVAL', 15))
+# A restaurant older than this is refreshed before a driver is picked from it
+DRIVER_INDEX_MAX_AGE = float(os.environ.get('DRIVER_INDEX_MAX_AGE', 60))
+# Drivers marked busy here stay out of the index for this long even if the
+# driver service still lists them as available
+DRIVER_INDEX_BUSY_GRACE = float(os.environ.get('DRIVER_INDEX_BUSY_GRACE', 30))
+# Restaurants without assignments for this long are dropped from the index
+DRIVER_INDEX_IDLE_TTL = float(os.environ.get('DRIVER_INDEX_IDLE_TTL', 600))
+
+
+class _Restaurant:
+    __slots__ = ("heap", "available", "seen", "refreshed_at", "used_at")
+
+    def __init__(self):
+        self.heap = []
+        # driver_id -> (distance, seq, driver) for drivers currently in the heap
+        self.available = {}
+        # every driver listed by the last refresh
+        self.seen = set()
+        self.refreshed_at = 0.0
+        self.used_at = time.time()
+
+
+class DriverIndex:
+    """
+    Available drivers per restaurant, in a min-heap keyed by distance.
+
+    fetch_drivers(restaurant_id) returns the driver list of the driver service
+    and is only called on refresh, so picking a driver is a heap pop instead
+    of a GET, a sort and a scan. Drivers marked busy are dropped from every
+    restaurant right away and their stale heap entries are skipped on pop.
+    on_available(restaurant_id, driver_ids) is called when a refresh finds
+    drivers available that were not before, e.g. freed by a finished delivery.
+    """
+
+    def __init__(self, fetch_drivers, on_available=None):
+        self.fetch_drivers = fetch_drivers
+        self.on_available = on_available
+        self.lock = threading.Lock()
+        self.restaurants = {}
+        # driver_id -> {restaurant_id: driver} as last seen by a refresh
+        self.known = {}
+        # driver_id -> time it was marked busy here
+        self.busy_since = {}
+        self.sequence = itertools.count()
+        self.hits = 0
+        self.refreshes = 0
+        self.refresh_errors = 0
+
+    def refresh(self, restaurant_id):
+        """Reload the drivers of a restaurant, keep the old entries if the call fails"""
+        started = time.time()
+        try:
+            drivers = self.fetch_drivers(restaurant_id)
+        except Exception as e:
+            print(f"Error refreshing drivers of restaurant {restaurant_id}: {str(e)}")
+            with self.lock:
+                self.refresh_errors += 1
+            return False
+
+        with self.lock:
+            self.refreshes += 1
+            # the first load of a restaurant has nothing to compare with
+            known = restaurant_id in self.restaurants
+            restaurant = self.restaurants.setdefault(restaurant_id, _Restaurant())
+            previously_available = set(restaurant.available)
+            self._forget(restaurant_id, restaurant)
+            for driver in drivers:
+                driver_id = driver.get('DriverId')
+                if driver_id is None:
+                    continue
+                restaurant.seen.add(driver_id)
+                self.known.setdefault(driver_id, {})[restaurant_id] = driver
+                # a driver we just marked busy may still show as available
+                if (driver.get('DriverStatus', '').upper() == 'AVAILABLE' and
+                        self.busy_since.get(driver_id, 0) < started - DRIVER_INDEX_BUSY_GRACE):
+                    restaurant.heap.append(self._entry(restaurant, driver_id, driver))
+            heapq.heapify(restaurant.heap)
+            restaurant.refreshed_at = time.time()
+            freed = [d for d in restaurant.available if d not in previously_available] if known else []
+
+        if freed and self.on_available is not None:
+            try:
+                self.on_available(restaurant_id, freed)
+            except Exception as e:
+                print(f"Error handling drivers available at restaurant {restaurant_id}: {str(e)}")
+        return True
+
+    def _entry(self, restaurant, driver_id, driver):
+        entry = (float(driver.get('Distance', float('inf'))), next(self.sequence), driver)
+        restaurant.available[driver_id] = entry
+        return entry
+
+    def _forget(self, restaurant_id, restaurant):
+        for driver_id in restaurant.seen:
+            seen_in = self.known.get(driver_id)
+            if seen_in is not None:
+                seen_in.pop(restaurant_id, None)
+                if not seen_in:
+                    del self.known[driver_id]
+        restaurant.heap = []
+        restaurant.available = {}
+        restaurant.seen = set()
+
+    def _ensure_fresh(self, restaurant_id):
+        """Refresh the restaurant if it is missing or too old, return True if it was"""
+        with self.lock:
+            restaurant = self.restaurants.get(restaurant_id)
+            stale = restaurant is None or time.time() - restaurant.refreshed_at > DRIVER_INDEX_MAX_AGE
+        if stale:
+            self.refresh(restaurant_id)
+        return stale
+
+    def available(self, restaurant_id):
+        """Return {driver_id: (distance, driver)} of the available drivers of a restaurant"""
+        self._ensure_fresh(restaurant_id)
+        with self.lock:
+            restaurant = self.restaurants.get(restaurant_id)
+            if restaurant is None:
+                return {}
+            restaurant.used_at = time.time()
+            return {driver_id: (entry[0], entry[2]) for driver_id, entry in restaurant.available.items()}
+
+    def take(self, driver_id):
+        """Mark a driver picked from available() busy, return False if it was
+        taken by someone else in the meantime.
+        """
+        with self.lock:
+            for restaurant_id in self.known.get(driver_id, {}):
+                restaurant = self.restaurants.get(restaurant_id)
+                if restaurant is not None and driver_id in restaurant.available:
+                    self._mark_busy(driver_id)
+                    return True
+            return False
+
+    def pop_nearest(self, restaurant_id):
+        """Take the nearest available driver of a restaurant out of the index.
+        The driver is considered busy from now on, call mark_available or
+        invalidate if it could not be assigned after all.
+        """
+        stale = self._ensure_fresh(restaurant_id)
+
+        with self.lock:
+            restaurant = self.restaurants.get(restaurant_id)
+            if restaurant is None:
+                return None
+            restaurant.used_at = time.time()
+            while restaurant.heap:
+                entry = heapq.heappop(restaurant.heap)
+                driver = entry[2]
+                driver_id = driver.get('DriverId')
+                # entries of drivers marked busy since they were pushed are skipped
+                if restaurant.available.get(driver_id) is entry:
+                    self._mark_busy(driver_id)
+                    if not stale:
+                        self.hits += 1
+                    return driver
+            return None
+
+    def _mark_busy(self, driver_id):
+        self.busy_since[driver_id] = time.time()
+        for restaurant_id in self.known.get(driver_id, {}):
+            restaurant = self.restaurants.get(restaurant_id)
+            if restaurant is not None:
+                restaurant.available.pop(driver_id, None)
+
+    def mark_busy(self, driver_id):
+        with self.lock:
+            self._mark_busy(driver_id)
+
+    def mark_available(self, driver_id):
+        """Put a freed driver back in every restaurant it was last seen in.
+        Returns False if the driver is unknown to the index.
+        """
+        with self.lock:
+            self.busy_since.pop(driver_id, None)
+            seen = self.known.get(driver_id)
+            if not seen:
+                return False
+            for restaurant_id, driver in seen.items():
+                restaurant = self.restaurants.get(restaurant_id)
+                if restaurant is None or driver_id in restaurant.available:
+                    continue
+                heapq.heappush(restaurant.heap, self._entry(restaurant, driver_id, driver))
+            return True
+
+    def invalidate(self, restaurant_id):
+        """Force a refresh of the restaurant on its next pop"""
+        with self.lock:
+            restaurant = self.restaurants.get(restaurant_id)
+            if restaurant is not None:
+                restaurant.refreshed_at = 0.0
+
+    def refresh_all(self):
+        """Refresh every restaurant in use and drop idle ones, returns the delay
+        until the next run so it can be scheduled as a periodic job.
+        """
+        now = time.time()
+        with self.lock:
+            for restaurant_id, restaurant in list(self.restaurants.items()):
+                if now - restaurant.used_at > DRIVER_INDEX_IDLE_TTL:
+                    self._forget(restaurant_id, restaurant)
+                    del self.restaurants[restaurant_id]
+            for driver_id, since in list(self.busy_since.items()):
+                if now - since > DRIVER_INDEX_BUSY_GRACE:
+                    del self.busy_since[driver_id]
+            restaurant_ids = list(self.restaurants)
+        for restaurant_id in restaurant_ids:
+            self.refresh(restaurant_id)
+        return DRIVER_INDEX_REFRESH_INTERVAL
+
+    def snapshot(self):
+        with self.lock:
+            now = time.time()
+            return {
+                "restaurants": len(self.restaurants),
+                "available_drivers": sum(len(r.available) for r in self.restaurants.values()),
+                "oldest_refresh": max(
+                    (round(now - r.refreshed_at, 3) for r in self.restaurants.values()), default=None
+                ),
+                "hits": self.hits,
+                "refreshes": self.refreshes,
+                "refresh_errors": self.refresh_errors,
+            }
@@ -0,0 +1,24 @@
+import json
+import os
+import threading
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_firestore_client():
+    """Firestore client of the default Firebase app, initialized from FIREBASE_CONFIG"""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                import firebase_admin
+                from firebase_admin import credentials, firestore
+
+                if not firebase_admin._apps:
+                    firebase_config = os.environ.get('FIREBASE_CONFIG')
+                    if not firebase_config:
+                        raise RuntimeError("FIREBASE_CONFIG environment variable not set")
+                    firebase_admin.initialize_app(credentials.Certificate(json.loads(firebase_config)))
+                _client = firestore.client()
+    return _client
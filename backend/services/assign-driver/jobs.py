@@ -0,0 +1,160 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from firestore_client import get_firestore_client
+from scheduler import get_scheduler
+
+# Where delayed jobs are persisted: "sqlite" (local file) or "firestore"
+JOBS_STORE = os.environ.get('JOBS_STORE', 'sqlite')
+JOBS_DB_PATH = os.environ.get('JOBS_DB_PATH', 'jobs.db')
+JOBS_COLLECTION = os.environ.get('JOBS_COLLECTION', 'scheduled_jobs')
+
+# Overdue jobs found at startup are run JOBS_CATCHUP_BATCH_SIZE at a time,
+# one batch every JOBS_CATCHUP_INTERVAL seconds, instead of all at once
+JOBS_CATCHUP_BATCH_SIZE = int(os.environ.get('JOBS_CATCHUP_BATCH_SIZE', 50))
+JOBS_CATCHUP_INTERVAL = float(os.environ.get('JOBS_CATCHUP_INTERVAL', 1))
+
+# Seconds before a job whose handler raised is tried again
+JOBS_RETRY_DELAY = float(os.environ.get('JOBS_RETRY_DELAY', 60))
+
+
+class SqliteJobStore:
+    """Jobs kept in a local SQLite file, mount it on a volume to survive restarts"""
+
+    def __init__(self, path):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        with self.lock, self.connection:
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS jobs ("
+                "id TEXT PRIMARY KEY, type TEXT NOT NULL, payload TEXT NOT NULL, due REAL NOT NULL)"
+            )
+
+    def save(self, job_id, job_type, payload, due):
+        with self.lock, self.connection:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO jobs (id, type, payload, due) VALUES (?, ?, ?, ?)",
+                (job_id, job_type, json.dumps(payload), due)
+            )
+
+    def delete(self, job_id, due=None):
+        # with due set, only delete that run of the job, not one added again since
+        with self.lock, self.connection:
+            if due is None:
+                self.connection.execute("DELETE FROM jobs WHERE id = ?", (job_id,))
+            else:
+                self.connection.execute("DELETE FROM jobs WHERE id = ? AND due = ?", (job_id, due))
+
+    def load(self):
+        with self.lock:
+            rows = self.connection.execute("SELECT id, type, payload, due FROM jobs ORDER BY due").fetchall()
+        return [(job_id, job_type, json.loads(payload), due) for job_id, job_type, payload, due in rows]
+
+
+class FirestoreJobStore:
+    """Jobs kept in a Firestore collection, one document per job"""
+
+    def __init__(self, collection):
+        self.collection = get_firestore_client().collection(collection)
+
+    def save(self, job_id, job_type, payload, due):
+        self.collection.document(job_id).set({"type": job_type, "payload": payload, "due": due})
+
+    def delete(self, job_id, due=None):
+        doc_ref = self.collection.document(job_id)
+        if due is not None:
+            doc = doc_ref.get()
+            if not doc.exists or doc.to_dict().get("due") != due:
+                return
+        doc_ref.delete()
+
+    def load(self):
+        jobs = []
+        for doc in self.collection.order_by("due").stream():
+            job = doc.to_dict()
+            jobs.append((doc.id, job["type"], job.get("payload", {}), job["due"]))
+        return jobs
+
+
+class DelayedJobs:
+    """
+    Persistent delayed jobs run by the shared scheduler.
+
+    A job is written to the store before it is queued and deleted once its
+    handler succeeded or it was removed, so jobs that were pending when the
+    service stopped are queued again by start().
+    """
+
+    def __init__(self, store, scheduler):
+        self.store = store
+        self.scheduler = scheduler
+        self.handlers = {}
+        self.started = False
+
+    def register(self, job_type, handler):
+        """Run handler(payload) for jobs of job_type"""
+        self.handlers[job_type] = handler
+
+    def add(self, job_id, job_type, payload, delay):
+        due = time.time() + delay
+        self.store.save(job_id, job_type, payload, due)
+        self.scheduler.schedule_at(job_id, due, self._run, job_id, job_type, payload, due)
+
+    def remove(self, job_id):
+        """Drop a job that is no longer needed"""
+        self.scheduler.cancel(job_id)
+        self.store.delete(job_id)
+
+    def start(self):
+        """Queue the stored jobs, spreading overdue ones over catch-up batches"""
+        if self.started:
+            return
+        self.started = True
+        now = time.time()
+        overdue = 0
+        jobs = self.store.load()
+        for job_id, job_type, payload, due in jobs:
+            run_at = due
+            if due <= now:
+                run_at = now + (overdue // JOBS_CATCHUP_BATCH_SIZE) * JOBS_CATCHUP_INTERVAL
+                overdue += 1
+            self.scheduler.schedule_at(job_id, run_at, self._run, job_id, job_type, payload, due)
+        print(f"Loaded {len(jobs)} delayed jobs, {overdue} overdue")
+
+    def _run(self, job_id, job_type, payload, due):
+        handler = self.handlers.get(job_type)
+        if handler is None:
+            print(f"No handler for job {job_id} of type {job_type}, dropping it")
+            self.store.delete(job_id, due)
+            return None
+        try:
+            handler(payload)
+        except Exception as e:
+            print(f"Error in delayed job {job_id}: {str(e)}")
+            return JOBS_RETRY_DELAY
+        self.store.delete(job_id, due)
+        return None
+
+
+_delayed_jobs = None
+_delayed_jobs_lock = threading.Lock()
+
+
+def get_delayed_jobs():
+    """Return the process-wide delayed job queue"""
+    global _delayed_jobs
+    if _delayed_jobs is None:
+        with _delayed_jobs_lock:
+            if _delayed_jobs is None:
+                if JOBS_STORE == 'firestore':
+                    store = FirestoreJobStore(JOBS_COLLECTION)
+                else:
+                    store = SqliteJobStore(JOBS_DB_PATH)
+                _delayed_jobs = DelayedJobs(store, get_scheduler())
+    return _delayed_jobs
@@ -0,0 +1,128 @@
+import os
+
+import numpy as np
+
+try:
+    from scipy.optimize import linear_sum_assignment
+except ImportError:
+    linear_sum_assignment = None
+
+# Batches with at most this many orders or drivers are solved optimally,
+# larger ones greedily (nearest pair first)
+MATCH_OPTIMAL_MAX = int(os.environ.get('MATCH_OPTIMAL_MAX', 200))
+
+# Cost of an order/driver pair that cannot be matched, kept finite so the
+# solvers never do arithmetic on inf
+INFEASIBLE = 1e9
+
+
+def build_cost_matrix(order_restaurants, driver_ids, distances):
+    """
+    Cost matrix of orders (rows) by drivers (columns).
+    distances maps restaurant_id -> {driver_id: distance}, pairs without a
+    distance are INFEASIBLE. One row is built per restaurant and repeated for
+    its orders with a single fancy-indexing step.
+    """
+    restaurants = list(dict.fromkeys(order_restaurants))
+    column = {driver_id: j for j, driver_id in enumerate(driver_ids)}
+    per_restaurant = np.full((len(restaurants), len(driver_ids)), INFEASIBLE)
+    for i, restaurant_id in enumerate(restaurants):
+        for driver_id, distance in distances.get(restaurant_id, {}).items():
+            j = column.get(driver_id)
+            if j is not None:
+                per_restaurant[i, j] = distance
+    row_of = {restaurant_id: i for i, restaurant_id in enumerate(restaurants)}
+    return per_restaurant[np.array([row_of[r] for r in order_restaurants], dtype=int)]
+
+
+def _hungarian(cost):
+    """Optimal assignment of a rows <= columns cost matrix, O(n^2 m).
+    Shortest augmenting path with potentials, the inner scan over columns is
+    vectorized. Returns the column matched to each row.
+    """
+    n, m = cost.shape
+    u = np.zeros(n + 1)
+    v = np.zeros(m + 1)
+    # p[j]: 1-based row matched to column j, column 0 is the virtual start
+    p = np.zeros(m + 1, dtype=int)
+    way = np.zeros(m + 1, dtype=int)
+
+    for i in range(1, n + 1):
+        p[0] = i
+        j0 = 0
+        minv = np.full(m + 1, np.inf)
+        used = np.zeros(m + 1, dtype=bool)
+        while True:
+            used[j0] = True
+            i0 = p[j0]
+            free = ~used[1:]
+            reduced = cost[i0 - 1] - u[i0] - v[1:]
+            improve = free & (reduced < minv[1:])
+            minv[1:][improve] = reduced[improve]
+            way[1:][improve] = j0
+
+            candidates = np.where(free, minv[1:], np.inf)
+            j1 = int(np.argmin(candidates)) + 1
+            delta = candidates[j1 - 1]
+
+            used_columns = np.nonzero(used)[0]
+            u[p[used_columns]] += delta
+            v[used_columns] -= delta
+            minv[1:][free] -= delta
+
+            j0 = j1
+            if p[j0] == 0:
+                break
+
+        # flip the augmenting path
+        while j0:
+            j1 = way[j0]
+            p[j0] = p[j1]
+            j0 = j1
+
+    assignment = np.full(n, -1, dtype=int)
+    matched = np.nonzero(p[1:])[0]
+    assignment[p[matched + 1] - 1] = matched
+    return assignment
+
+
+def solve_optimal(cost):
+    """Minimum total cost matching, returns [(row, column)]"""
+    if cost.size == 0:
+        return []
+    if linear_sum_assignment is not None:
+        rows, columns = linear_sum_assignment(cost)
+        pairs = zip(rows.tolist(), columns.tolist())
+    elif cost.shape[0] <= cost.shape[1]:
+        pairs = enumerate(_hungarian(cost).tolist())
+    else:
+        pairs = ((row, column) for column, row in enumerate(_hungarian(cost.T).tolist()))
+    return [(row, column) for row, column in pairs if cost[row, column] < INFEASIBLE]
+
+
+def solve_greedy(cost):
+    """Repeatedly match the nearest remaining pair, returns [(row, column)]"""
+    if cost.size == 0:
+        return []
+    n, m = cost.shape
+    row_used = np.zeros(n, dtype=bool)
+    column_used = np.zeros(m, dtype=bool)
+    pairs = []
+    flat = cost.ravel()
+    feasible = np.nonzero(flat < INFEASIBLE)[0]
+    for index in feasible[np.argsort(flat[feasible], kind='stable')].tolist():
+        row, column = divmod(index, m)
+        if row_used[row] or column_used[column]:
+            continue
+        row_used[row] = column_used[column] = True
+        pairs.append((row, column))
+        if len(pairs) == min(n, m):
+            break
+    return pairs
+
+
+def solve(cost, optimal_max=MATCH_OPTIMAL_MAX):
+    """Optimal matching for small batches, greedy for large ones"""
+    if max(cost.shape, default=0) <= optimal_max:
+        return solve_optimal(cost)
+    return solve_greedy(cost)
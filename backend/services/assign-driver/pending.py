@@ -0,0 +1,75 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+class PendingOrders:
+    """
+    Orders waiting for a driver, oldest first, indexed by restaurant.
+
+    claim() hands an order to one driver.available event at a time, so a burst
+    of freed drivers is spread over several pending orders instead of all
+    racing for the oldest one. release() puts a claimed order back in line
+    when it is still waiting after the attempt.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.orders = OrderedDict()
+        self.by_restaurant = {}
+        self.claimed = set()
+
+    def add(self, order_id, restaurant_id):
+        with self.lock:
+            if order_id in self.orders:
+                return
+            self.orders[order_id] = (restaurant_id, time.time())
+            self.by_restaurant.setdefault(restaurant_id, OrderedDict())[order_id] = True
+
+    def remove(self, order_id):
+        with self.lock:
+            self.claimed.discard(order_id)
+            entry = self.orders.pop(order_id, None)
+            if entry is None:
+                return
+            restaurant_orders = self.by_restaurant.get(entry[0])
+            if restaurant_orders is not None:
+                restaurant_orders.pop(order_id, None)
+                if not restaurant_orders:
+                    del self.by_restaurant[entry[0]]
+
+    def claim(self, restaurant_id=None):
+        """Return (order_id, restaurant_id) of the oldest unclaimed order of the
+        restaurant, or of any restaurant when it has none, and mark it claimed.
+        """
+        with self.lock:
+            for candidates in (self.by_restaurant.get(restaurant_id, ()), self.orders):
+                for order_id in candidates:
+                    if order_id not in self.claimed:
+                        self.claimed.add(order_id)
+                        return order_id, self.orders[order_id][0]
+            return None
+
+    def claim_all(self):
+        """Claim every unclaimed order, return [(order_id, restaurant_id)] oldest first"""
+        with self.lock:
+            claimed = [
+                (order_id, entry[0]) for order_id, entry in self.orders.items()
+                if order_id not in self.claimed
+            ]
+            self.claimed.update(order_id for order_id, _ in claimed)
+            return claimed
+
+    def release(self, order_id):
+        with self.lock:
+            self.claimed.discard(order_id)
+
+    def snapshot(self):
+        with self.lock:
+            oldest = next(iter(self.orders.values()), None)
+            return {
+                "pending": len(self.orders),
+                "claimed": len(self.claimed),
+                "restaurants": len(self.by_restaurant),
+                "oldest_wait": None if oldest is None else round(time.time() - oldest[1], 3),
+            }
@@ -0,0 +1,168 @@
+import os
+import socket
+import threading
+import time
+
+from firestore_client import get_firestore_client
+
+# Where driver leases are kept: "firestore" is shared by every replica,
+# "memory" only guards the assignments of this process
+RESERVATION_STORE = os.environ.get(
+    'RESERVATION_STORE', 'firestore' if os.environ.get('FIREBASE_CONFIG') else 'memory'
+)
+RESERVATION_COLLECTION = os.environ.get('RESERVATION_COLLECTION', 'driver_leases')
+
+# A lease outlives the Busy PUT so that other replicas see the driver busy
+# in the driver service before it expires
+DRIVER_LEASE_SECONDS = float(os.environ.get('DRIVER_LEASE_SECONDS', 30))
+
+# Identifies this replica in the leases it holds
+REPLICA_ID = os.environ.get('REPLICA_ID', f"{socket.gethostname()}:{os.getpid()}")
+
+
+class MemoryReservations:
+    """Leases held in this process only"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.leases = {}
+
+    def acquire_many(self, claims, ttl):
+        now = time.time()
+        acquired = []
+        with self.lock:
+            for driver_id, holder in claims:
+                lease = self.leases.get(driver_id)
+                if lease is not None and lease[1] > now and lease[0] != holder:
+                    continue
+                self.leases[driver_id] = (holder, now + ttl)
+                acquired.append(driver_id)
+            # drop expired leases so the table does not grow with the fleet history
+            if len(self.leases) > 1024:
+                self.leases = {d: lease for d, lease in self.leases.items() if lease[1] > now}
+        return acquired
+
+    def release(self, driver_id, holder):
+        with self.lock:
+            lease = self.leases.get(driver_id)
+            if lease is not None and lease[0] == holder:
+                del self.leases[driver_id]
+
+
+class FirestoreReservations:
+    """
+    Leases in a Firestore collection, one document per driver.
+    A lease is taken in a transaction that reads the driver's document and
+    only writes it when the current lease expired or is ours, so two replicas
+    can never both take the same driver.
+    """
+
+    def __init__(self, collection):
+        from firebase_admin import firestore
+
+        self.client = get_firestore_client()
+        self.collection = self.client.collection(collection)
+        self.transactional = firestore.transactional
+
+    def acquire_many(self, claims, ttl):
+        refs = [self.collection.document(str(driver_id)) for driver_id, _ in claims]
+
+        @self.transactional
+        def acquire(transaction):
+            now = time.time()
+            snapshots = {snapshot.id: snapshot for snapshot in self.client.get_all(refs, transaction=transaction)}
+            acquired = []
+            for (driver_id, holder), ref in zip(claims, refs):
+                snapshot = snapshots.get(ref.id)
+                lease = snapshot.to_dict() if snapshot is not None and snapshot.exists else None
+                if lease and lease.get("expires_at", 0) > now and lease.get("holder") != holder:
+                    continue
+                transaction.set(ref, {"holder": holder, "expires_at": now + ttl})
+                acquired.append(driver_id)
+            return acquired
+
+        return acquire(self.client.transaction())
+
+    def release(self, driver_id, holder):
+        ref = self.collection.document(str(driver_id))
+
+        @self.transactional
+        def release(transaction):
+            snapshot = ref.get(transaction=transaction)
+            if snapshot.exists and snapshot.to_dict().get("holder") == holder:
+                transaction.delete(ref)
+
+        release(self.client.transaction())
+
+
+class DriverReservations:
+    """Short compare-and-set leases on drivers, taken before they are set Busy"""
+
+    def __init__(self, store, ttl=DRIVER_LEASE_SECONDS):
+        self.store = store
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.acquired = 0
+        self.conflicts = 0
+        self.errors = 0
+
+    def holder(self, order_id):
+        return f"{REPLICA_ID}:{order_id}"
+
+    def acquire_many(self, claims):
+        """Take leases for [(driver_id, order_id)], return the driver_ids acquired.
+        All drivers are taken in one call to the store.
+        """
+        if not claims:
+            return set()
+        try:
+            acquired = set(self.store.acquire_many(
+                [(driver_id, self.holder(order_id)) for driver_id, order_id in claims], self.ttl
+            ))
+        except Exception as e:
+            print(f"Error acquiring driver leases: {str(e)}")
+            with self.lock:
+                self.errors += 1
+            return set()
+        with self.lock:
+            self.acquired += len(acquired)
+            self.conflicts += len(claims) - len(acquired)
+        return acquired
+
+    def acquire(self, driver_id, order_id):
+        return driver_id in self.acquire_many([(driver_id, order_id)])
+
+    def release(self, driver_id, order_id):
+        """Give a lease back early, when the driver could not be set Busy"""
+        try:
+            self.store.release(driver_id, self.holder(order_id))
+        except Exception as e:
+            print(f"Error releasing lease of driver {driver_id}: {str(e)}")
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                "store": type(self.store).__name__,
+                "lease_seconds": self.ttl,
+                "acquired": self.acquired,
+                "conflicts": self.conflicts,
+                "errors": self.errors,
+            }
+
+
+_reservations = None
+_reservations_lock = threading.Lock()
+
+
+def get_reservations():
+    """Return the process-wide driver reservations"""
+    global _reservations
+    if _reservations is None:
+        with _reservations_lock:
+            if _reservations is None:
+                if RESERVATION_STORE == 'firestore':
+                    store = FirestoreReservations(RESERVATION_COLLECTION)
+                else:
+                    store = MemoryReservations()
+                _reservations = DriverReservations(store)
+    return _reservations
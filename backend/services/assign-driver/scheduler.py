@@ -0,0 +1,221 @@
+import heapq
+import itertools
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+# Worker threads that run due jobs, shared by every scheduled job
+SCHEDULER_WORKERS = int(os.environ.get('SCHEDULER_WORKERS', 4))
+
+
+class _Job:
+    __slots__ = ("key", "due", "seq", "fn", "args", "index")
+
+    def __init__(self, key, due, seq, fn, args):
+        self.key = key
+        self.due = due
+        self.seq = seq
+        self.fn = fn
+        self.args = args
+        self.index = -1
+
+    def __lt__(self, other):
+        return (self.due, self.seq) < (other.due, other.seq)
+
+
+class IndexedHeap:
+    """
+    Min-heap of jobs ordered by due time, indexed by key.
+    Each job remembers its position, so removing or rescheduling a job by key
+    is O(log n) instead of a linear scan.
+    """
+
+    def __init__(self):
+        self.heap = []
+        self.jobs = {}
+
+    def __len__(self):
+        return len(self.heap)
+
+    def __contains__(self, key):
+        return key in self.jobs
+
+    def peek(self):
+        return self.heap[0] if self.heap else None
+
+    def push(self, job):
+        self.remove(job.key)
+        job.index = len(self.heap)
+        self.heap.append(job)
+        self.jobs[job.key] = job
+        self._sift_up(job.index)
+
+    def pop(self):
+        job = self.heap[0]
+        self._remove_at(0)
+        return job
+
+    def remove(self, key):
+        job = self.jobs.get(key)
+        if job is None:
+            return None
+        self._remove_at(job.index)
+        return job
+
+    def _remove_at(self, index):
+        job = self.heap[index]
+        last = self.heap.pop()
+        del self.jobs[job.key]
+        job.index = -1
+        if index < len(self.heap):
+            last.index = index
+            self.heap[index] = last
+            self._sift_up(index)
+            self._sift_down(last.index)
+
+    def _swap(self, i, j):
+        self.heap[i], self.heap[j] = self.heap[j], self.heap[i]
+        self.heap[i].index = i
+        self.heap[j].index = j
+
+    def _sift_up(self, index):
+        while index > 0:
+            parent = (index - 1) // 2
+            if not self.heap[index] < self.heap[parent]:
+                break
+            self._swap(index, parent)
+            index = parent
+
+    def _sift_down(self, index):
+        size = len(self.heap)
+        while True:
+            smallest = index
+            for child in (2 * index + 1, 2 * index + 2):
+                if child < size and self.heap[child] < self.heap[smallest]:
+                    smallest = child
+            if smallest == index:
+                break
+            self._swap(index, smallest)
+            index = smallest
+
+
+class Scheduler:
+    """
+    Runs delayed jobs from one dispatcher thread and a small worker pool.
+
+    Jobs are keyed: scheduling a key that is already queued replaces it, and
+    cancel(key) removes it. A job may return a number of seconds to run again
+    after that delay, which is how periodic checks are written; returning
+    None ends it.
+    """
+
+    def __init__(self, workers=SCHEDULER_WORKERS, name="scheduler"):
+        self.name = name
+        self.workers = workers
+        self.queue = IndexedHeap()
+        self.condition = threading.Condition()
+        self.sequence = itertools.count()
+        self.running = {}
+        self.executor = None
+        self.thread = None
+        self.executed = 0
+        self.failed = 0
+        self.last_lag = 0.0
+        self.max_lag = 0.0
+
+    def start(self):
+        with self.condition:
+            if self.thread is not None:
+                return
+            self.executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix=self.name)
+            self.thread = threading.Thread(target=self._dispatch, name=f"{self.name}-dispatcher", daemon=True)
+            self.thread.start()
+        print(f"Scheduler {self.name} started with {self.workers} workers")
+
+    def schedule(self, key, delay, fn, *args):
+        """Run fn(*args) in delay seconds, replacing any job queued under key."""
+        self.schedule_at(key, time.time() + delay, fn, *args)
+
+    def schedule_at(self, key, due, fn, *args):
+        """Run fn(*args) at the epoch time due, replacing any job queued under key."""
+        self.start()
+        with self.condition:
+            self.queue.push(_Job(key, due, next(self.sequence), fn, args))
+            # a running job with the same key must not reschedule over this one
+            if key in self.running:
+                self.running[key] = False
+            self.condition.notify()
+
+    def cancel(self, key):
+        """Remove the job queued under key, return True if there was one."""
+        with self.condition:
+            if key in self.running:
+                self.running[key] = False
+            return self.queue.remove(key) is not None
+
+    def __contains__(self, key):
+        with self.condition:
+            return key in self.queue or key in self.running
+
+    def _dispatch(self):
+        while True:
+            with self.condition:
+                job = self.queue.peek()
+                now = time.time()
+                if job is None or job.due > now:
+                    self.condition.wait(None if job is None else job.due - now)
+                    continue
+                self.queue.pop()
+                self.running[job.key] = True
+                lag = now - job.due
+                self.last_lag = lag
+                self.max_lag = max(self.max_lag, lag)
+            self.executor.submit(self._run, job)
+
+    def _run(self, job):
+        delay = None
+        try:
+            delay = job.fn(*job.args)
+        except Exception as e:
+            print(f"Error in scheduled job {job.key}: {str(e)}")
+            with self.condition:
+                self.failed += 1
+        with self.condition:
+            self.executed += 1
+            keep = self.running.pop(job.key, False)
+            # skip rescheduling if the job was cancelled or replaced meanwhile
+            if keep and delay is not None and job.key not in self.queue:
+                self.queue.push(_Job(job.key, time.time() + delay, next(self.sequence), job.fn, job.args))
+                self.condition.notify()
+
+    def snapshot(self):
+        with self.condition:
+            job = self.queue.peek()
+            now = time.time()
+            return {
+                "queued": len(self.queue),
+                "running": len(self.running),
+                "workers": self.workers,
+                "next_due_in": None if job is None else round(job.due - now, 3),
+                # how far behind the oldest due job currently is
+                "lag": 0.0 if job is None else round(max(0.0, now - job.due), 3),
+                "last_lag": round(self.last_lag, 3),
+                "max_lag": round(self.max_lag, 3),
+                "executed": self.executed,
+                "failed": self.failed,
+            }
+
+
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+
+def get_scheduler():
+    """Return the process-wide scheduler"""
+    global _scheduler
+    if _scheduler is None:
+        with _scheduler_lock:
+            if _scheduler is None:
+                _scheduler = Scheduler()
+    return _scheduler
@@ -0,0 +1,11 @@
+import os
+import sys
+import tempfile
+
+# the service modules import each other as top-level modules, as in the image
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# app.py is imported by some tests: keep its jobs and messages out of the
+# working directory and away from a real broker
+os.environ.setdefault('JOBS_DB_PATH', os.path.join(tempfile.mkdtemp(), 'jobs.db'))
+os.environ.setdefault('AMQP_BACKEND', 'memory')
@@ -0,0 +1,175 @@
+"""
+Order auto-cancellation job of assign-driver, against fake order, wallet and
+customer services. Run from backend/services:
+
+    python -m pytest assign-driver/tests
+"""
+
+import copy
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+import app
+from jobs import DelayedJobs, SqliteJobStore
+
+ORDER_ID = "order-1"
+CUSTOMER_ID = "customer-1"
+
+
+class FakeServices:
+    """The order, wallet and customer services as seen through invoke_http"""
+
+    def __init__(self):
+        self.order = {
+            "orderId": ORDER_ID,
+            "customerId": CUSTOMER_ID,
+            "status": "PREPARING",
+            "driverStatus": "PENDING",
+            "paymentStatus": "PAID",
+            "price": 20.0,
+            "deliveryFee": 2.0,
+            "items": [],
+            "version": "v1",
+        }
+        self.balance = 5.0
+        self.down = set()
+
+    def invoke_http(self, url, method="GET", json=None, headers=None, **kwargs):
+        for service in self.down:
+            if url.startswith(service):
+                return {"code": 503, "message": f"invocation of service fails: {url}."}
+
+        if url == f"{app.ORDER_URL}/orders/{ORDER_ID}" and method == "GET":
+            return copy.deepcopy(self.order)
+        if url == f"{app.ORDER_URL}/orders/{ORDER_ID}/status" and method == "PUT":
+            if headers and headers.get("If-Match") != self.order["version"]:
+                return {"error": "Order was modified", "code": 412}
+            self.order.update(json)
+            self.order["version"] = "v" + str(int(self.order["version"][1:]) + 1)
+            return dict(json, id=ORDER_ID, version=self.order["version"])
+        if url == f"{app.WALLET_URL}/wallet/{CUSTOMER_ID}":
+            if method == "PUT":
+                self.balance = json["balance"]
+            return {"balance": self.balance}
+        if url == f"{app.CUSTOMER_URL}/customers/{CUSTOMER_ID}":
+            return {"email": "customer@example.com"}
+        raise AssertionError(f"unexpected call {method} {url}")
+
+
+class FakeScheduler:
+
+    def __init__(self):
+        self.queued = {}
+
+    def schedule_at(self, key, due, fn, *args):
+        self.queued[key] = (fn, args)
+
+    def cancel(self, key):
+        return self.queued.pop(key, None) is not None
+
+
+class OrderCancellationTest(unittest.TestCase):
+
+    def setUp(self):
+        self.services = FakeServices()
+        patcher = mock.patch.object(app, "invoke_http", self.services.invoke_http)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.store = SqliteJobStore(os.path.join(directory, "jobs.db"))
+        self.scheduler = FakeScheduler()
+        self.jobs = DelayedJobs(self.store, self.scheduler)
+        self.jobs.register("cancel_order", app.run_order_cancellation)
+        self.jobs.add(f"cancel:{ORDER_ID}", "cancel_order", {"order_id": ORDER_ID}, 0)
+
+    def run_job(self):
+        """Run the stored cancellation, return the delay before it is retried"""
+        fn, args = self.scheduler.queued[f"cancel:{ORDER_ID}"]
+        return fn(*args)
+
+    def stored(self):
+        return [job_id for job_id, _, _, _ in self.store.load()]
+
+    def test_waiting_order_is_cancelled_and_refunded(self):
+        self.assertIsNone(self.run_job())
+
+        self.assertEqual(self.services.order["status"], "CANCELLED")
+        self.assertEqual(self.services.order["driverStatus"], "CANCELLED")
+        self.assertEqual(self.services.order["paymentStatus"], "REFUNDED")
+        self.assertEqual(self.services.balance, 25.0)
+        self.assertEqual(self.stored(), [])
+
+    def test_order_with_a_driver_is_left_alone(self):
+        self.services.order.update(driverStatus="ASSIGNED", driverId="driver-1")
+
+        self.assertIsNone(self.run_job())
+
+        self.assertEqual(self.services.order["status"], "PREPARING")
+        self.assertEqual(self.services.balance, 5.0)
+        self.assertEqual(self.stored(), [])
+
+    def test_job_stays_stored_when_the_order_cannot_be_read(self):
+        self.services.down.add(app.ORDER_URL)
+
+        self.assertIsNotNone(self.run_job())
+        self.assertEqual(self.stored(), [f"cancel:{ORDER_ID}"])
+
+        self.services.down.clear()
+        self.assertIsNone(self.run_job())
+        self.assertEqual(self.services.order["status"], "CANCELLED")
+        self.assertEqual(self.stored(), [])
+
+    def test_job_stays_stored_when_the_cancellation_fails(self):
+        real_invoke = self.services.invoke_http
+
+        def status_put_fails(url, method="GET", **kwargs):
+            if method == "PUT" and url.startswith(app.ORDER_URL):
+                return {"code": 500, "message": "invocation of service fails."}
+            return real_invoke(url, method, **kwargs)
+
+        with mock.patch.object(app, "invoke_http", status_put_fails):
+            self.assertIsNotNone(self.run_job())
+
+        self.assertEqual(self.services.order["status"], "PREPARING")
+        self.assertEqual(self.stored(), [f"cancel:{ORDER_ID}"])
+
+    def test_order_assigned_during_the_cancellation_is_not_refunded(self):
+        real_invoke = self.services.invoke_http
+
+        def assigned_first(url, method="GET", **kwargs):
+            if method == "PUT" and url.startswith(app.ORDER_URL) and self.services.order["driverStatus"] == "PENDING":
+                # a driver is assigned just before the cancellation arrives
+                self.services.order.update(driverStatus="ASSIGNED", driverId="driver-1", version="v9")
+            return real_invoke(url, method, **kwargs)
+
+        with mock.patch.object(app, "invoke_http", assigned_first):
+            self.assertIsNone(self.run_job())
+
+        self.assertEqual(self.services.order["status"], "PREPARING")
+        self.assertEqual(self.services.order["paymentStatus"], "PAID")
+        self.assertEqual(self.services.balance, 5.0)
+        self.assertEqual(self.stored(), [])
+
+    def test_failed_refund_is_retried_once_the_wallet_is_back(self):
+        self.services.down.add(app.WALLET_URL)
+
+        self.assertIsNotNone(self.run_job())
+        self.assertEqual(self.services.order["status"], "CANCELLED")
+        self.assertEqual(self.services.order["paymentStatus"], "REFUND_PENDING")
+        self.assertEqual(self.services.balance, 5.0)
+        self.assertEqual(self.stored(), [f"cancel:{ORDER_ID}"])
+
+        self.services.down.clear()
+        self.assertIsNone(self.run_job())
+        self.assertEqual(self.services.order["paymentStatus"], "REFUNDED")
+        self.assertEqual(self.services.balance, 25.0)
+        self.assertEqual(self.stored(), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,101 @@
+"""
+Freed drivers reaching pending orders in assign-driver. Run from
+backend/services:
+
+    python -m pytest assign-driver/tests
+"""
+
+import unittest
+from unittest import mock
+
+import app
+from driver_index import DriverIndex
+from pending import PendingOrders
+
+RESTAURANT_ID = "restaurant-1"
+
+
+def driver(driver_id, status="Available", distance=1.0):
+    return {"DriverId": driver_id, "DriverStatus": status, "Distance": distance}
+
+
+class FakeScheduler:
+
+    def __init__(self):
+        self.queued = {}
+
+    def schedule(self, key, delay, fn, *args):
+        self.queued[key] = (delay, fn, args)
+
+    def __contains__(self, key):
+        return key in self.queued
+
+
+class DriverIndexRefreshTest(unittest.TestCase):
+
+    def setUp(self):
+        self.drivers = [driver(1, "Busy"), driver(2)]
+        self.found = []
+        self.index = DriverIndex(lambda restaurant_id: self.drivers, on_available=lambda *args: self.found.append(args))
+
+    def test_first_load_of_a_restaurant_reports_nothing(self):
+        self.index.refresh(RESTAURANT_ID)
+        self.assertEqual(self.found, [])
+
+    def test_refresh_reports_drivers_freed_since_the_last_one(self):
+        self.index.refresh(RESTAURANT_ID)
+        self.drivers = [driver(1), driver(2)]
+        self.index.refresh(RESTAURANT_ID)
+        self.assertEqual(self.found, [(RESTAURANT_ID, [1])])
+
+        # still available, already reported
+        self.index.refresh(RESTAURANT_ID)
+        self.assertEqual(len(self.found), 1)
+
+    def test_failed_callback_does_not_fail_the_refresh(self):
+        def fail(restaurant_id, driver_ids):
+            raise ValueError("boom")
+
+        index = DriverIndex(lambda restaurant_id: self.drivers, on_available=fail)
+        index.refresh(RESTAURANT_ID)
+        self.drivers = [driver(1), driver(2)]
+        self.assertTrue(index.refresh(RESTAURANT_ID))
+
+
+class FreedDriverTest(unittest.TestCase):
+
+    def setUp(self):
+        self.scheduler = FakeScheduler()
+        self.pending = PendingOrders()
+        self.published = []
+        for name, value in [
+            ("get_scheduler", lambda: self.scheduler),
+            ("pending_orders", self.pending),
+            ("publish_driver_available", lambda *args: self.published.append(args)),
+        ]:
+            patcher = mock.patch.object(app, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_refresh_finding_drivers_checks_one_pending_order_per_driver(self):
+        for order_id in ("order-1", "order-2", "order-3"):
+            self.pending.add(order_id, RESTAURANT_ID)
+
+        app.on_drivers_found(RESTAURANT_ID, [1, 2])
+
+        self.assertEqual(sorted(self.scheduler.queued), ["assign:order-1", "assign:order-2"])
+        self.assertEqual({delay for delay, _, _ in self.scheduler.queued.values()}, {0})
+
+    def test_released_driver_is_announced(self):
+        with mock.patch.object(app, "invoke_http", return_value={"Success": True}):
+            app.release_driver(1, "order-1", RESTAURANT_ID, driver(1, "Busy"))
+        self.assertEqual(self.published, [(1, RESTAURANT_ID)])
+
+    def test_driver_left_busy_is_not_announced(self):
+        with mock.patch.object(app, "invoke_http", return_value={"code": 503, "message": "down"}):
+            app.release_driver(1, "order-1", RESTAURANT_ID, driver(1, "Busy"))
+        self.assertEqual(self.published, [])
+
+
+if __name__ == "__main__":
+    unittest.main()
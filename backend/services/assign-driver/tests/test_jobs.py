@@ -0,0 +1,115 @@
+"""
+Durable delayed jobs of assign-driver. Run from backend/services:
+
+    python -m pytest assign-driver/tests
+"""
+
+import os
+import shutil
+import tempfile
+import time
+import unittest
+from unittest import mock
+
+import jobs
+from jobs import DelayedJobs, SqliteJobStore
+
+
+class FakeScheduler:
+    """Records what is scheduled instead of running it"""
+
+    def __init__(self):
+        self.queued = {}
+
+    def schedule_at(self, key, due, fn, *args):
+        self.queued[key] = (due, fn, args)
+
+    def cancel(self, key):
+        return self.queued.pop(key, None) is not None
+
+    def run(self, key):
+        _, fn, args = self.queued.pop(key)
+        return fn(*args)
+
+
+class DelayedJobsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.path = os.path.join(self.directory, "jobs.db")
+        self.scheduler = FakeScheduler()
+        self.jobs = self.new_jobs()
+        self.handled = []
+        self.jobs.register("cancel_order", self.handled.append)
+
+    def new_jobs(self):
+        """A DelayedJobs on the same file, as after a restart"""
+        return DelayedJobs(SqliteJobStore(self.path), self.scheduler)
+
+    def stored(self):
+        return [job_id for job_id, _, _, _ in SqliteJobStore(self.path).load()]
+
+    def test_job_is_stored_until_its_handler_succeeds(self):
+        self.jobs.add("cancel:1", "cancel_order", {"order_id": "1"}, 60)
+        self.assertEqual(self.stored(), ["cancel:1"])
+
+        self.assertIsNone(self.scheduler.run("cancel:1"))
+        self.assertEqual(self.handled, [{"order_id": "1"}])
+        self.assertEqual(self.stored(), [])
+
+    def test_job_whose_handler_fails_stays_stored_and_is_retried(self):
+        def fail(payload):
+            raise Exception("order service unavailable")
+
+        self.jobs.register("cancel_order", fail)
+        self.jobs.add("cancel:1", "cancel_order", {"order_id": "1"}, 60)
+
+        self.assertEqual(self.scheduler.run("cancel:1"), jobs.JOBS_RETRY_DELAY)
+        self.assertEqual(self.stored(), ["cancel:1"])
+
+    def test_removed_job_is_not_run(self):
+        self.jobs.add("cancel:1", "cancel_order", {"order_id": "1"}, 60)
+        self.jobs.remove("cancel:1")
+        self.assertNotIn("cancel:1", self.scheduler.queued)
+        self.assertEqual(self.stored(), [])
+
+    def test_finished_run_keeps_a_job_added_again_since(self):
+        self.jobs.add("cancel:1", "cancel_order", {"order_id": "1"}, 60)
+        _, fn, args = self.scheduler.queued["cancel:1"]
+        self.jobs.add("cancel:1", "cancel_order", {"order_id": "1"}, 120)
+
+        fn(*args)
+        self.assertEqual(self.stored(), ["cancel:1"])
+
+    def test_stored_jobs_are_queued_again_after_a_restart(self):
+        self.jobs.add("cancel:1", "cancel_order", {"order_id": "1"}, 60)
+        due = self.scheduler.queued["cancel:1"][0]
+        self.scheduler.queued.clear()
+
+        restarted = self.new_jobs()
+        restarted.register("cancel_order", self.handled.append)
+        restarted.start()
+
+        self.assertEqual(self.scheduler.queued["cancel:1"][0], due)
+        self.scheduler.run("cancel:1")
+        self.assertEqual(self.handled, [{"order_id": "1"}])
+        self.assertEqual(self.stored(), [])
+
+    def test_overdue_jobs_are_spread_over_catch_up_batches(self):
+        store = SqliteJobStore(self.path)
+        past = time.time() - 600
+        for i in range(5):
+            store.save(f"cancel:{i}", "cancel_order", {"order_id": str(i)}, past + i)
+
+        with mock.patch.object(jobs, "JOBS_CATCHUP_BATCH_SIZE", 2), \
+                mock.patch.object(jobs, "JOBS_CATCHUP_INTERVAL", 10):
+            started = time.time()
+            self.new_jobs().start()
+
+        offsets = [round(self.scheduler.queued[f"cancel:{i}"][0] - started) for i in range(5)]
+        self.assertEqual(offsets, [0, 0, 10, 10, 20])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,57 @@
+"""
+Batched order reads of assign-driver. Run from backend/services:
+
+    python -m pytest assign-driver/tests
+"""
+
+import unittest
+from unittest import mock
+
+import app
+
+
+class GetOrdersTest(unittest.TestCase):
+
+    def setUp(self):
+        self.calls = []
+        self.reply = None
+
+    def invoke_http(self, url, method="GET", json=None, **kwargs):
+        self.calls.append((method, url, json["ids"]))
+        if self.reply is not None:
+            return self.reply
+        # the order service answers in no particular order
+        return {
+            "orders": [{"orderId": order_id, "version": "v1"} for order_id in reversed(json["ids"]) if order_id != "gone"],
+            "missing": ["gone"] if "gone" in json["ids"] else [],
+        }
+
+    def get_orders(self, order_ids):
+        with mock.patch.object(app, "invoke_http", self.invoke_http):
+            return app.get_orders(order_ids)
+
+    def test_orders_come_back_in_the_order_of_ids_with_their_versions(self):
+        orders = self.get_orders(["1", "gone", "2"])
+
+        self.assertEqual(self.calls, [("POST", f"{app.ORDER_URL}/orders:batchGet", ["1", "gone", "2"])])
+        self.assertEqual([order.get("orderId") for order in orders], ["1", None, "2"])
+        self.assertEqual(orders[0]["version"], "v1")
+        self.assertTrue(app.order_read_failed(orders[1]))
+
+    def test_ids_are_split_into_batches_the_order_service_accepts(self):
+        with mock.patch.object(app, "ORDER_BATCH_GET_MAX", 2):
+            orders = self.get_orders(["1", "2", "3"])
+
+        self.assertEqual([ids for _, _, ids in self.calls], [["1", "2"], ["3"]])
+        self.assertEqual([order["orderId"] for order in orders], ["1", "2", "3"])
+
+    def test_failed_batch_fails_every_order_in_it(self):
+        self.reply = {"code": 503, "message": "invocation of service fails."}
+        orders = self.get_orders(["1", "2"])
+
+        self.assertEqual(len(orders), 2)
+        self.assertTrue(all(app.order_read_failed(order) for order in orders))
+
+
+if __name__ == "__main__":
+    unittest.main()
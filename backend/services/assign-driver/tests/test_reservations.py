@@ -0,0 +1,100 @@
+"""
+Driver leases of assign-driver. Run from backend/services:
+
+    python -m pytest assign-driver/tests
+"""
+
+import unittest
+from unittest import mock
+
+import reservations
+from reservations import DriverReservations, MemoryReservations
+
+
+class FakeClock:
+
+    def __init__(self, now=1000.0):
+        self.now = now
+
+    def time(self):
+        return self.now
+
+
+class MemoryReservationsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = FakeClock()
+        patcher = mock.patch.object(reservations, "time", self.clock)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.store = MemoryReservations()
+
+    def test_leased_driver_is_not_given_to_another_holder(self):
+        self.assertEqual(self.store.acquire_many([(1, "a"), (2, "a")], 30), [1, 2])
+        self.assertEqual(self.store.acquire_many([(1, "b"), (3, "b")], 30), [3])
+
+    def test_holder_takes_its_own_lease_again(self):
+        self.store.acquire_many([(1, "a")], 30)
+        self.clock.now += 20
+        self.assertEqual(self.store.acquire_many([(1, "a")], 30), [1])
+
+        # renewed, still held past the first expiry
+        self.clock.now += 20
+        self.assertEqual(self.store.acquire_many([(1, "b")], 30), [])
+
+    def test_expired_lease_can_be_taken(self):
+        self.store.acquire_many([(1, "a")], 30)
+        self.clock.now += 31
+        self.assertEqual(self.store.acquire_many([(1, "b")], 30), [1])
+
+    def test_only_the_holder_releases_a_lease(self):
+        self.store.acquire_many([(1, "a")], 30)
+
+        self.store.release(1, "b")
+        self.assertEqual(self.store.acquire_many([(1, "b")], 30), [])
+
+        self.store.release(1, "a")
+        self.assertEqual(self.store.acquire_many([(1, "b")], 30), [1])
+
+
+class FailingStore:
+
+    def acquire_many(self, claims, ttl):
+        raise ConnectionError("store unavailable")
+
+    def release(self, driver_id, holder):
+        raise ConnectionError("store unavailable")
+
+
+class DriverReservationsTest(unittest.TestCase):
+
+    def test_orders_compete_for_a_driver(self):
+        leases = DriverReservations(MemoryReservations())
+
+        self.assertEqual(leases.acquire_many([(1, "order-1"), (2, "order-1")]), {1, 2})
+        self.assertFalse(leases.acquire(1, "order-2"))
+        self.assertTrue(leases.acquire(1, "order-1"))
+
+        leases.release(1, "order-1")
+        self.assertTrue(leases.acquire(1, "order-2"))
+
+        snapshot = leases.snapshot()
+        self.assertEqual(snapshot["store"], "MemoryReservations")
+        self.assertEqual((snapshot["acquired"], snapshot["conflicts"]), (4, 1))
+
+    def test_failing_store_acquires_nothing(self):
+        leases = DriverReservations(FailingStore())
+
+        self.assertEqual(leases.acquire_many([(1, "order-1")]), set())
+        # a failed release is left to expire
+        leases.release(1, "order-1")
+        self.assertEqual(leases.snapshot()["errors"], 1)
+
+    def test_no_claims_do_not_call_the_store(self):
+        leases = DriverReservations(FailingStore())
+        self.assertEqual(leases.acquire_many([]), set())
+        self.assertEqual(leases.snapshot()["errors"], 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,157 @@
+"""
+Indexed heap and scheduler of assign-driver. Run from backend/services:
+
+    python -m pytest assign-driver/tests
+"""
+
+import random
+import threading
+import time
+import unittest
+
+from scheduler import IndexedHeap, Scheduler, _Job
+
+
+def wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            raise AssertionError("timed out")
+        time.sleep(0.01)
+
+
+def job(key, due, seq=0):
+    return _Job(key, due, seq, None, ())
+
+
+class IndexedHeapTest(unittest.TestCase):
+
+    def assertConsistent(self, heap):
+        for index, item in enumerate(heap.heap):
+            self.assertEqual(item.index, index)
+            self.assertIs(heap.jobs[item.key], item)
+            for child in (2 * index + 1, 2 * index + 2):
+                if child < len(heap.heap):
+                    self.assertFalse(heap.heap[child] < item)
+        self.assertEqual(len(heap.jobs), len(heap.heap))
+
+    def test_pops_in_due_order(self):
+        heap = IndexedHeap()
+        for key, due in [("c", 3), ("a", 1), ("d", 4), ("b", 2)]:
+            heap.push(job(key, due))
+        self.assertEqual([heap.pop().key for _ in range(4)], ["a", "b", "c", "d"])
+        self.assertIsNone(heap.peek())
+
+    def test_remove_by_key(self):
+        heap = IndexedHeap()
+        for key, due in [("a", 1), ("b", 2), ("c", 3)]:
+            heap.push(job(key, due))
+        removed = heap.remove("a")
+
+        self.assertEqual(removed.key, "a")
+        self.assertEqual(removed.index, -1)
+        self.assertNotIn("a", heap)
+        self.assertIsNone(heap.remove("a"))
+        self.assertEqual(heap.peek().key, "b")
+        self.assertConsistent(heap)
+
+    def test_push_replaces_the_job_of_the_same_key(self):
+        heap = IndexedHeap()
+        heap.push(job("a", 1))
+        heap.push(job("b", 2))
+        heap.push(job("a", 3))
+
+        self.assertEqual(len(heap), 2)
+        self.assertEqual([heap.pop().key for _ in range(2)], ["b", "a"])
+
+    def test_stays_consistent_under_random_operations(self):
+        rng = random.Random(7)
+        heap = IndexedHeap()
+        expected = {}
+        for seq in range(2000):
+            key = rng.randrange(50)
+            action = rng.random()
+            if action < 0.5:
+                due = rng.random()
+                heap.push(job(key, due, seq))
+                expected[key] = due
+            elif action < 0.8:
+                heap.remove(key)
+                expected.pop(key, None)
+            elif heap:
+                popped = heap.pop()
+                self.assertEqual(popped.due, min(expected.values()))
+                del expected[popped.key]
+            self.assertConsistent(heap)
+
+
+class SchedulerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.scheduler = Scheduler(workers=2, name="test-scheduler")
+
+    def test_runs_jobs_when_due(self):
+        ran = threading.Event()
+        self.scheduler.schedule("job", 0.05, ran.set)
+        self.assertFalse(ran.is_set())
+        self.assertTrue(ran.wait(2))
+
+    def test_cancelled_job_does_not_run(self):
+        ran = []
+        self.scheduler.schedule("job", 0.1, ran.append, 1)
+        self.assertTrue(self.scheduler.cancel("job"))
+        self.assertFalse(self.scheduler.cancel("job"))
+        time.sleep(0.2)
+        self.assertEqual(ran, [])
+
+    def test_rescheduling_a_key_replaces_its_job(self):
+        ran = []
+        self.scheduler.schedule("job", 0.05, ran.append, "first")
+        self.scheduler.schedule("job", 0.1, ran.append, "second")
+        wait_for(lambda: ran)
+        time.sleep(0.1)
+        self.assertEqual(ran, ["second"])
+
+    def test_returned_delay_runs_the_job_again(self):
+        runs = []
+
+        def check():
+            runs.append(1)
+            return 0.01 if len(runs) < 3 else None
+
+        self.scheduler.schedule("check", 0, check)
+        wait_for(lambda: len(runs) == 3)
+        time.sleep(0.05)
+        self.assertEqual(len(runs), 3)
+        self.assertNotIn("check", self.scheduler)
+
+    def test_job_cancelled_while_running_is_not_rescheduled(self):
+        started = threading.Event()
+        release = threading.Event()
+        runs = []
+
+        def check():
+            runs.append(1)
+            started.set()
+            release.wait(2)
+            return 0.01
+
+        self.scheduler.schedule("check", 0, check)
+        self.assertTrue(started.wait(2))
+        self.scheduler.cancel("check")
+        release.set()
+        wait_for(lambda: "check" not in self.scheduler)
+        time.sleep(0.05)
+        self.assertEqual(len(runs), 1)
+
+    def test_failing_job_is_counted(self):
+        def fail():
+            raise ValueError("boom")
+
+        self.scheduler.schedule("fail", 0, fail)
+        wait_for(lambda: self.scheduler.snapshot()["executed"] == 1)
+        self.assertEqual(self.scheduler.snapshot()["failed"], 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
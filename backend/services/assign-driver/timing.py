@@ -0,0 +1,20 @@
+import time
+
+
+class StepTimer:
+    """Wall time of the consecutive steps of a request, for latency logs"""
+
+    def __init__(self):
+        self.started = self.last = time.perf_counter()
+        self.steps = []
+
+    def step(self, name):
+        """Close the step that just finished under name"""
+        now = time.perf_counter()
+        self.steps.append((name, now - self.last))
+        self.last = now
+
+    def __str__(self):
+        parts = [f"{name}={elapsed * 1000:.0f}ms" for name, elapsed in self.steps]
+        parts.append(f"total={(self.last - self.started) * 1000:.0f}ms")
+        return " ".join(parts)
@@ -3,6 +3,7 @@ from flask_cors import CORS
 import os
 import json
 from invokes import invoke_http
+from invokes.stats import stats_blueprint
 from firebase_admin import credentials, firestore, initialize_app
 import pika
 from datetime import datetime
@@ -11,6 +12,7 @@ import rabbitmq.amqp_lib as amqp_lib
 
 app = Flask(__name__)
 CORS(app)
+app.register_blueprint(stats_blueprint)
 
 # Initialize Firebase
 firebase_config = os.environ.get('FIREBASE_CONFIG')
@@ -31,24 +33,21 @@ CUSTOMER_URL = os.environ.get('customerURL') or "http://customer-service:4000"
 
 def publish_message(routing_key, message):
     try:
-        print("  Connecting to AMQP broker...")
-        connection, channel = amqp_lib.connect(
+        # Hand the message to the background publisher
+        queued = amqp_lib.publish_async(
             hostname=RABBITMQ_HOST,
             port=RABBITMQ_PORT,
-            exchange_name='order_topic',
+            exchange_name=EXCHANGE_NAME,
             exchange_type='topic',
-        )
-        
-        # Publish the message
-        channel.basic_publish(
-            exchange=EXCHANGE_NAME,
             routing_key=routing_key,
-            body=json.dumps(message),
+            body=message,
             properties=pika.BasicProperties(delivery_mode=2)
         )
+        if not queued:
+            print(f"Dropped message to {routing_key}, publish buffer is full")
+            return
         
-        connection.close()
-        print(f"Published message to {routing_key}: {message}")
+        print(f"Queued message to {routing_key}: {message}")
         
     except Exception as e:
         print(f"Error publishing message: {str(e)}")
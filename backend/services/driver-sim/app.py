@@ -0,0 +1,254 @@
+"""
+Local stand-in for the OutSystems driver service (DRIVER_URL), for load tests.
+
+Serves the endpoints assign-driver and reject-delivery call, with the same
+response shapes:
+- GET /status/<restaurant_id>: every driver with its Distance to the restaurant
+- PUT /drivers: update a driver's status
+- GET /getDriversById?Id=<driver_id>
+
+Orders and customers can be stubbed too (SIM_STUB_ORDERS), so that pointing
+orderURL and customerURL at the simulator runs assign-driver without Firebase.
+"""
+
+from flask import Flask, request, jsonify
+from flask_cors import CORS
+import os
+import random
+import threading
+import time
+import zlib
+
+app = Flask(__name__)
+CORS(app)
+
+PORT = int(os.environ.get('PORT', 5010))
+
+# Fleet
+SIM_DRIVERS = int(os.environ.get('SIM_DRIVERS', 200))
+SIM_SEED = int(os.environ.get('SIM_SEED', 42))
+# Drivers set Busy go back to Available after this many seconds, 0 keeps them busy
+SIM_DELIVERY_SECONDS = float(os.environ.get('SIM_DELIVERY_SECONDS', 0))
+
+# Latency of every call: lognormal around SIM_LATENCY_MS, SIM_LATENCY_SIGMA
+# sets the spread (0 gives a fixed latency). Each endpoint can override the
+# median with SIM_LATENCY_MS_STATUS, SIM_LATENCY_MS_DRIVERS or SIM_LATENCY_MS_GET
+SIM_LATENCY_MS = float(os.environ.get('SIM_LATENCY_MS', 80))
+SIM_LATENCY_SIGMA = float(os.environ.get('SIM_LATENCY_SIGMA', 0.5))
+SIM_LATENCY_MS_BY_ENDPOINT = {
+    "status": float(os.environ.get('SIM_LATENCY_MS_STATUS', SIM_LATENCY_MS)),
+    "drivers": float(os.environ.get('SIM_LATENCY_MS_DRIVERS', SIM_LATENCY_MS)),
+    "get_driver": float(os.environ.get('SIM_LATENCY_MS_GET', SIM_LATENCY_MS)),
+}
+
+# Share of calls answered with a 503, and of PUT /drivers answered with Success false
+SIM_FAILURE_RATE = float(os.environ.get('SIM_FAILURE_RATE', 0))
+SIM_REJECT_RATE = float(os.environ.get('SIM_REJECT_RATE', 0))
+
+# Serve /orders and /customers stubs as well
+SIM_STUB_ORDERS = os.environ.get('SIM_STUB_ORDERS', 'true').lower() == 'true'
+
+lock = threading.Lock()
+drivers = {}
+orders = {}
+stats = {}
+
+
+def reset_fleet():
+    rng = random.Random(SIM_SEED)
+    with lock:
+        drivers.clear()
+        orders.clear()
+        stats.clear()
+        for driver_id in range(1, SIM_DRIVERS + 1):
+            drivers[driver_id] = {
+                "DriverId": driver_id,
+                "DriverName": f"Driver {driver_id}",
+                "DriverNumber": 80000000 + driver_id,
+                "DriverLocation": f"{rng.uniform(0, 20):.4f},{rng.uniform(0, 20):.4f}",
+                "DriverEmail": f"driver{driver_id}@example.com",
+                "DriverStatus": "Available",
+                "busy_until": 0.0,
+            }
+
+
+def restaurant_location(restaurant_id):
+    # stable pseudo-random position for any restaurant id
+    seed = zlib.crc32(str(restaurant_id).encode("utf-8"))
+    rng = random.Random(seed)
+    return rng.uniform(0, 20), rng.uniform(0, 20)
+
+
+def public(driver):
+    return {key: value for key, value in driver.items() if key != "busy_until"}
+
+
+def record(endpoint, outcome):
+    with lock:
+        endpoint_stats = stats.setdefault(endpoint, {"calls": 0, "failures": 0, "rejections": 0})
+        endpoint_stats["calls"] += 1
+        if outcome:
+            endpoint_stats[outcome] += 1
+
+
+def simulate(endpoint):
+    """Sleep for the endpoint's latency, return a 503 response if this call fails"""
+    median = SIM_LATENCY_MS_BY_ENDPOINT.get(endpoint, SIM_LATENCY_MS)
+    if median > 0:
+        latency = median * (random.lognormvariate(0, SIM_LATENCY_SIGMA) if SIM_LATENCY_SIGMA > 0 else 1)
+        time.sleep(latency / 1000)
+    if random.random() < SIM_FAILURE_RATE:
+        record(endpoint, "failures")
+        return jsonify({"code": 503, "message": "Simulated driver service failure"}), 503
+    return None
+
+
+def release_delivered(now):
+    for driver in drivers.values():
+        if driver["busy_until"] and driver["busy_until"] <= now:
+            driver["DriverStatus"] = "Available"
+            driver["busy_until"] = 0.0
+
+
+@app.route("/health", methods=['GET'])
+def health_check():
+    return jsonify({'status': 'ok', 'service': 'driver-sim'})
+
+
+@app.route("/status/<restaurant_id>", methods=['GET'])
+def get_driver_status(restaurant_id):
+    failure = simulate("status")
+    if failure:
+        return failure
+    record("status", None)
+
+    x, y = restaurant_location(restaurant_id)
+    with lock:
+        release_delivered(time.time())
+        result = []
+        for driver in drivers.values():
+            dx, dy = (float(v) for v in driver["DriverLocation"].split(","))
+            result.append(dict(public(driver), Distance=round(((dx - x) ** 2 + (dy - y) ** 2) ** 0.5, 3)))
+    return jsonify({"FullResult": result})
+
+
+@app.route("/drivers", methods=['PUT'])
+def update_driver():
+    failure = simulate("drivers")
+    if failure:
+        return failure
+    if random.random() < SIM_REJECT_RATE:
+        record("drivers", "rejections")
+        return jsonify({"Success": False, "ErrorMessage": "Simulated rejection"})
+    record("drivers", None)
+
+    data = request.get_json() or {}
+    with lock:
+        driver = drivers.get(int(data.get("DriverId", 0)))
+        if driver is None:
+            return jsonify({"Success": False, "ErrorMessage": "Driver not found"})
+        status = data.get("DriverStatus", driver["DriverStatus"])
+        driver["DriverStatus"] = status.capitalize()
+        driver["busy_until"] = (
+            time.time() + SIM_DELIVERY_SECONDS
+            if driver["DriverStatus"] == "Busy" and SIM_DELIVERY_SECONDS > 0 else 0.0
+        )
+    return jsonify({"Success": True, "ErrorMessage": ""})
+
+
+@app.route("/getDriversById", methods=['GET'])
+def get_driver_by_id():
+    failure = simulate("get_driver")
+    if failure:
+        return failure
+    record("get_driver", None)
+
+    with lock:
+        driver = drivers.get(request.args.get("Id", type=int))
+        return jsonify({"Driver": public(driver) if driver else None})
+
+
+def stub_order(order_id):
+    # callers hold the lock
+    return orders.setdefault(order_id, {
+        "orderId": order_id,
+        # spread orders over 50 restaurants
+        "restaurantId": f"restaurant-{zlib.crc32(order_id.encode('utf-8')) % 50}",
+        "customerId": "sim-customer",
+        "price": 25.0,
+        "deliveryFee": 3.0,
+        "status": "PREPARING",
+        "driverStatus": "PENDING",
+        "items": [],
+        "version": "1",
+    })
+
+
+@app.route("/orders/<order_id>", methods=['GET'])
+def get_order(order_id):
+    if not SIM_STUB_ORDERS:
+        return jsonify({'error': 'Order not found'}), 404
+    with lock:
+        return jsonify(stub_order(order_id))
+
+
+@app.route("/orders:batchGet", methods=['POST'])
+def batch_get_orders():
+    ids = (request.get_json(silent=True) or {}).get('ids') or []
+    if not SIM_STUB_ORDERS:
+        return jsonify({'orders': [], 'missing': ids})
+    with lock:
+        return jsonify({'orders': [stub_order(order_id) for order_id in ids], 'missing': []})
+
+
+@app.route("/orders/<order_id>/status", methods=['PUT'])
+def update_order_status(order_id):
+    if not SIM_STUB_ORDERS:
+        return jsonify({'error': 'Order not found'}), 404
+    with lock:
+        order = orders.setdefault(order_id, {"orderId": order_id, "version": "1"})
+        # same version check as order-service
+        if_match = request.headers.get('If-Match')
+        if if_match and if_match.strip('"') != order["version"]:
+            return jsonify({'error': f'Order {order_id} was modified since the version in If-Match', 'code': 412}), 412
+        order.update(request.get_json() or {})
+        order["version"] = str(int(order["version"]) + 1)
+        return jsonify(order)
+
+
+@app.route("/customers/<customer_id>", methods=['GET'])
+def get_customer(customer_id):
+    if not SIM_STUB_ORDERS:
+        return jsonify({'error': 'Customer not found'}), 404
+    return jsonify({"customerId": customer_id, "email": "customer@example.com"})
+
+
+@app.route("/stats", methods=['GET'])
+def get_stats():
+    """Calls per endpoint and fleet state, read by the benchmark before and after a run"""
+    with lock:
+        release_delivered(time.time())
+        busy = sum(1 for driver in drivers.values() if driver["DriverStatus"] == "Busy")
+        return jsonify({
+            "code": 200,
+            "data": {
+                "endpoints": {endpoint: dict(values) for endpoint, values in stats.items()},
+                "drivers": len(drivers),
+                "busy_drivers": busy,
+                "orders": len(orders),
+            }
+        })
+
+
+@app.route("/reset", methods=['POST'])
+def reset():
+    """Make every driver available again and clear the stats"""
+    reset_fleet()
+    return jsonify({"code": 200, "message": f"Fleet of {SIM_DRIVERS} drivers reset"})
+
+
+reset_fleet()
+
+if __name__ == "__main__":
+    print("This is flask " + os.path.basename(__file__) + " for simulating the driver service")
+    app.run(host="0.0.0.0", port=PORT, threaded=True)
@@ -0,0 +1,110 @@
+"""
+Load test of assign-driver against the driver service simulator.
+
+Sends POST /assign/<order_id> at a fixed rate, open loop: every request
+gets its own thread and leaves at its scheduled time however many are
+still waiting for a response. Latency is measured from that scheduled
+time, so time spent queueing behind a late sender counts too. Reports
+assignments/s, p50/p99 latency of successful assignments and, separately,
+of every other response, and driver service calls per assignment read
+from the simulator's /stats before and after the run.
+
+Start the stack with the simulator in front of assign-driver, e.g.
+
+    DRIVER_URL=http://driver-sim:5010 ORDER_URL=http://driver-sim:5010 \\
+    CUSTOMER_URL=http://driver-sim:5010 docker-compose --profile bench up --build
+
+then run
+
+    python benchmark_assign.py --rate 50 --duration 30
+"""
+
+import argparse
+import threading
+import time
+import uuid
+
+import requests
+
+
+def percentile(values, fraction):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    index = min(len(values) - 1, int(round(fraction * (len(values) - 1))))
+    return values[index]
+
+
+def driver_calls(sim_url):
+    endpoints = requests.get(f"{sim_url}/stats", timeout=10).json()["data"]["endpoints"]
+    return sum(endpoint["calls"] for endpoint in endpoints.values())
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--assign-url", default="http://localhost:5006")
+    parser.add_argument("--sim-url", default="http://localhost:5010")
+    parser.add_argument("--rate", type=float, default=20, help="requests per second")
+    parser.add_argument("--duration", type=float, default=30, help="seconds")
+    parser.add_argument("--no-reset", action="store_true", help="keep the simulator's fleet state")
+    args = parser.parse_args()
+
+    if not args.no_reset:
+        requests.post(f"{args.sim_url}/reset", timeout=10)
+    calls_before = driver_calls(args.sim_url)
+
+    session = requests.Session()
+    # connections above the pool size are opened anyway, only not kept alive
+    adapter = requests.adapters.HTTPAdapter(pool_maxsize=64)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+
+    lock = threading.Lock()
+    latencies = []
+    other_latencies = []
+    statuses = {}
+    run_id = uuid.uuid4().hex[:8]
+
+    def assign(order_id, scheduled):
+        try:
+            status = session.post(f"{args.assign_url}/assign/{order_id}", timeout=60).status_code
+        except requests.RequestException:
+            status = "error"
+        # from the scheduled send time, not from when this thread got to run
+        elapsed = time.perf_counter() - scheduled
+        with lock:
+            statuses[status] = statuses.get(status, 0) + 1
+            (latencies if status == 200 else other_latencies).append(elapsed)
+
+    total = int(args.rate * args.duration)
+    started = time.perf_counter()
+    threads = []
+    for i in range(total):
+        # open loop: request i leaves at i / rate whatever the response times
+        scheduled = started + i / args.rate
+        delay = scheduled - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+        thread = threading.Thread(target=assign, args=(f"bench-{run_id}-{i}", scheduled), daemon=True)
+        thread.start()
+        threads.append(thread)
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    calls = driver_calls(args.sim_url) - calls_before
+    assigned = statuses.get(200, 0)
+
+    print(f"sent {total} requests in {elapsed:.1f}s (target {args.rate:g}/s)")
+    print(f"responses: {dict(sorted(statuses.items(), key=str))}")
+    print(f"assignments/s: {assigned / elapsed:.1f}")
+    print(f"latency p50: {percentile(latencies, 0.5) * 1000:.0f}ms  p99: {percentile(latencies, 0.99) * 1000:.0f}ms")
+    print(
+        f"other responses: {len(other_latencies)}  p50: {percentile(other_latencies, 0.5) * 1000:.0f}ms"
+        f"  p99: {percentile(other_latencies, 0.99) * 1000:.0f}ms"
+    )
+    print(f"driver service calls: {calls} ({calls / max(assigned, 1):.2f} per assignment)")
+
+
+if __name__ == "__main__":
+    main()
@@ -23,34 +23,46 @@ exchange_name = "order_topic"
 exchange_type = "topic"
 queue_name = "error_queue"  
 
-def callback(channel, method, properties, body):
-    try:
-        error = json.loads(body)
-        print(f"Error message (JSON): {error}")
-        
-        # Store error in Firebase if initialized
-        if 'db' in globals():
-            error_ref = db.collection('errors').document()
-            error_data = {
-                'timestamp': datetime.datetime.now(),
-                'error_details': error,
-                'routing_key': method.routing_key
-            }
-            error_ref.set(error_data)
-            print(f"Error stored in Firebase with ID: {error_ref.id}")
-        else:
-            print("Warning: Firebase not initialized, error not stored")
-        
-    except Exception as e:
-        print(f"Unable to parse JSON: {e=}")
-        print(f"Error message: {body}")
-    print()
+# Errors are written to Firestore in batches, a WriteBatch holds up to 500 writes
+batch_size = min(int(os.environ.get('ERROR_BATCH_SIZE', 200)), 500)
+batch_timeout_ms = int(os.environ.get('ERROR_BATCH_TIMEOUT_MS', 500))
+
+def batch_callback(channel, messages):
+    """Store a batch of errors with a single Firestore commit"""
+    if 'db' not in globals():
+        print(f"Warning: Firebase not initialized, {len(messages)} errors not stored")
+        return
+
+    batch = db.batch()
+    stored = 0
+    for method, properties, body in messages:
+        try:
+            error = amqp_lib.decode_message(body, properties)
+        except Exception as e:
+            # skip the malformed message instead of failing the whole batch
+            print(f"Unable to decode message: {e=}")
+            print(f"Error message: {body}")
+            continue
+
+        error_ref = db.collection('errors').document()
+        batch.set(error_ref, {
+            'timestamp': datetime.datetime.now(),
+            'error_details': error,
+            'routing_key': method.routing_key
+        })
+        stored += 1
+
+    # raising here leaves the batch to be redelivered
+    if stored:
+        batch.commit()
+    print(f"Stored {stored} of {len(messages)} errors in Firebase")
 
 if __name__ == "__main__":
     print(f"This is {os.path.basename(__file__)} - amqp consumer...")
     try:
-        amqp_lib.start_consuming(
-            rabbit_host, rabbit_port, exchange_name, exchange_type, queue_name, callback
+        amqp_lib.start_batch_consuming(
+            rabbit_host, rabbit_port, exchange_name, exchange_type, queue_name, batch_callback,
+            batch_size=batch_size, batch_timeout_ms=batch_timeout_ms
         )
     except Exception as exception:
         print(f"Unable to connect to RabbitMQ.\n     {exception=}\n")
\ No newline at end of file
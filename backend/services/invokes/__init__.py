@@ -0,0 +1,14 @@
+"""
+HTTP client shared by the services that call each other: a pooled keep-alive
+session with per-destination circuit breakers, a retry budget, an opt-in GET
+cache and single-flight GETs. Copied into each image next to rabbitmq/.
+"""
+
+from .breaker import CircuitOpenError
+from .client import (
+    configure_cache,
+    get_invoke_stats,
+    invoke_async,
+    invoke_http,
+    invoke_many,
+)
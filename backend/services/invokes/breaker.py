@@ -0,0 +1,138 @@
+import os
+import threading
+import time
+from collections import deque
+
+# Circuit breaker settings, applied per destination (scheme://host:port)
+# the breaker opens when at least BREAKER_MIN_REQUESTS calls were made in the
+# last BREAKER_WINDOW seconds and BREAKER_FAILURE_RATE of them failed
+BREAKER_WINDOW = float(os.environ.get('BREAKER_WINDOW', 30))
+BREAKER_MIN_REQUESTS = int(os.environ.get('BREAKER_MIN_REQUESTS', 10))
+BREAKER_FAILURE_RATE = float(os.environ.get('BREAKER_FAILURE_RATE', 0.5))
+BREAKER_OPEN_SECONDS = float(os.environ.get('BREAKER_OPEN_SECONDS', 15))
+BREAKER_HALF_OPEN_PROBES = int(os.environ.get('BREAKER_HALF_OPEN_PROBES', 1))
+
+
+class CircuitOpenError(Exception):
+    pass
+
+
+class CircuitBreaker:
+    """Failure-rate circuit breaker for a single destination.
+       closed: calls go through and their outcome is recorded in a sliding window;
+       open: calls fail fast until BREAKER_OPEN_SECONDS have passed;
+       half_open: up to BREAKER_HALF_OPEN_PROBES calls probe the destination,
+            a success closes the breaker and a failure opens it again.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.state = "closed"
+        self.opened_at = None
+        self.probes = 0
+        self.outcomes = deque()
+        self.times_opened = 0
+        self.rejected = 0
+        self.lock = threading.Lock()
+
+    def _prune(self, now):
+        while self.outcomes and self.outcomes[0][0] < now - BREAKER_WINDOW:
+            self.outcomes.popleft()
+
+    def allow_request(self):
+        with self.lock:
+            if self.state == "open":
+                if time.monotonic() - self.opened_at < BREAKER_OPEN_SECONDS:
+                    self.rejected += 1
+                    return False
+                self.state = "half_open"
+                self.probes = 0
+
+            if self.state == "half_open":
+                if self.probes >= BREAKER_HALF_OPEN_PROBES:
+                    self.rejected += 1
+                    return False
+                self.probes += 1
+            return True
+
+    def record(self, success):
+        with self.lock:
+            now = time.monotonic()
+            if self.state == "half_open":
+                self.probes = max(self.probes - 1, 0)
+                if success:
+                    self.state = "closed"
+                    self.outcomes.clear()
+                else:
+                    self._open(now)
+                return
+
+            self.outcomes.append((now, success))
+            self._prune(now)
+            if self.state == "closed" and len(self.outcomes) >= BREAKER_MIN_REQUESTS:
+                failures = sum(1 for _, ok in self.outcomes if not ok)
+                if failures / len(self.outcomes) >= BREAKER_FAILURE_RATE:
+                    self._open(now)
+
+    def _open(self, now):
+        self.state = "open"
+        self.opened_at = now
+        self.times_opened += 1
+        self.outcomes.clear()
+
+    def snapshot(self):
+        with self.lock:
+            self._prune(time.monotonic())
+            failures = sum(1 for _, ok in self.outcomes if not ok)
+            return {
+                "state": self.state,
+                "window_requests": len(self.outcomes),
+                "window_failures": failures,
+                "times_opened": self.times_opened,
+                "rejected": self.rejected,
+            }
+
+
+class RetryBudget:
+    """Global token bucket that caps retries to a fraction of the traffic."""
+
+    def __init__(self, ratio, min_per_sec, max_tokens=None):
+        self.ratio = ratio
+        self.min_per_sec = min_per_sec
+        self.max_tokens = max_tokens or max(10.0, min_per_sec * 10)
+        self.tokens = self.max_tokens
+        self.updated_at = time.monotonic()
+        self.retries = 0
+        self.exhausted = 0
+        self.lock = threading.Lock()
+
+    def _refill(self, extra=0.0):
+        now = time.monotonic()
+        self.tokens = min(
+            self.max_tokens,
+            self.tokens + (now - self.updated_at) * self.min_per_sec + extra
+        )
+        self.updated_at = now
+
+    def deposit(self):
+        with self.lock:
+            self._refill(self.ratio)
+
+    def try_withdraw(self):
+        with self.lock:
+            self._refill()
+            if self.tokens >= 1:
+                self.tokens -= 1
+                self.retries += 1
+                return True
+            self.exhausted += 1
+            return False
+
+    def snapshot(self):
+        with self.lock:
+            self._refill()
+            return {
+                "tokens": round(self.tokens, 2),
+                "retries": self.retries,
+                "exhausted": self.exhausted,
+            }
@@ -0,0 +1,173 @@
+import copy
+import re
+import threading
+import time
+from collections import OrderedDict
+from urllib.parse import urlsplit
+
+
+def _resource(url):
+    parts = urlsplit(url)
+    return parts.netloc, parts.path.rstrip("/")
+
+
+def affected_by_write(url, written_url):
+    """Whether a write to written_url changes what a GET of url returns:
+       the same resource, one of its parents or one of its sub-resources.
+    """
+    netloc, path = _resource(written_url)
+    key_netloc, key_path = _resource(url)
+    if key_netloc != netloc:
+        return False
+    return (key_path == path or key_path.startswith(path + "/")
+            or path.startswith(key_path + "/"))
+
+
+class ResponseCache:
+    """Bounded LRU cache of successful GET replies with per-route TTLs.
+       Only urls matching a configured route are cached. A write to a resource
+       invalidates the cached reads of that resource, its parents and its
+       sub-resources, e.g. PUT /orders/1/status drops GET /orders/1.
+    """
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self.routes = []
+        self.entries = OrderedDict()
+        self.generation = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self.lock = threading.Lock()
+
+    def configure(self, routes, max_entries=None):
+        with self.lock:
+            self.routes = [(re.compile(pattern), ttl) for pattern, ttl in routes.items()]
+            if max_entries is not None:
+                self.max_entries = max_entries
+            self.entries.clear()
+
+    def ttl_for(self, url):
+        for pattern, ttl in self.routes:
+            if pattern.search(url):
+                return ttl
+        return None
+
+    def get(self, url):
+        with self.lock:
+            entry = self.entries.get(url)
+            if entry is None or entry[0] < time.monotonic():
+                if entry is not None:
+                    del self.entries[url]
+                self.misses += 1
+                return False, None
+            self.entries.move_to_end(url)
+            self.hits += 1
+            return True, copy.deepcopy(entry[1])
+
+    def put(self, url, value, ttl, generation):
+        with self.lock:
+            # a write went out while this read was in flight, the value may be stale
+            if generation != self.generation:
+                return
+            self.entries[url] = (time.monotonic() + ttl, copy.deepcopy(value))
+            self.entries.move_to_end(url)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, url):
+        with self.lock:
+            self.generation += 1
+            for key in list(self.entries.keys()):
+                if affected_by_write(key, url):
+                    del self.entries[key]
+                    self.invalidations += 1
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                "enabled": bool(self.routes),
+                "entries": len(self.entries),
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+            }
+
+
+class _Flight:
+    def __init__(self):
+        self.done = threading.Event()
+        self.waiters = 0
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """Collapse concurrent identical calls into one.
+       The first caller of a key runs the call, callers arriving while it is in
+       flight wait for it and each receive a copy of its result. A detached
+       flight keeps its current waiters but is not joined by later callers.
+    """
+
+    def __init__(self):
+        self.flights = {}
+        self.calls = 0
+        self.collapsed = 0
+        self.detached = 0
+        self.lock = threading.Lock()
+
+    def do(self, key, fn):
+        with self.lock:
+            self.calls += 1
+            flight = self.flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = _Flight()
+                self.flights[key] = flight
+            else:
+                flight.waiters += 1
+                self.collapsed += 1
+
+        if not leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return copy.deepcopy(flight.result)
+
+        result = None
+        try:
+            result = fn()
+            return result
+        except Exception as e:
+            flight.error = e
+            raise
+        finally:
+            with self.lock:
+                if self.flights.get(key) is flight:
+                    del self.flights[key]
+                waiters = flight.waiters
+            # snapshot the result so the leader can't change what waiters copy
+            flight.result = copy.deepcopy(result) if waiters else result
+            flight.done.set()
+
+    def detach(self, match):
+        """Make later callers of the keys matching match(key) start a new call
+           instead of joining the one in flight, whose result may be out of date.
+        """
+        with self.lock:
+            for key in [key for key in self.flights if match(key)]:
+                del self.flights[key]
+                self.detached += 1
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                "calls": self.calls,
+                "collapsed": self.collapsed,
+                "detached": self.detached,
+                "in_flight": len(self.flights),
+            }
@@ -0,0 +1,284 @@
+import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+import requests
+from requests.adapters import HTTPAdapter
+
+from .breaker import CircuitBreaker, CircuitOpenError, RetryBudget
+from .cache import ResponseCache, SingleFlight, affected_by_write
+
+SUPPORTED_HTTP_METHODS = set([
+    "GET", "OPTIONS", "HEAD", "POST", "PUT", "PATCH", "DELETE"
+])
+
+# Only idempotent reads are ever retried
+RETRYABLE_HTTP_METHODS = set(["GET", "HEAD"])
+RETRYABLE_STATUS_CODES = set([502, 503, 504])
+
+# Connection pool settings for the shared HTTP client
+# pool_connections: number of per-host pools kept alive
+# pool_maxsize: number of keep-alive connections kept per host
+HTTP_POOL_CONNECTIONS = int(os.environ.get('HTTP_POOL_CONNECTIONS', 10))
+HTTP_POOL_MAXSIZE = int(os.environ.get('HTTP_POOL_MAXSIZE', 20))
+HTTP_CONNECT_TIMEOUT = float(os.environ.get('HTTP_CONNECT_TIMEOUT', 3.05))
+HTTP_READ_TIMEOUT = float(os.environ.get('HTTP_READ_TIMEOUT', 10))
+
+# Worker threads shared by invoke_many for concurrent fan-out calls
+HTTP_FANOUT_WORKERS = int(os.environ.get('HTTP_FANOUT_WORKERS', 16))
+
+# Retry settings for idempotent GETs
+# retries are capped by a global budget: every request deposits
+# HTTP_RETRY_BUDGET_RATIO tokens, plus HTTP_RETRY_BUDGET_MIN_PER_SEC tokens per
+# second so that low-traffic services can still retry
+HTTP_MAX_RETRIES = int(os.environ.get('HTTP_MAX_RETRIES', 2))
+HTTP_RETRY_BACKOFF = float(os.environ.get('HTTP_RETRY_BACKOFF', 0.1))
+HTTP_RETRY_BACKOFF_MAX = float(os.environ.get('HTTP_RETRY_BACKOFF_MAX', 2))
+HTTP_RETRY_BUDGET_RATIO = float(os.environ.get('HTTP_RETRY_BUDGET_RATIO', 0.1))
+HTTP_RETRY_BUDGET_MIN_PER_SEC = float(os.environ.get('HTTP_RETRY_BUDGET_MIN_PER_SEC', 1))
+
+# Read-through cache for GET calls, disabled until routes are configured
+HTTP_CACHE_MAX_ENTRIES = int(os.environ.get('HTTP_CACHE_MAX_ENTRIES', 1024))
+
+# Methods that modify a resource and invalidate its cached reads
+WRITE_HTTP_METHODS = set(["POST", "PUT", "PATCH", "DELETE"])
+
+_session = None
+_session_lock = threading.Lock()
+_executor = None
+_executor_lock = threading.Lock()
+_breakers = {}
+_breakers_lock = threading.Lock()
+_retry_budget = RetryBudget(HTTP_RETRY_BUDGET_RATIO, HTTP_RETRY_BUDGET_MIN_PER_SEC)
+_cache = ResponseCache(HTTP_CACHE_MAX_ENTRIES)
+_single_flight = SingleFlight()
+
+
+def configure_cache(routes, max_entries=None):
+    """Enable the GET read-through cache for the given routes.
+       routes: a dict mapping a url regex to the TTL of its entries in seconds;
+       max_entries: the maximum number of cached replies before LRU eviction.
+    """
+    _cache.configure(routes, max_entries)
+
+
+def get_session():
+    """Return the process-wide requests.Session, creating it on first use.
+       The session keeps one keep-alive connection pool per host so repeated
+       calls to the same service reuse TCP (and TLS) connections.
+    """
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(
+                    pool_connections=HTTP_POOL_CONNECTIONS,
+                    pool_maxsize=HTTP_POOL_MAXSIZE,
+                )
+                session.mount("http://", adapter)
+                session.mount("https://", adapter)
+                _session = session
+    return _session
+
+
+def get_pool_stats():
+    """Return the state of each per-host connection pool of the shared client."""
+    stats = {}
+    if _session is None:
+        return stats
+
+    for adapter in set(_session.adapters.values()):
+        pools = adapter.poolmanager.pools
+        for key in list(pools.keys()):
+            pool = pools.get(key)
+            if pool is None:
+                continue
+            stats[f"{pool.scheme}://{pool.host}:{pool.port}"] = {
+                "connections_opened": pool.num_connections,
+                "requests": pool.num_requests,
+                "idle_connections": sum(1 for conn in pool.pool.queue if conn is not None) if pool.pool else 0,
+                "maxsize": pool.pool.maxsize if pool.pool else 0,
+            }
+    return stats
+
+
+def get_breaker(url):
+    """Return the circuit breaker of the destination of url."""
+    parts = urlsplit(url)
+    name = f"{parts.scheme}://{parts.netloc}"
+    breaker = _breakers.get(name)
+    if breaker is None:
+        with _breakers_lock:
+            breaker = _breakers.setdefault(name, CircuitBreaker(name))
+    return breaker
+
+
+def get_breaker_states():
+    """Return the state of every circuit breaker, keyed by destination."""
+    return {name: breaker.snapshot() for name, breaker in list(_breakers.items())}
+
+
+def get_invoke_stats():
+    """Collect the monitoring data of the invoke_http layer."""
+    return {
+        "pools": get_pool_stats(),
+        "breakers": get_breaker_states(),
+        "retry_budget": _retry_budget.snapshot(),
+        "cache": _cache.snapshot(),
+        "single_flight": _single_flight.snapshot(),
+    }
+
+
+def _send(method, url, json=None, **kwargs):
+    """Send a request through the destination's circuit breaker.
+       Idempotent methods are retried with jittered exponential backoff on
+       connection errors and 502/503/504 replies, as long as the global retry
+       budget allows it.
+    """
+    breaker = get_breaker(url)
+    retryable = method.upper() in RETRYABLE_HTTP_METHODS
+    _retry_budget.deposit()
+
+    attempt = 0
+    while True:
+        if not breaker.allow_request():
+            raise CircuitOpenError("Circuit breaker open for " + breaker.name + ".")
+
+        error = None
+        r = None
+        try:
+            r = get_session().request(method, url, json = json, **kwargs)
+        except requests.RequestException as e:
+            error = e
+        except Exception:
+            # release a half-open probe slot whatever went wrong
+            breaker.record(False)
+            raise
+        breaker.record(error is None and r.status_code < 500)
+
+        should_retry = error is not None or r.status_code in RETRYABLE_STATUS_CODES
+        if retryable and should_retry and attempt < HTTP_MAX_RETRIES and _retry_budget.try_withdraw():
+            attempt += 1
+            backoff = min(HTTP_RETRY_BACKOFF_MAX, HTTP_RETRY_BACKOFF * (2 ** attempt))
+            time.sleep(random.uniform(0, backoff))
+            continue
+
+        if error is not None:
+            raise error
+        return r
+
+
+def invoke_http(url, method='GET', json=None, **kwargs):
+    """A simple wrapper for requests methods.
+       url: the url of the http service;
+       method: the http method;
+       data: the JSON input when needed by the http method;
+       return: the JSON reply content from the http service if the call succeeds;
+            otherwise, return a JSON object with a "code" name-value pair.
+    """
+    ttl = _cache.ttl_for(url) if method.upper() == "GET" else None
+    if ttl:
+        found, cached = _cache.get(url)
+        if found:
+            return cached
+        generation = _cache.generation
+
+    # concurrent identical GETs share a single request
+    if method.upper() == "GET" and json is None and not kwargs:
+        code, result = _single_flight.do(
+            ("GET", url), lambda: _invoke(url, method)
+        )
+    else:
+        code, result = _invoke(url, method, json, **kwargs)
+
+    if ttl and code == 200 and isinstance(result, (dict, list)):
+        _cache.put(url, result, ttl, generation)
+
+    return result
+
+
+def _invoke(url, method='GET', json=None, **kwargs):
+    code = 200
+    result = {}
+
+    kwargs.setdefault('timeout', (HTTP_CONNECT_TIMEOUT, HTTP_READ_TIMEOUT))
+
+    try:
+        if method.upper() in SUPPORTED_HTTP_METHODS:
+            r = _send(method, url, json = json, **kwargs)
+        else:
+            raise Exception("HTTP method {} unsupported.".format(method))
+    except CircuitOpenError as e:
+        code = 503
+        result = {"code": code, "message": "invocation of service fails: " + url + ". " + str(e)}
+    except Exception as e:
+        code = 500
+        result = {"code": code, "message": "invocation of service fails: " + url + ". " + str(e)}
+    # a write invalidates cached reads of the resource, even if it failed, and
+    # GETs sent from now on must not join a read that started before it
+    if method.upper() in WRITE_HTTP_METHODS:
+        _cache.invalidate(url)
+        _single_flight.detach(lambda key: affected_by_write(key[1], url))
+    if code not in range(200,300):
+        return code, result
+
+    ## Check http call result
+    if r.status_code != requests.codes.ok:
+        code = r.status_code
+    try:
+        result = r.json() if len(r.content)>0 else ""
+    except Exception as e:
+        code = 500
+        result = {"code": code, "message": "Invalid JSON output from service: " + url + ". " + str(e)}
+
+    return code, result
+
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(
+                    max_workers=HTTP_FANOUT_WORKERS,
+                    thread_name_prefix="invoke_many",
+                )
+    return _executor
+
+
+def _invoke_one(call):
+    try:
+        if isinstance(call, str):
+            return invoke_http(call)
+        call = dict(call)
+        return invoke_http(call.pop('url'), **call)
+    except Exception as e:
+        return {"code": 500, "message": "invocation of service fails: " + str(e)}
+
+
+def invoke_many(calls):
+    """Send a batch of independent invoke_http calls concurrently.
+       calls: a list of urls, or of dicts holding the invoke_http arguments,
+            e.g. {"url": ..., "method": "GET", "json": ...};
+       return: a list with the result of each call, in the same order as calls.
+            A failing call gets its own {"code", "message"} error object and
+            does not affect the other results.
+    """
+    calls = list(calls)
+    if len(calls) <= 1:
+        return [_invoke_one(call) for call in calls]
+
+    futures = [_get_executor().submit(_invoke_one, call) for call in calls]
+    return [future.result() for future in futures]
+
+
+def invoke_async(url, method='GET', json=None, **kwargs):
+    """Start an invoke_http call on the fan-out pool and return at once.
+       return: a Future whose result() is the invoke_http result, or a
+            {"code", "message"} error object if the call raised.
+    """
+    call = dict(kwargs, url=url, method=method, json=json)
+    return _get_executor().submit(_invoke_one, call)
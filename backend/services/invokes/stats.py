@@ -0,0 +1,25 @@
+from flask import Blueprint, jsonify
+
+import rabbitmq.amqp_lib as amqp_lib
+from .client import get_invoke_stats
+
+# Monitoring routes of the shared clients, registered by every service using them
+stats_blueprint = Blueprint("stats", __name__)
+
+
+@stats_blueprint.route("/invoke-stats", methods=['GET'])
+def invoke_stats():
+    """Expose connection pool statistics of the invoke_http client"""
+    return jsonify({
+        "code": 200,
+        "data": get_invoke_stats()
+    }), 200
+
+
+@stats_blueprint.route("/publisher-stats", methods=['GET'])
+def publisher_stats():
+    """Expose buffer and confirm statistics of the background AMQP publisher"""
+    return jsonify({
+        "code": 200,
+        "data": amqp_lib.get_publisher_stats()
+    }), 200
@@ -0,0 +1,133 @@
+"""
+Circuit breaker and retry budget of invoke_http. Run from backend/services:
+
+    python -m pytest invokes/tests
+"""
+
+import unittest
+from unittest import mock
+
+from invokes import breaker, client
+from invokes.breaker import CircuitBreaker, RetryBudget
+
+
+class FakeClock:
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+
+class CircuitBreakerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = FakeClock()
+        for name, value in [
+            ("time", self.clock),
+            ("BREAKER_WINDOW", 30),
+            ("BREAKER_MIN_REQUESTS", 4),
+            ("BREAKER_FAILURE_RATE", 0.5),
+            ("BREAKER_OPEN_SECONDS", 15),
+            ("BREAKER_HALF_OPEN_PROBES", 1),
+        ]:
+            patcher = mock.patch.object(breaker, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.breaker = CircuitBreaker("http://order-service:5001")
+
+    def trip(self):
+        for success in (True, False, True, False):
+            self.assertTrue(self.breaker.allow_request())
+            self.breaker.record(success)
+        self.assertEqual(self.breaker.state, "open")
+
+    def test_stays_closed_below_the_minimum_number_of_requests(self):
+        for _ in range(3):
+            self.breaker.record(False)
+        self.assertEqual(self.breaker.state, "closed")
+
+    def test_opens_at_the_failure_rate_and_rejects_calls(self):
+        self.trip()
+        self.assertFalse(self.breaker.allow_request())
+        self.assertEqual(self.breaker.snapshot()["rejected"], 1)
+
+    def test_failures_outside_the_window_are_forgotten(self):
+        for _ in range(3):
+            self.breaker.record(False)
+        self.clock.now += 31
+        self.breaker.record(False)
+        self.assertEqual(self.breaker.state, "closed")
+
+    def test_half_open_lets_one_probe_through_and_closes_on_success(self):
+        self.trip()
+        self.clock.now += 15
+        self.assertTrue(self.breaker.allow_request())
+        self.assertEqual(self.breaker.state, "half_open")
+        # the probe slot is taken until its outcome is recorded
+        self.assertFalse(self.breaker.allow_request())
+
+        self.breaker.record(True)
+        self.assertEqual(self.breaker.state, "closed")
+        self.assertTrue(self.breaker.allow_request())
+
+    def test_failed_probe_opens_the_breaker_again(self):
+        self.trip()
+        self.clock.now += 15
+        self.assertTrue(self.breaker.allow_request())
+        self.breaker.record(False)
+
+        self.assertEqual(self.breaker.state, "open")
+        self.assertEqual(self.breaker.times_opened, 2)
+        self.assertFalse(self.breaker.allow_request())
+
+
+class SendProbeTest(unittest.TestCase):
+
+    def test_unexpected_error_releases_the_probe_slot(self):
+        url = "http://probe-test:5000/orders/1"
+        half_open = client.get_breaker(url)
+        half_open.state = "half_open"
+        half_open.probes = 0
+
+        session = mock.Mock()
+        session.request.side_effect = ValueError("bad hook")
+        with mock.patch.object(client, "get_session", return_value=session):
+            with self.assertRaises(ValueError):
+                client._send("GET", url)
+
+        self.assertEqual(half_open.state, "open")
+        self.assertEqual(half_open.probes, 0)
+
+
+class RetryBudgetTest(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = FakeClock()
+        patcher = mock.patch.object(breaker, "time", self.clock)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_retries_are_capped_by_the_tokens(self):
+        budget = RetryBudget(ratio=0.5, min_per_sec=0, max_tokens=2)
+        self.assertTrue(budget.try_withdraw())
+        self.assertTrue(budget.try_withdraw())
+        self.assertFalse(budget.try_withdraw())
+        self.assertEqual(budget.snapshot()["exhausted"], 1)
+
+        # each request deposits a fraction of a retry
+        budget.deposit()
+        budget.deposit()
+        self.assertTrue(budget.try_withdraw())
+
+    def test_tokens_refill_over_time(self):
+        budget = RetryBudget(ratio=0, min_per_sec=1, max_tokens=1)
+        self.assertTrue(budget.try_withdraw())
+        self.assertFalse(budget.try_withdraw())
+        self.clock.now += 1
+        self.assertTrue(budget.try_withdraw())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,87 @@
+"""
+GET read-through cache of invoke_http. Run from backend/services:
+
+    python -m pytest invokes/tests
+"""
+
+import unittest
+from unittest import mock
+
+from invokes import cache
+from invokes.cache import ResponseCache
+
+ORDERS = "http://order-service:5001/orders"
+
+
+class FakeClock:
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+
+class ResponseCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = FakeClock()
+        patcher = mock.patch.object(cache, "time", self.clock)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.cache = ResponseCache(max_entries=2)
+        self.cache.configure({r"/orders/[^/]+$": 5})
+
+    def put(self, url, value):
+        self.cache.put(url, value, self.cache.ttl_for(url), self.cache.generation)
+
+    def test_only_configured_routes_are_cached(self):
+        self.assertEqual(self.cache.ttl_for(ORDERS + "/1"), 5)
+        self.assertIsNone(self.cache.ttl_for(ORDERS))
+
+    def test_entries_expire_after_their_ttl(self):
+        self.put(ORDERS + "/1", {"status": "PENDING"})
+        self.assertEqual(self.cache.get(ORDERS + "/1"), (True, {"status": "PENDING"}))
+        self.clock.now += 6
+        self.assertEqual(self.cache.get(ORDERS + "/1"), (False, None))
+        self.assertEqual(self.cache.snapshot()["entries"], 0)
+
+    def test_hits_are_copies(self):
+        self.put(ORDERS + "/1", {"status": "PENDING"})
+        _, order = self.cache.get(ORDERS + "/1")
+        order["status"] = "CANCELLED"
+        self.assertEqual(self.cache.get(ORDERS + "/1"), (True, {"status": "PENDING"}))
+
+    def test_least_recently_used_entry_is_evicted(self):
+        self.put(ORDERS + "/1", {"id": 1})
+        self.put(ORDERS + "/2", {"id": 2})
+        self.cache.get(ORDERS + "/1")
+        self.put(ORDERS + "/3", {"id": 3})
+
+        self.assertTrue(self.cache.get(ORDERS + "/1")[0])
+        self.assertFalse(self.cache.get(ORDERS + "/2")[0])
+        self.assertEqual(self.cache.snapshot()["evictions"], 1)
+
+    def test_write_invalidates_the_resource_and_its_parents(self):
+        self.put(ORDERS + "/1", {"id": 1})
+        self.put(ORDERS + "/2", {"id": 2})
+
+        self.cache.invalidate(ORDERS + "/1/status")
+
+        self.assertFalse(self.cache.get(ORDERS + "/1")[0])
+        self.assertTrue(self.cache.get(ORDERS + "/2")[0])
+
+    def test_write_to_another_host_keeps_the_entry(self):
+        self.put(ORDERS + "/1", {"id": 1})
+        self.cache.invalidate("http://wallet-service:5002/orders/1")
+        self.assertTrue(self.cache.get(ORDERS + "/1")[0])
+
+    def test_read_that_overlapped_a_write_is_not_stored(self):
+        generation = self.cache.generation
+        self.cache.invalidate(ORDERS + "/1")
+        self.cache.put(ORDERS + "/1", {"status": "PENDING"}, 5, generation)
+        self.assertFalse(self.cache.get(ORDERS + "/1")[0])
+
+
+if __name__ == "__main__":
+    unittest.main()
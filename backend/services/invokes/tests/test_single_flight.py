@@ -0,0 +1,173 @@
+"""
+Single-flight GETs of invoke_http. Run from backend/services:
+
+    python -m pytest invokes/tests
+"""
+
+import json
+import threading
+import time
+import unittest
+from unittest import mock
+
+from invokes import client
+from invokes.cache import ResponseCache, SingleFlight
+
+ORDER_URL = "http://order-service:5001/orders/1"
+
+
+def wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            raise AssertionError("timed out")
+        time.sleep(0.01)
+
+
+class FakeResponse:
+
+    def __init__(self, body, status_code=200):
+        self.status_code = status_code
+        self.content = json.dumps(body).encode()
+
+    def json(self):
+        return json.loads(self.content)
+
+
+class FakeOrderService:
+    """Order service whose GETs block until released, answering with the
+    status the order had when the GET was received
+    """
+
+    def __init__(self):
+        self.status = "PENDING"
+        self.gets = 0
+        self.release = threading.Event()
+
+    def send(self, method, url, json=None, **kwargs):
+        if method == "PUT":
+            self.status = json["status"]
+            return FakeResponse({"status": self.status})
+        self.gets += 1
+        status = self.status
+        self.release.wait(5)
+        return FakeResponse({"status": status})
+
+
+class SingleFlightTest(unittest.TestCase):
+
+    def test_concurrent_callers_share_one_call(self):
+        flights = SingleFlight()
+        started = threading.Event()
+        release = threading.Event()
+        calls = []
+
+        def fetch():
+            calls.append(1)
+            started.set()
+            release.wait(5)
+            return {"value": 1}
+
+        results = []
+        leader = threading.Thread(target=lambda: results.append(flights.do("key", fetch)))
+        leader.start()
+        started.wait(5)
+        follower = threading.Thread(target=lambda: results.append(flights.do("key", fetch)))
+        follower.start()
+        wait_for(lambda: flights.collapsed == 1)
+        release.set()
+        leader.join(5)
+        follower.join(5)
+
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(results, [{"value": 1}, {"value": 1}])
+        # each caller gets its own copy
+        self.assertIsNot(results[0], results[1])
+
+    def test_leader_error_is_raised_to_waiters(self):
+        flights = SingleFlight()
+        started = threading.Event()
+        release = threading.Event()
+
+        def fetch():
+            started.set()
+            release.wait(5)
+            raise ValueError("down")
+
+        errors = []
+
+        def call():
+            try:
+                flights.do("key", fetch)
+            except ValueError as e:
+                errors.append(e)
+
+        leader = threading.Thread(target=call)
+        leader.start()
+        started.wait(5)
+        follower = threading.Thread(target=call)
+        follower.start()
+        wait_for(lambda: flights.collapsed == 1)
+        release.set()
+        leader.join(5)
+        follower.join(5)
+
+        self.assertEqual(len(errors), 2)
+        self.assertEqual(flights.snapshot()["in_flight"], 0)
+
+
+class InvokeHttpSingleFlightTest(unittest.TestCase):
+
+    def setUp(self):
+        self.service = FakeOrderService()
+        # a fresh client state, without the cache routes a service may have set
+        for name, value in [
+            ("_send", self.service.send),
+            ("_cache", ResponseCache(16)),
+            ("_single_flight", SingleFlight()),
+        ]:
+            patcher = mock.patch.object(client, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.addCleanup(self.service.release.set)
+
+    def test_get_after_a_write_does_not_join_an_older_read(self):
+        results = {}
+        early = threading.Thread(target=lambda: results.setdefault("early", client.invoke_http(ORDER_URL)))
+        early.start()
+        wait_for(lambda: self.service.gets == 1)
+
+        client.invoke_http(ORDER_URL, method="PUT", json={"status": "CANCELLED"})
+
+        late = threading.Thread(target=lambda: results.setdefault("late", client.invoke_http(ORDER_URL)))
+        late.start()
+        wait_for(lambda: self.service.gets == 2)
+        self.service.release.set()
+        early.join(5)
+        late.join(5)
+
+        self.assertEqual(results["early"], {"status": "PENDING"})
+        self.assertEqual(results["late"], {"status": "CANCELLED"})
+
+    def test_write_to_another_resource_keeps_the_flight(self):
+        results = []
+        first = threading.Thread(target=lambda: results.append(client.invoke_http(ORDER_URL)))
+        first.start()
+        wait_for(lambda: self.service.gets == 1)
+
+        client.invoke_http("http://order-service:5001/orders/2", method="PUT", json={"status": "CANCELLED"})
+        collapsed = client._single_flight.collapsed
+
+        second = threading.Thread(target=lambda: results.append(client.invoke_http(ORDER_URL)))
+        second.start()
+        wait_for(lambda: client._single_flight.collapsed == collapsed + 1)
+        self.service.release.set()
+        first.join(5)
+        second.join(5)
+
+        self.assertEqual(self.service.gets, 1)
+        self.assertEqual(results, [{"status": "PENDING"}, {"status": "PENDING"}])
+
+
+if __name__ == "__main__":
+    unittest.main()
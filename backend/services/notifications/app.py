@@ -11,9 +11,13 @@ exchange_name = "order_topic"
 exchange_type = "topic"
 queue_name = "notification_queue"
 
+# SendGrid calls run on a pool of workers, messages are acked once sent
+consumer_workers = int(os.environ.get('NOTIFICATION_WORKERS', 8))
+prefetch_count = int(os.environ.get('NOTIFICATION_PREFETCH', 16))
+
 def callback(channel, method, properties, body):
     try:
-        message_data = json.loads(body)
+        message_data = amqp_lib.decode_message(body, properties)
         print(f"JSON: {message_data}")
 
         recipient_email = message_data.get('recipient')
@@ -76,10 +80,13 @@ def callback(channel, method, properties, body):
             print(f"Response headers: {response.headers}")
         except Exception as e:
             print(f"ERROR sending email: {str(e)}")
+            raise
 
     except Exception as e:
         print(f"Unable to process message: {e}")
         print(f"Message body: {body}")
+        # let the consumer nack the message so it is redelivered
+        raise
     print()
 
 if __name__ == "__main__":
@@ -87,7 +94,8 @@ if __name__ == "__main__":
     try:
         print("[DEBUG] Notification service is starting...")
         amqp_lib.start_consuming(
-            rabbit_host, rabbit_port, exchange_name, exchange_type, queue_name, callback
+            rabbit_host, rabbit_port, exchange_name, exchange_type, queue_name, callback,
+            prefetch_count=prefetch_count, workers=consumer_workers
         )
 
         # If we get here, start_consuming() returned instead of blocking
@@ -1,8 +1,12 @@
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify, stream_with_context
 from flask_cors import CORS
+import base64
 import json
 import os
 from firebase_admin import credentials, firestore, initialize_app
+from google.cloud.firestore_v1.field_path import FieldPath
+from google.api_core.datetime_helpers import DatetimeWithNanoseconds
+from google.api_core.exceptions import FailedPrecondition, NotFound
 from datetime import datetime, timezone, timedelta
 
 
@@ -26,40 +30,183 @@ db = firestore.client()
 
 PORT = int(os.environ.get('PORT', 5001))
 
+# Largest page GET /orders?limit= returns
+ORDERS_PAGE_MAX = int(os.environ.get('ORDERS_PAGE_MAX', 500))
+# Most order IDs POST /orders:batchGet reads in one call
+BATCH_GET_MAX = int(os.environ.get('BATCH_GET_MAX', 300))
+
 
 @app.route('/health', methods=['GET'])
 def health_check():
     """Health check endpoint"""
     return jsonify({'status': 'ok', 'service': 'order-service'})
   
+def convert_timestamps(order_dict):
+    """Convert Firestore timestamps to ISO format strings"""
+    for key, value in order_dict.items():
+        if isinstance(value, datetime):
+            order_dict[key] = value.isoformat()
+    return order_dict
+
+def order_version(update_time):
+    """Version of an order: its Firestore update time, to nanoseconds"""
+    return update_time.rfc3339()
+
+def with_version(response, version):
+    """Expose the order version in the ETag header of a response"""
+    response.headers['ETag'] = f'"{version}"'
+    return response
+
+def if_match_option():
+    """Write option requiring the version in the If-Match header, None without one.
+
+    Raises ValueError when the header is not a version.
+    """
+    etag = request.headers.get('If-Match', '').strip()
+    if not etag or etag == '*':
+        return None
+    version = etag.removeprefix('W/').strip('"')
+    return db.write_option(last_update_time=DatetimeWithNanoseconds.from_rfc3339(version))
+
+def precondition_failed(order_id):
+    return jsonify({
+        'error': f'Order {order_id} was modified since the version in If-Match',
+        'code': 412
+    }), 412
+
+def encode_page_token(doc):
+    """Opaque cursor pointing after doc, in (createdAt, id) order"""
+    created_at = doc.get('createdAt')
+    if isinstance(created_at, datetime):
+        created_at = {'ts': created_at.isoformat()}
+    payload = json.dumps({'createdAt': created_at, 'id': doc.id}, separators=(',', ':'))
+    return base64.urlsafe_b64encode(payload.encode('utf-8')).decode('ascii').rstrip('=')
+
+def decode_page_token(token):
+    """Return the startAfter cursor values of a token made by encode_page_token"""
+    padded = token + '=' * (-len(token) % 4)
+    cursor = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')).decode('utf-8'))
+    created_at = cursor['createdAt']
+    if isinstance(created_at, dict):
+        created_at = datetime.fromisoformat(created_at['ts'])
+    return {
+        'createdAt': created_at,
+        '__name__': db.collection('orders').document(cursor['id'])
+    }
+
+def parse_fields(fields):
+    """Split a fields= query parameter into field paths, None when absent"""
+    if not fields:
+        return None
+    return [field.strip() for field in fields.split(',') if field.strip()]
+
+def orders_query(customer_id=None, fields=None):
+    """Orders of a customer or all orders, optionally projected on fields"""
+    query = db.collection('orders')
+    if customer_id:
+        query = query.where('customerId', '==', customer_id)
+    if fields:
+        query = query.select(fields)
+    return query
+
+def project(doc, fields):
+    """Order dict of doc, restricted to fields when a projection was requested"""
+    order = convert_timestamps(doc.to_dict() or {})
+    if fields:
+        # Firestore already trimmed the nested maps of a.b paths, keep their top-level field
+        top_level = {field.split('.')[0] for field in fields}
+        order = {key: value for key, value in order.items() if key in top_level}
+    return order | {'id': doc.id, 'version': order_version(doc.update_time)}
+
+def ordered_orders_query(customer_id=None, fields=None, start_after=None):
+    """Orders in (createdAt, id) order, resumed after a page token.
+
+    Raises ValueError when start_after is not a valid token.
+    """
+    # the cursor needs createdAt even when it is not a requested field
+    query_fields = fields + ['createdAt'] if fields and 'createdAt' not in fields else fields
+    query = orders_query(customer_id, query_fields) \
+        .order_by('createdAt') \
+        .order_by(FieldPath.document_id())
+    if start_after:
+        try:
+            query = query.start_after(decode_page_token(start_after))
+        except Exception:
+            raise ValueError('Invalid startAfter token')
+    return query
+
+def export_orders(query, fields):
+    """Yield one NDJSON line per order as Firestore streams them.
+
+    Every line carries the cursor after its order, so a client that got cut
+    off passes the last cursor it received as startAfter to resume.
+    """
+    count = 0
+    try:
+        for doc in query.stream():
+            line = {'order': project(doc, fields), 'cursor': encode_page_token(doc)}
+            yield json.dumps(line) + '\n'
+            count += 1
+    except Exception as e:
+        # the status line is already sent, report the error in the stream
+        print(f"Error in export after {count} orders: {str(e)}")
+        yield json.dumps({'error': str(e)}) + '\n'
+        return
+    print(f"Exported {count} orders")
+
 @app.route('/orders', methods=['GET'])
 def get_orders():
-    """Get all orders or filter by customerId"""
+    """Get all orders or filter by customerId.
+
+    With limit, returns one page {"orders": [...], "nextPageToken": ...} in
+    createdAt order; pass nextPageToken back as startAfter for the next page.
+    With format=ndjson, streams every order as {"order": ..., "cursor": ...}
+    lines without building the list in memory.
+    fields=a,b only reads those fields from Firestore.
+    """
     try:
-        print("="*50)
-        print("GET /orders hit")
         customer_id = request.args.get('customerId')
-        print(f"Requesting orders for customer ID: {customer_id}")
-        
-        def convert_timestamps(order_dict):
-            for key, value in order_dict.items():
-                if isinstance(value, datetime):
-                    order_dict[key] = value.isoformat()
-            return order_dict
-        
-        if customer_id:
-            orders_ref = db.collection('orders')
-            query = orders_ref.where('customerId', '==', customer_id)
-            orders = [convert_timestamps(doc.to_dict()) | {'id': doc.id} for doc in query.stream()]
-            print(f"Found {len(orders)} orders for customer")
-            print("Orders:", json.dumps(orders, indent=2))
-        else:
-            orders_ref = db.collection('orders')
-            print("No customer ID provided, fetching all orders")
-            orders = [convert_timestamps(doc.to_dict()) | {'id': doc.id} for doc in orders_ref.stream()]
-            print(f"Found {len(orders)} total orders")
-        
-        return jsonify(orders)
+        fields = parse_fields(request.args.get('fields'))
+        limit = request.args.get('limit')
+        start_after = request.args.get('startAfter')
+        print(f"GET /orders customerId={customer_id} limit={limit} fields={fields}")
+
+        if request.args.get('format') == 'ndjson':
+            try:
+                query = ordered_orders_query(customer_id, fields, start_after)
+            except ValueError as e:
+                return jsonify({'error': str(e)}), 400
+            return Response(
+                stream_with_context(export_orders(query, fields)),
+                mimetype='application/x-ndjson'
+            )
+
+        if limit is None:
+            query = orders_query(customer_id, fields)
+            orders = [project(doc, fields) for doc in query.stream()]
+            print(f"Found {len(orders)} orders")
+            return jsonify(orders)
+
+        try:
+            limit = int(limit)
+        except ValueError:
+            return jsonify({'error': 'limit must be an integer'}), 400
+        if limit < 1 or limit > ORDERS_PAGE_MAX:
+            return jsonify({'error': f'limit must be between 1 and {ORDERS_PAGE_MAX}'}), 400
+
+        try:
+            query = ordered_orders_query(customer_id, fields, start_after)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+
+        # one extra document tells whether there is a next page
+        docs = list(query.limit(limit + 1).stream())
+        page = docs[:limit]
+        next_page_token = encode_page_token(page[-1]) if len(docs) > limit else None
+
+        orders = [project(doc, fields) for doc in page]
+        print(f"Returning {len(orders)} orders, more: {next_page_token is not None}")
+        return jsonify({'orders': orders, 'nextPageToken': next_page_token})
     except Exception as e:
         print(f"Error in get_orders: {str(e)}")
         return jsonify({'error': str(e)}), 500
@@ -78,6 +225,8 @@ def get_order(order_id):
         
         order_data = order.to_dict()
         order_data['orderId'] = order.id  # Make sure orderId is included
+        # send back as If-Match to only update the order if it did not change
+        order_data['version'] = order_version(order.update_time)
         
         # Convert Firestore timestamps to ISO format strings
         for key, value in order_data.items():
@@ -85,11 +234,51 @@ def get_order(order_id):
                 order_data[key] = value.isoformat()
                 
         print(f"Found order: {json.dumps(order_data, indent=2)}")  # Debug log
-        return jsonify(order_data)
+        return with_version(jsonify(order_data), order_data['version'])
     except Exception as e:
         print(f"Error getting order: {str(e)}")  # Debug log
         return jsonify({'error': str(e)}), 500
     
+@app.route('/orders:batchGet', methods=['POST'])
+def batch_get_orders():
+    """Get several orders in one Firestore round trip.
+
+    Body: {"ids": [...], "fields": [...]} where fields is optional.
+    Returns {"orders": [...], "missing": [...]} in the order of ids. Each
+    order carries its version, to be sent back as If-Match.
+    """
+    try:
+        data = request.get_json(silent=True) or {}
+        ids = data.get('ids')
+        if not isinstance(ids, list) or not all(isinstance(order_id, str) and order_id for order_id in ids):
+            return jsonify({'error': 'ids must be a list of order IDs'}), 400
+        # keep the request order, drop duplicates
+        ids = list(dict.fromkeys(ids))
+        if len(ids) > BATCH_GET_MAX:
+            return jsonify({'error': f'At most {BATCH_GET_MAX} ids per request'}), 400
+
+        fields = data.get('fields')
+        if isinstance(fields, str):
+            fields = parse_fields(fields)
+        if fields is not None and not (isinstance(fields, list) and all(isinstance(f, str) for f in fields)):
+            return jsonify({'error': 'fields must be a list of field names'}), 400
+        print(f"Batch get of {len(ids)} orders, fields={fields}")
+
+        refs = [db.collection('orders').document(order_id) for order_id in ids]
+        # get_all returns the documents in no particular order
+        found = {
+            doc.id: convert_timestamps(doc.to_dict() or {}) | {'orderId': doc.id, 'version': order_version(doc.update_time)}
+            for doc in db.get_all(refs, field_paths=fields or None) if doc.exists
+        }
+
+        orders = [found[order_id] for order_id in ids if order_id in found]
+        missing = [order_id for order_id in ids if order_id not in found]
+        print(f"Found {len(orders)} orders, {len(missing)} missing")
+        return jsonify({'orders': orders, 'missing': missing})
+    except Exception as e:
+        print(f"Error in batch_get_orders: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
 @app.route('/orders', methods=['POST'])
 def create_order():
     try:
@@ -126,9 +315,16 @@ def create_order():
     
 @app.route('/orders/<order_id>', methods=['PUT'])
 def update_order(order_id):
-    """Update an existing order"""
+    """Update an existing order, only if it is still at the If-Match version when given"""
     try:
+        try:
+            option = if_match_option()
+        except ValueError:
+            return jsonify({'error': 'Invalid If-Match version'}), 400
+
         order_data = request.json
+        # version comes from GET /orders/<id>, it is not a stored field
+        order_data.pop('version', None)
         
         # Use ISO format string instead of SERVER_TIMESTAMP
         sg_timezone = timezone(timedelta(hours=8))
@@ -143,27 +339,32 @@ def update_order(order_id):
             else:
                 update_data[key] = value
         
-        # Update in Firestore
+        # Update in Firestore, update() fails if the order does not exist
         order_ref = db.collection('orders').document(order_id)
-        order = order_ref.get()
-        
-        if not order.exists:
-            return jsonify({'error': 'Order not found'}), 404
-        
-        order_ref.update(update_data)
+        result = order_ref.update(update_data, option=option)
+        version = order_version(result.update_time)
         
         # Return the updated data without Sentinel values
         response_data = {k: v for k, v in order_data.items() if v is not None}
-        return jsonify({'id': order_id, **response_data})
+        return with_version(jsonify({'id': order_id, **response_data, 'version': version}), version)
     
+    except NotFound:
+        return jsonify({'error': 'Order not found'}), 404
+    except FailedPrecondition:
+        return precondition_failed(order_id)
     except Exception as e:
         print(f"Error updating order: {str(e)}")  # Add logging
         return jsonify({'error': str(e)}), 500
     
 @app.route('/orders/<order_id>/status', methods=['PUT'])
 def update_order_status(order_id):
-    """Update order status fields"""
+    """Update order status fields, only if the order is still at the If-Match version when given"""
     try:
+        try:
+            option = if_match_option()
+        except ValueError:
+            return jsonify({'error': 'Invalid If-Match version'}), 400
+
         status_data = request.json
         valid_status_fields = ['status', 'driverStatus', 'paymentStatus', 'driverId']
         
@@ -173,12 +374,7 @@ def update_order_status(order_id):
                 'error': 'At least one status field (status, driverStatus, paymentStatus) is required'
             }), 400
         
-        # Update in Firestore
         order_ref = db.collection('orders').document(order_id)
-        order = order_ref.get()
-        
-        if not order.exists:
-            return jsonify({'error': 'Order not found'}), 404
         
         # Create update data without SERVER_TIMESTAMP
         update_data = {}
@@ -193,16 +389,22 @@ def update_order_status(order_id):
         current_sg_time = datetime.now(sg_timezone)
         update_data['updatedAt'] = current_sg_time.isoformat()
         
-        # Perform the update
-        order_ref.update(update_data)
+        # Perform the update, update() fails if the order does not exist
+        result = order_ref.update(update_data, option=option)
+        version = order_version(result.update_time)
         
         # Return the updated data
         response_data = {
             'id': order_id,
-            **update_data
+            **update_data,
+            'version': version
         }
         
-        return jsonify(response_data)
+        return with_version(jsonify(response_data), version)
+    except NotFound:
+        return jsonify({'error': 'Order not found'}), 404
+    except FailedPrecondition:
+        return precondition_failed(order_id)
     except Exception as e:
         print(f"Error updating order status: {str(e)}")
         return jsonify({'error': str(e)}), 500
@@ -1,6 +1,7 @@
 from flask import Flask, request, jsonify
 from flask_cors import CORS
-from invokes import invoke_http
+from invokes import invoke_http, invoke_many
+from invokes.stats import stats_blueprint
 import os
 import pika
 from os import environ
@@ -20,6 +21,7 @@ CORS(app,
          "expose_headers": ["Content-Type"],
          "supports_credentials": True
      }})
+app.register_blueprint(stats_blueprint)
 
 PORT = int(os.environ.get('PORT', 5004))
 order_URL = environ.get('orderURL') or 'http://localhost:5001'
@@ -38,24 +40,21 @@ queue_name = "error_queue"
 
 def send_error_notification(error_details):
     try:
-        print("  Connecting to AMQP broker...")
-        connection, channel = amqp_lib.connect(
+        print("  Publishing error message to queue...")
+        queued = amqp_lib.publish_async(
             hostname=RABBITMQ_HOST,
             port=RABBITMQ_PORT,
-            exchange_name='order_topic',
-            exchange_type='topic',
-        )
-
-        print("  Publishing error message to queue...")
-        channel.basic_publish(
-            exchange='order_topic',
+            exchange_name=exchange_name,
+            exchange_type=exchange_type,
             routing_key='wallet.payment.error',
-            body=json.dumps(error_details),
+            body=error_details,
             properties=pika.BasicProperties(delivery_mode=2)
         )
+        if not queued:
+            print("  Error message dropped, publish buffer is full")
+            return False
 
-        connection.close()
-        print("  Error message sent successfully")
+        print("  Error message queued successfully")
         return True
 
     except Exception as e:
@@ -337,17 +336,11 @@ def get_user_profile(user_id):
     try:
         print(f'\n-----Fetching profile for user: {user_id}-----')
         
-        # Get user profile from wallet service
-        customer_response = invoke_http(
-            f"{customer_URL}/customers/{user_id}",
-            method='GET'
-        )
-        
-        # Get wallet balance
-        balance_response = invoke_http(
-            f"{wallet_URL}/wallet/{user_id}",
-            method='GET'
-        )
+        # Get user profile from customer service and wallet balance concurrently
+        customer_response, balance_response = invoke_many([
+            {"url": f"{customer_URL}/customers/{user_id}", "method": 'GET'},
+            {"url": f"{wallet_URL}/wallet/{user_id}", "method": 'GET'},
+        ])
         
         print('Wallet service responses:', customer_response, balance_response)
         
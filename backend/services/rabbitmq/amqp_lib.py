@@ -5,8 +5,114 @@ References:
 https://pika.readthedocs.io/en/stable/_modules/pika/exceptions.html#ConnectionClosed
 """
 
+import atexit
+import functools
+import itertools
+import json
+import os
+import queue
+import signal
+import threading
 import time
+import zlib
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 import pika
+from . import topology
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+# "memory" swaps RabbitMQ for the in-process broker in memory_broker.py
+AMQP_BACKEND = os.environ.get('AMQP_BACKEND', 'rabbitmq')
+
+
+def _open_connection(parameters):
+    if AMQP_BACKEND == 'memory':
+        from . import memory_broker
+        return memory_broker.BlockingConnection(parameters)
+    return pika.BlockingConnection(parameters)
+
+
+def _open_select_connection(parameters, **callbacks):
+    if AMQP_BACKEND == 'memory':
+        from . import memory_broker
+        return memory_broker.SelectConnection(parameters, **callbacks)
+    return pika.SelectConnection(parameters, **callbacks)
+
+
+# Message codecs, signalled through the content_type / content_encoding
+# properties so producers and consumers can switch codecs independently
+# AMQP_CODEC: "json" (default) or "msgpack"
+# AMQP_COMPRESS_THRESHOLD: deflate bodies larger than this many bytes, 0 disables
+AMQP_CODEC = os.environ.get('AMQP_CODEC', 'json')
+AMQP_COMPRESS_THRESHOLD = int(os.environ.get('AMQP_COMPRESS_THRESHOLD', 0))
+
+JSON_CONTENT_TYPE = "application/json"
+MSGPACK_CONTENT_TYPE = "application/msgpack"
+DEFLATE_ENCODING = "deflate"
+
+CODECS = {
+    "json": JSON_CONTENT_TYPE,
+    "msgpack": MSGPACK_CONTENT_TYPE,
+}
+
+
+def encode_message(message, codec=None, compress_threshold=None):
+    """Serialise message, returning (body, content_type, content_encoding)."""
+    codec = codec or AMQP_CODEC
+    if compress_threshold is None:
+        compress_threshold = AMQP_COMPRESS_THRESHOLD
+
+    if codec == "msgpack" and msgpack is not None:
+        body = msgpack.packb(message, use_bin_type=True)
+        content_type = MSGPACK_CONTENT_TYPE
+    else:
+        body = json.dumps(message, separators=(",", ":")).encode("utf-8")
+        content_type = JSON_CONTENT_TYPE
+
+    content_encoding = None
+    if compress_threshold and len(body) > compress_threshold:
+        body = zlib.compress(body)
+        content_encoding = DEFLATE_ENCODING
+    return body, content_type, content_encoding
+
+
+def decode_message(body, properties=None):
+    """Deserialise a message body according to its content properties.
+    Messages without a content_type are JSON, as sent by older producers.
+    """
+    content_type = getattr(properties, "content_type", None)
+    content_encoding = getattr(properties, "content_encoding", None)
+
+    if content_encoding == DEFLATE_ENCODING:
+        body = zlib.decompress(body)
+    elif content_encoding not in (None, "", "utf-8"):
+        raise ValueError(f"Unsupported content encoding: {content_encoding}")
+
+    if content_type == MSGPACK_CONTENT_TYPE:
+        if msgpack is None:
+            raise ValueError("msgpack message received but msgpack is not installed")
+        return msgpack.unpackb(body, raw=False)
+    return json.loads(body)
+
+
+def prepare_message(message, properties=None):
+    """Encode message unless it is already bytes or str, returning (body, properties)."""
+    if properties is None:
+        properties = pika.BasicProperties(delivery_mode=2)
+    if isinstance(message, (bytes, str)):
+        return message, properties
+
+    body, properties.content_type, properties.content_encoding = encode_message(message)
+    return body, properties
+
+
+if AMQP_CODEC == "msgpack" and msgpack is None:
+    print("[WARN] AMQP_CODEC=msgpack but msgpack is not installed, publishing JSON")
+
 
 # code to connect to RabbitMQ server, facilitate publish and consumption  
 # to edit here in order to establish more queues
@@ -21,7 +127,7 @@ def connect(hostname, port, exchange_name, exchange_type, max_retries=12, retry_
           try:
                 print(f"Connecting to AMQP broker {hostname}:{port}...")
                 # connect to the broker
-                connection = pika.BlockingConnection(
+                connection = _open_connection(
                      pika.ConnectionParameters(
                           host=hostname,
                           port=port,
@@ -68,9 +174,548 @@ def is_connection_open(connection):
         return False
 
 
-def start_consuming(
-     hostname, port, exchange_name, exchange_type, queue_name, callback
-):
+# Background publisher settings
+# AMQP_PUBLISH_BLOCK_TIMEOUT: seconds enqueue waits for room in a full buffer
+# (backpressure), 0 drops the message right away (fail fast)
+AMQP_PUBLISH_BUFFER = int(os.environ.get('AMQP_PUBLISH_BUFFER', 10000))
+AMQP_PUBLISH_BATCH = int(os.environ.get('AMQP_PUBLISH_BATCH', 100))
+AMQP_PUBLISH_BLOCK_TIMEOUT = float(os.environ.get('AMQP_PUBLISH_BLOCK_TIMEOUT', 0))
+AMQP_PUBLISH_MAX_ATTEMPTS = int(os.environ.get('AMQP_PUBLISH_MAX_ATTEMPTS', 5))
+# AMQP_PUBLISH_RETRY_BACKOFF: seconds before a nacked message is published again,
+# doubled on each attempt up to AMQP_PUBLISH_RETRY_BACKOFF_MAX
+AMQP_PUBLISH_RETRY_BACKOFF = float(os.environ.get('AMQP_PUBLISH_RETRY_BACKOFF', 0.5))
+AMQP_PUBLISH_RETRY_BACKOFF_MAX = float(os.environ.get('AMQP_PUBLISH_RETRY_BACKOFF_MAX', 30))
+
+
+class BackgroundPublisher:
+    """Publishes buffered messages from a background thread with publisher confirms.
+
+    Request handlers enqueue messages into a bounded in-memory buffer and
+    return at once. The worker thread owns an asynchronous (SelectConnection)
+    connection and keeps up to batch_size messages in flight on a
+    confirm-mode channel: messages are sent without waiting, and the
+    broker's acks and nacks, often one multiple-ack for many messages, are
+    handled as they come back.
+
+    A nacked message, or one in flight when the broker closes the channel
+    (e.g. PRECONDITION_FAILED on an exchange declare), is published again up
+    to max_attempts times, after a backoff doubling from retry_backoff, then
+    logged and dropped. Messages in flight or waiting for their retry when
+    the connection drops are published again on the next connection.
+    """
+
+    def __init__(self, hostname, port, username='guest', password='guest',
+                 max_buffer=AMQP_PUBLISH_BUFFER, batch_size=AMQP_PUBLISH_BATCH,
+                 max_attempts=AMQP_PUBLISH_MAX_ATTEMPTS, retry_interval=5,
+                 retry_backoff=AMQP_PUBLISH_RETRY_BACKOFF, retry_backoff_max=AMQP_PUBLISH_RETRY_BACKOFF_MAX):
+        self.parameters = pika.ConnectionParameters(
+            host=hostname,
+            port=port,
+            credentials=pika.PlainCredentials(username, password),
+            heartbeat=300,
+            blocked_connection_timeout=300,
+        )
+        self.buffer = queue.Queue(maxsize=max_buffer)
+        self.batch_size = batch_size
+        self.max_attempts = max_attempts
+        self.retry_interval = retry_interval
+        self.retry_backoff = retry_backoff
+        self.retry_backoff_max = retry_backoff_max
+        self.pending = deque()
+        # retry id -> message waiting for its backoff
+        self.retrying = {}
+        self.retry_ids = itertools.count()
+        # delivery tag -> (message, time sent), on the current channel
+        self.in_flight = {}
+        self.delivery_tag = 0
+        # message waiting for its exchange to be declared
+        self.declaring = None
+        self.connection = None
+        self.channel = None
+        self.declared_exchanges = set()
+        self.stopping = threading.Event()
+        self.thread = None
+        self.lock = threading.Lock()
+        # enqueue counts drops on request threads, the worker on its own
+        self.stats_lock = threading.Lock()
+
+        self.published = 0
+        self.nacked = 0
+        self.dropped = 0
+        self.batches = 0
+        self.confirmed = 0
+        self.confirm_latency_total = 0.0
+        self.confirm_latency_max = 0.0
+
+    def start(self):
+        with self.lock:
+            if self.thread is None:
+                self.thread = threading.Thread(
+                    target=self._run, name="amqp-background-publisher", daemon=True
+                )
+                self.thread.start()
+
+    def enqueue(self, exchange_name, exchange_type, routing_key, body, properties=None,
+                block_timeout=AMQP_PUBLISH_BLOCK_TIMEOUT):
+        """Buffer a message for publishing, return False if it was dropped."""
+        if properties is None:
+            properties = pika.BasicProperties(delivery_mode=2)
+        self.start()
+
+        message = [exchange_name, exchange_type, routing_key, body, properties, 0]
+        try:
+            if block_timeout > 0:
+                self.buffer.put(message, timeout=block_timeout)
+            else:
+                self.buffer.put_nowait(message)
+        except queue.Full:
+            with self.stats_lock:
+                self.dropped += 1
+            print(f"[WARN] Publish buffer full, dropping message for {routing_key}")
+            return False
+        self._wake()
+        return True
+
+    def _wake(self):
+        """Have the worker thread publish what was buffered (thread-safe)."""
+        connection = self.connection
+        if connection is not None and connection.is_open:
+            try:
+                connection.ioloop.add_callback_threadsafe(self._pump)
+            except Exception:
+                # the worker's periodic tick picks the message up
+                pass
+
+    def _idle(self):
+        return (self.buffer.empty() and not self.pending and not self.in_flight
+                and not self.retrying and self.declaring is None)
+
+    def _next_message(self):
+        if self.pending:
+            return self.pending.popleft()
+        try:
+            return self.buffer.get_nowait()
+        except queue.Empty:
+            return None
+
+    def _retry(self, message, reason):
+        message[5] += 1
+        if message[5] >= self.max_attempts:
+            with self.stats_lock:
+                self.dropped += 1
+            print(f"[ERROR] Message for {message[2]} {reason} {message[5]} times, dropping")
+            return
+        # back off, a broker nacking under pressure would nack an immediate retry too
+        retry_id = next(self.retry_ids)
+        self.retrying[retry_id] = message
+        delay = min(self.retry_backoff * 2 ** (message[5] - 1), self.retry_backoff_max)
+        self.connection.ioloop.call_later(delay, lambda: self._retry_due(retry_id))
+
+    def _retry_due(self, retry_id):
+        message = self.retrying.pop(retry_id, None)
+        if message is not None:
+            self.pending.append(message)
+            self._pump()
+
+    def _take_back(self, reason=None):
+        """Put the messages in flight back in line, oldest first. With a reason,
+        the failure counts as an attempt of each message.
+        """
+        messages = [message for _, (message, _) in sorted(self.in_flight.items())]
+        if self.declaring is not None:
+            messages.append(self.declaring)
+        self.in_flight = {}
+        self.declaring = None
+        if reason is None:
+            self.pending.extendleft(reversed(messages))
+        else:
+            for message in messages:
+                self._retry(message, reason)
+
+    # -- worker thread, all methods below run on the connection's ioloop
+
+    def _run(self):
+        while True:
+            try:
+                self.connection = _open_select_connection(
+                    self.parameters,
+                    on_open_callback=self._on_connection_open,
+                    on_open_error_callback=self._on_connection_open_error,
+                    on_close_callback=self._on_connection_closed,
+                )
+                self.connection.ioloop.start()
+            except Exception as exception:
+                print(f"[ERROR] Background publisher connection failed: {exception=}")
+            self._take_back()
+            # the timers of the retries are gone with the connection's ioloop
+            self.pending.extend(self.retrying.values())
+            self.retrying = {}
+            self.connection = None
+            self.channel = None
+            if self.stopping.is_set():
+                break
+            time.sleep(self.retry_interval)
+
+    def _on_connection_open(self, connection):
+        connection.channel(on_open_callback=self._on_channel_open)
+
+    def _on_connection_open_error(self, connection, error):
+        print(f"[ERROR] Background publish failed: {error=}")
+        connection.ioloop.stop()
+
+    def _on_connection_closed(self, connection, reason):
+        if not self.stopping.is_set():
+            print(f"[WARN] Background publisher connection closed: {reason=}")
+        self.channel = None
+        self._take_back()
+        connection.ioloop.stop()
+
+    def _on_channel_open(self, channel):
+        self.channel = channel
+        self.delivery_tag = 0
+        self.declared_exchanges = set()
+        channel.add_on_close_callback(self._on_channel_closed)
+        channel.confirm_delivery(ack_nack_callback=self._on_confirm, callback=lambda frame: self._tick())
+
+    def _on_channel_closed(self, channel, reason):
+        self.channel = None
+        if isinstance(reason, pika.exceptions.ChannelClosedByBroker):
+            # an error caused by what was declared or published, don't retry it forever
+            print(f"[ERROR] Publish channel closed by the broker: {reason=}")
+            self._take_back(reason="failed on a closed channel")
+        else:
+            self._take_back()
+        # reconnect after retry_interval
+        if self.connection is not None and self.connection.is_open:
+            self.connection.close()
+
+    def _tick(self):
+        """Publish on a timer too, for messages whose wake-up was missed and for close()"""
+        if self.channel is None:
+            return
+        self._pump()
+        self.connection.ioloop.call_later(1, self._tick)
+
+    def _pump(self):
+        """Send buffered messages until batch_size of them are in flight."""
+        if self.channel is None or not self.channel.is_open or self.declaring is not None:
+            return
+        sent = 0
+        while len(self.in_flight) < self.batch_size:
+            message = self._next_message()
+            if message is None:
+                break
+            exchange_name, exchange_type, routing_key, body, properties, attempts = message
+            if exchange_name not in self.declared_exchanges:
+                self.declaring = message
+                self.channel.exchange_declare(
+                    exchange=exchange_name,
+                    exchange_type=exchange_type,
+                    durable=True,
+                    callback=self._on_exchange_declared
+                )
+                break
+            self.channel.basic_publish(
+                exchange=exchange_name,
+                routing_key=routing_key,
+                body=body,
+                properties=properties
+            )
+            self.delivery_tag += 1
+            self.in_flight[self.delivery_tag] = (message, time.monotonic())
+            sent += 1
+        if sent:
+            self.batches += 1
+
+        if self.stopping.is_set() and self._idle() and self.connection.is_open:
+            self.connection.close()
+
+    def _on_exchange_declared(self, frame):
+        message, self.declaring = self.declaring, None
+        self.declared_exchanges.add(message[0])
+        self.pending.appendleft(message)
+        self._pump()
+
+    def _on_confirm(self, frame):
+        method = frame.method
+        if method.multiple:
+            tags = [tag for tag in self.in_flight if tag <= method.delivery_tag]
+        else:
+            tags = [method.delivery_tag]
+        now = time.monotonic()
+        for tag in tags:
+            entry = self.in_flight.pop(tag, None)
+            if entry is None:
+                continue
+            message, sent_at = entry
+            latency = now - sent_at
+            self.confirmed += 1
+            self.confirm_latency_total += latency
+            self.confirm_latency_max = max(self.confirm_latency_max, latency)
+            if isinstance(method, pika.spec.Basic.Ack):
+                self.published += 1
+            else:
+                self.nacked += 1
+                self._retry(message, "nacked")
+        self._pump()
+
+    def close(self, timeout=5):
+        """Flush buffered messages for up to timeout seconds, then stop."""
+        self.stopping.set()
+        self._wake()
+        if self.thread is not None:
+            self.thread.join(timeout)
+
+    def stats(self):
+        with self.stats_lock:
+            dropped = self.dropped
+        return {
+            "buffer_depth": self.buffer.qsize() + len(self.pending) + len(self.retrying),
+            "buffer_size": self.buffer.maxsize,
+            "in_flight": len(self.in_flight),
+            "published": self.published,
+            "nacked": self.nacked,
+            "dropped": dropped,
+            "batches": self.batches,
+            "avg_confirm_ms": round(1000 * self.confirm_latency_total / self.confirmed, 2) if self.confirmed else 0.0,
+            "max_confirm_ms": round(1000 * self.confirm_latency_max, 2),
+        }
+
+
+_background_publishers = {}
+_publishers_lock = threading.Lock()
+
+
+def get_background_publisher(hostname, port, username='guest', password='guest'):
+    key = (os.getpid(), hostname, port, username)
+    with _publishers_lock:
+        publisher = _background_publishers.get(key)
+        if publisher is None:
+            publisher = BackgroundPublisher(hostname, port, username, password)
+            _background_publishers[key] = publisher
+        return publisher
+
+
+def publish_async(hostname, port, exchange_name, exchange_type, routing_key, body, properties=None):
+    """Hand a message to the background publisher and return at once.
+    Returns False if the message was dropped because the buffer is full.
+    """
+    body, properties = prepare_message(body, properties)
+    return get_background_publisher(hostname, port).enqueue(
+        exchange_name, exchange_type, routing_key, body, properties
+    )
+
+
+def get_publisher_stats():
+    return {
+        f"{key[1]}:{key[2]}": publisher.stats()
+        for key, publisher in list(_background_publishers.items())
+        if key[0] == os.getpid()
+    }
+
+
+@atexit.register
+def _flush_background_publishers():
+    for publisher in list(_background_publishers.values()):
+        publisher.close()
+
+
+def settle_failed(channel, queue_name, method, properties, body):
+    """Reject a message whose callback failed.
+
+    For queues declared in topology.py, the message is republished to its
+    next delayed-retry tier and acked. Once every tier is used up, it is
+    nacked and goes to the queue's parking lot. Other queues requeue the
+    message once and discard it when the redelivery fails too.
+    """
+    if not channel.is_open:
+        return
+    if queue_name not in topology.QUEUES:
+        channel.basic_nack(delivery_tag=method.delivery_tag, requeue=not method.redelivered)
+        return
+
+    tier = topology.next_retry_tier(properties)
+    if tier is None:
+        print(f"[WARN] Message {method.delivery_tag} exhausted its retries, parking it")
+        channel.basic_nack(delivery_tag=method.delivery_tag, requeue=False)
+        return
+
+    retry_properties = pika.BasicProperties(
+        content_type=properties.content_type,
+        content_encoding=properties.content_encoding,
+        delivery_mode=2,
+        headers=topology.retry_headers(properties, queue_name, tier),
+    )
+    channel.basic_publish(
+        exchange=topology.RETRY_EXCHANGE,
+        routing_key=method.routing_key,
+        body=body,
+        properties=retry_properties
+    )
+    channel.basic_ack(delivery_tag=method.delivery_tag)
+
+
+class ParallelConsumer:
+    """Runs consumer callbacks on a pool of worker threads with manual acks.
+
+    The broker sends at most prefetch_count unacknowledged messages. Each
+    message is acked only after its callback returns. If the callback raises,
+    the message is handed to settle_failed for a delayed retry. Acks are sent from the connection's own thread
+    through add_callback_threadsafe, since pika channels are not thread-safe.
+    Callbacks receive the channel for compatibility but must not use it.
+    """
+
+    def __init__(self, callback, workers, prefetch_count=None):
+        self.callback = callback
+        self.workers = workers
+        self.prefetch_count = prefetch_count or workers * 2
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="amqp-consumer")
+        self.in_flight = 0
+        self.lock = threading.Lock()
+        self.connection = None
+        self.queue_name = None
+
+    def consume(self, connection, channel, queue_name):
+        self.connection = connection
+        self.queue_name = queue_name
+        channel.basic_qos(prefetch_count=self.prefetch_count)
+        channel.basic_consume(
+            queue=queue_name, on_message_callback=self._dispatch, auto_ack=False
+        )
+        print(f"[DEBUG] Waiting for messages with {self.workers} workers, prefetch {self.prefetch_count}...")
+        channel.start_consuming()
+
+    def _dispatch(self, channel, method, properties, body):
+        with self.lock:
+            self.in_flight += 1
+        self.executor.submit(self._handle, self.connection, channel, method, properties, body)
+
+    def _handle(self, connection, channel, method, properties, body):
+        try:
+            self.callback(channel, method, properties, body)
+            settle = functools.partial(self._ack, channel, method.delivery_tag)
+        except Exception as e:
+            print(f"[ERROR] Callback failed for message {method.delivery_tag}: {e}")
+            settle = functools.partial(
+                settle_failed, channel, self.queue_name, method, properties, body
+            )
+        finally:
+            with self.lock:
+                self.in_flight -= 1
+
+        try:
+            connection.add_callback_threadsafe(settle)
+        except pika.exceptions.AMQPError as e:
+            # the broker redelivers unacked messages of a lost connection
+            print(f"[WARN] Unable to settle message {method.delivery_tag}: {e}")
+
+    @staticmethod
+    def _ack(channel, delivery_tag):
+        if channel.is_open:
+            channel.basic_ack(delivery_tag=delivery_tag)
+
+    def drain(self, channel, timeout=30):
+        """Stop receiving, finish in-flight callbacks and flush their acks."""
+        try:
+            if channel.is_open:
+                channel.stop_consuming()
+            deadline = time.monotonic() + timeout
+            while self.in_flight and time.monotonic() < deadline:
+                self.connection.process_data_events(time_limit=0.1)
+            self.executor.shutdown(wait=True)
+            self.connection.process_data_events(time_limit=0)
+        except pika.exceptions.AMQPError as e:
+            print(f"[WARN] Connection lost while draining: {e}")
+
+
+class BatchConsumer:
+    """Hands the callback batches of up to batch_size messages, or whatever
+    arrived within batch_timeout_ms of the first message of the batch.
+
+    The callback is called as callback(channel, messages), where messages is
+    a list of (method, properties, body) tuples. The whole batch is acked
+    with a single multiple-ack once the callback returns, so the sink can
+    commit it in one round trip. If the callback raises, every message of
+    the batch is handed to settle_failed for a delayed retry.
+    """
+
+    def __init__(self, callback, batch_size=100, batch_timeout_ms=500):
+        self.callback = callback
+        self.batch_size = batch_size
+        self.batch_timeout = batch_timeout_ms / 1000
+        self.batch = []
+        self.deadline = None
+        self.queue_name = None
+
+    def consume(self, connection, channel, queue_name):
+        self.queue_name = queue_name
+        # a batch left over from a dead channel is redelivered to this one,
+        # and its delivery tags are not valid here
+        self.batch = []
+        self.deadline = None
+        channel.basic_qos(prefetch_count=self.batch_size)
+        print(f"[DEBUG] Waiting for batches of up to {self.batch_size} messages...")
+        poll_interval = min(self.batch_timeout, 0.05)
+        for method, properties, body in channel.consume(queue_name, inactivity_timeout=poll_interval):
+            if method is not None:
+                if not self.batch:
+                    self.deadline = time.monotonic() + self.batch_timeout
+                self.batch.append((method, properties, body))
+
+            if len(self.batch) >= self.batch_size or (
+                    self.batch and time.monotonic() >= self.deadline):
+                self._flush(channel)
+
+    def _flush(self, channel):
+        batch, self.batch = self.batch, []
+        last_tag = batch[-1][0].delivery_tag
+        try:
+            self.callback(channel, batch)
+            channel.basic_ack(delivery_tag=last_tag, multiple=True)
+        except pika.exceptions.AMQPError:
+            raise
+        except Exception as e:
+            print(f"[ERROR] Batch of {len(batch)} messages failed: {e}")
+            for method, properties, body in batch:
+                settle_failed(channel, self.queue_name, method, properties, body)
+
+    def drain(self, channel, timeout=30):
+        """Stop receiving and commit the partial batch."""
+        try:
+            if channel.is_open:
+                channel.cancel()
+                if self.batch:
+                    self._flush(channel)
+        except pika.exceptions.AMQPError as e:
+            print(f"[WARN] Connection lost while draining: {e}")
+
+
+def _raise_keyboard_interrupt(signum, frame):
+    raise KeyboardInterrupt()
+
+
+class _AutoAckConsumer:
+    def __init__(self, callback):
+        self.callback = callback
+
+    def consume(self, connection, channel, queue_name):
+        channel.basic_consume(
+            queue=queue_name, on_message_callback=self.callback, auto_ack=True
+        )
+
+        print("[DEBUG] Waiting for messages...")
+        channel.start_consuming()  # This will block until interrupted
+
+    def drain(self, channel, timeout=30):
+        pass
+
+
+def _run_consumer(hostname, port, exchange_name, exchange_type, queue_name, consumer):
+    # drain in-flight work on docker stop as well as on Ctrl+C
+    if threading.current_thread() is threading.main_thread():
+        signal.signal(signal.SIGTERM, _raise_keyboard_interrupt)
+
+    connection = channel = None
     while True:
         try:
             print("[DEBUG] Connecting and setting up channel...")
@@ -82,15 +727,13 @@ def start_consuming(
             )
 
             print(f"[DEBUG] Declaring queue: {queue_name}")
-            channel.queue_declare(queue=queue_name, durable=True)
+            if queue_name in topology.QUEUES:
+                topology.declare_queue(channel, queue_name)
+            else:
+                channel.queue_declare(queue=queue_name, durable=True)
 
             print(f"[DEBUG] Consuming from queue: {queue_name}")
-            channel.basic_consume(
-                queue=queue_name, on_message_callback=callback, auto_ack=True
-            )
-
-            print("[DEBUG] Waiting for messages...")
-            channel.start_consuming()  # This will block until interrupted
+            consumer.consume(connection, channel, queue_name)
 
         except pika.exceptions.ConnectionClosedByBroker:
             print("[WARN] Connection closed by broker. Reconnecting...")
@@ -98,10 +741,37 @@ def start_consuming(
 
         except KeyboardInterrupt:
             print("[INFO] Keyboard interrupt. Shutting down...")
-            close(connection, channel)
+            if connection is not None and connection.is_open:
+                consumer.drain(channel)
+                close(connection, channel)
             break
 
         except Exception as e:
             print(f"[ERROR] Unhandled exception: {e}")
             print("[DEBUG] Reconnecting in 5 seconds...")
             time.sleep(5)
+
+
+def start_consuming(
+     hostname, port, exchange_name, exchange_type, queue_name, callback,
+     prefetch_count=None, workers=None
+):
+    """Consume queue_name until interrupted, reconnecting when the connection drops.
+    With workers set, callbacks run in parallel on that many threads and
+    messages are acked after the callback succeeds (see ParallelConsumer).
+    Otherwise callbacks run one at a time with automatic acks.
+    """
+    if workers:
+        consumer = ParallelConsumer(callback, workers, prefetch_count)
+    else:
+        consumer = _AutoAckConsumer(callback)
+    _run_consumer(hostname, port, exchange_name, exchange_type, queue_name, consumer)
+
+
+def start_batch_consuming(
+     hostname, port, exchange_name, exchange_type, queue_name, callback,
+     batch_size=100, batch_timeout_ms=500
+):
+    """Consume queue_name in batches for bulk sinks (see BatchConsumer)."""
+    consumer = BatchConsumer(callback, batch_size, batch_timeout_ms)
+    _run_consumer(hostname, port, exchange_name, exchange_type, queue_name, consumer)
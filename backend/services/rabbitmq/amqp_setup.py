@@ -8,11 +8,12 @@ import pika
 import os
 import time
 import sys
+import topology
 
 amqp_host = os.environ.get('RABBITMQ_HOST', 'rabbitmq')
 amqp_port = int(os.environ.get('RABBITMQ_PORT', 5672))
-exchange_name = "order_topic"
-exchange_type = "topic"
+exchange_name = topology.EXCHANGE_NAME
+exchange_type = topology.EXCHANGE_TYPE
 
 
 def create_exchange(hostname, port, exchange_name, exchange_type):
@@ -40,17 +41,70 @@ def create_exchange(hostname, port, exchange_name, exchange_type):
     return channel
 
 
-def create_queue(channel, exchange_name, queue_name, binding_keys):
-    print(f"Declaring queue: {queue_name}")
-    channel.queue_declare(queue=queue_name, durable=True)
+def move_messages(channel, source, target):
+    """Move every message of source to target, return how many were moved.
+    channel must be in confirm mode, so a message is only acked from source
+    once target has it.
+    """
+    moved = 0
+    while True:
+        method, properties, body = channel.basic_get(queue=source)
+        if method is None:
+            return moved
+        channel.basic_publish(exchange="", routing_key=target, body=body, properties=properties)
+        channel.basic_ack(method.delivery_tag)
+        moved += 1
 
-    for binding_key in binding_keys:
-        print(f"Binding '{queue_name}' to '{exchange_name}' with key '{binding_key}'")
-        channel.queue_bind(
-            exchange=exchange_name,
-            queue=queue_name,
-            routing_key=binding_key
-        )
+
+def queue_exists(connection, queue_name):
+    channel = connection.channel()
+    try:
+        channel.queue_declare(queue=queue_name, passive=True)
+    except pika.exceptions.ChannelClosedByBroker as e:
+        if e.reply_code != 404:
+            raise
+        return False
+    channel.close()
+    return True
+
+
+def migrate_queue(connection, queue_name):
+    """Recreate a queue declared before the topology gave it arguments.
+
+    RabbitMQ refuses to redeclare an existing queue with other arguments
+    (PRECONDITION_FAILED), so error_queue and notification_queue from older
+    deployments are recreated here: their messages are moved to
+    <queue>.migrating, the queue is deleted and declared again with the
+    topology's arguments, and the messages are moved back. Running it again
+    after a crash finishes an interrupted migration.
+    """
+    holding_queue = f"{queue_name}.migrating"
+    arguments = topology.queue_arguments(queue_name)
+
+    channel = connection.channel()
+    try:
+        channel.queue_declare(queue=queue_name, durable=True, arguments=arguments)
+        channel.close()
+    except pika.exceptions.ChannelClosedByBroker as e:
+        if e.reply_code != 406:
+            raise
+        print(f"Queue {queue_name} has outdated arguments, recreating it...")
+        channel = connection.channel()
+        channel.confirm_delivery()
+        channel.queue_declare(queue=holding_queue, durable=True)
+        moved = move_messages(channel, queue_name, holding_queue)
+        channel.queue_delete(queue=queue_name)
+        channel.queue_declare(queue=queue_name, durable=True, arguments=arguments)
+        print(f"Recreated {queue_name}, {moved} messages kept")
+        channel.close()
+
+    if queue_exists(connection, holding_queue):
+        channel = connection.channel()
+        channel.confirm_delivery()
+        moved = move_messages(channel, holding_queue, queue_name)
+        channel.queue_delete(queue=holding_queue)
+        print(f"Moved {moved} messages back from {holding_queue}")
+        channel.close()
 
 
 # --- Retry Logic ---
@@ -72,27 +126,10 @@ for attempt in range(1, MAX_RETRIES + 1):
             sys.exit(1)
         time.sleep(5)
 
-# Declare queues after successful connection
-create_queue(
-    channel=channel,
-    exchange_name=exchange_name,
-    queue_name="error_queue",
-    binding_keys=[
-        "order.*.error",
-        "payment.*.error",
-        "wallet.*.error",
-    ],
-)
-
-create_queue(
-    channel=channel,
-    exchange_name=exchange_name,
-    queue_name="notification_queue",
-    binding_keys=[
-        "wallet.payment.error",
-        "order.cancel.notification",
-        "driver.assigned.notification"
-    ],
-)
+# Recreate queues left over from before the topology, then declare queues,
+# retry queues and parking lots
+for queue_name in topology.QUEUES:
+    migrate_queue(channel.connection, queue_name)
+topology.declare_all(channel)
 
 print("RabbitMQ setup complete.")
@@ -0,0 +1,718 @@
+"""
+In-process stand-in for a RabbitMQ broker, behind the same interface as
+pika.BlockingConnection and, for the background publisher, pika.SelectConnection.
+
+amqp_lib opens its connections through this module when AMQP_BACKEND=memory,
+so publishers and consumers running in one process can exchange messages
+without a live RabbitMQ (tests, local runs, consumer throughput benchmarks).
+It supports:
+- direct, fanout, topic and headers exchanges, and the default exchange;
+- durable-less queues with x-message-ttl, x-max-length (reject-publish),
+  x-dead-letter-exchange and x-dead-letter-routing-key;
+- manual and automatic acks, basic_qos prefetch, nack/requeue with the
+  redelivered flag, and redelivery of unacked messages on channel close;
+- publisher confirms (a rejected publish raises NackError, or is nacked to
+  the ack_nack_callback of a SelectConnection channel);
+- channels closed by the broker on errors, e.g. PRECONDITION_FAILED when an
+  exchange is redeclared with another type.
+
+Messages do not survive the process, and callbacks run on the thread that
+calls start_consuming/process_data_events, as with pika.
+"""
+
+import heapq
+import itertools
+import queue
+import threading
+import time
+from collections import deque
+
+import pika
+from pika.spec import Basic
+
+
+class _Message:
+    __slots__ = ("exchange", "routing_key", "body", "properties", "redelivered", "expires_at")
+
+    def __init__(self, exchange, routing_key, body, properties):
+        self.exchange = exchange
+        self.routing_key = routing_key
+        self.body = body
+        self.properties = properties or pika.BasicProperties()
+        self.redelivered = False
+        self.expires_at = None
+
+
+class _Exchange:
+    def __init__(self, name, exchange_type):
+        self.name = name
+        self.type = exchange_type
+        self.bindings = []
+
+    def route(self, routing_key, headers):
+        matched = []
+        for queue_name, binding_key, arguments in self.bindings:
+            if self.type == "fanout":
+                hit = True
+            elif self.type == "direct":
+                hit = binding_key == routing_key
+            elif self.type == "topic":
+                hit = topic_matches(binding_key, routing_key)
+            else:
+                hit = headers_match(arguments or {}, headers or {})
+            if hit and queue_name not in matched:
+                matched.append(queue_name)
+        return matched
+
+
+class _Queue:
+    def __init__(self, name, arguments):
+        self.name = name
+        self.arguments = arguments or {}
+        self.messages = deque()
+        self.consumers = []
+        self.next_consumer = 0
+        self.ttl = self.arguments.get("x-message-ttl")
+        self.max_length = self.arguments.get("x-max-length")
+
+
+class _Consumer:
+    def __init__(self, tag, channel, queue_name, callback, auto_ack):
+        self.tag = tag
+        self.channel = channel
+        self.queue_name = queue_name
+        self.callback = callback
+        self.auto_ack = auto_ack
+
+
+def topic_matches(binding_key, routing_key):
+    """AMQP topic matching: '*' matches one word, '#' zero or more words."""
+    def match(pattern, words):
+        if not pattern:
+            return not words
+        head, rest = pattern[0], pattern[1:]
+        if head == "#":
+            return any(match(rest, words[i:]) for i in range(len(words) + 1))
+        if not words:
+            return False
+        return (head == "*" or head == words[0]) and match(rest, words[1:])
+    return match(binding_key.split("."), routing_key.split("."))
+
+
+def headers_match(arguments, headers):
+    # like RabbitMQ, binding arguments starting with "x-" are not matched on
+    match_kind = arguments.get("x-match", "all")
+    pairs = [(key, value) for key, value in arguments.items() if not key.startswith("x-")]
+    hits = [key in headers and headers[key] == value for key, value in pairs]
+    if match_kind.startswith("any"):
+        return any(hits)
+    return all(hits)
+
+
+class Broker:
+    """Process-wide broker state shared by every in-memory connection."""
+
+    def __init__(self):
+        self.exchanges = {"": _Exchange("", "direct")}
+        self.queues = {}
+        self.lock = threading.RLock()
+        self.consumer_tags = itertools.count(1)
+        self.published = 0
+        self.delivered = 0
+        self.acked = 0
+        self.rejected = 0
+        self.dead_lettered = 0
+        self.expired = 0
+        self.ttl_thread = None
+
+    # -- declarations
+
+    def exchange_declare(self, name, exchange_type):
+        with self.lock:
+            if name not in self.exchanges:
+                self.exchanges[name] = _Exchange(name, exchange_type)
+            elif self.exchanges[name].type != exchange_type:
+                raise pika.exceptions.ChannelClosedByBroker(
+                    406, f"PRECONDITION_FAILED - inequivalent arg 'type' for exchange '{name}'"
+                )
+
+    def queue_declare(self, name, arguments):
+        with self.lock:
+            if name not in self.queues:
+                self.queues[name] = _Queue(name, arguments)
+                if self.queues[name].ttl is not None:
+                    self._start_ttl_thread()
+            return self.queues[name]
+
+    def queue_bind(self, exchange, queue_name, routing_key, arguments):
+        with self.lock:
+            self._get_exchange(exchange).bindings.append((queue_name, routing_key, arguments))
+
+    def _get_exchange(self, name):
+        exchange = self.exchanges.get(name)
+        if exchange is None:
+            raise pika.exceptions.ChannelClosedByBroker(404, f"NOT_FOUND - no exchange '{name}'")
+        return exchange
+
+    # -- publishing
+
+    def publish(self, exchange, routing_key, body, properties):
+        """Route a message, return False if any target queue rejected it."""
+        with self.lock:
+            self.published += 1
+            if exchange == "":
+                targets = [routing_key] if routing_key in self.queues else []
+            else:
+                headers = properties.headers if properties else None
+                targets = self._get_exchange(exchange).route(routing_key, headers)
+
+            accepted = True
+            for queue_name in targets:
+                message = _Message(exchange, routing_key, body, properties)
+                accepted = self._enqueue(self.queues[queue_name], message) and accepted
+            return accepted
+
+    def _enqueue(self, target, message, front=False):
+        if not front and target.max_length is not None and len(target.messages) >= target.max_length:
+            self.rejected += 1
+            return False
+        if target.ttl is not None and message.expires_at is None:
+            message.expires_at = time.monotonic() + target.ttl / 1000
+        if front:
+            target.messages.appendleft(message)
+        else:
+            target.messages.append(message)
+        self._dispatch(target)
+        return True
+
+    def _dead_letter(self, source, message, reason):
+        exchange = source.arguments.get("x-dead-letter-exchange")
+        if exchange is None:
+            return
+        self.dead_lettered += 1
+        routing_key = source.arguments.get("x-dead-letter-routing-key", message.routing_key)
+        properties = message.properties
+        headers = dict(properties.headers or {})
+        headers["x-death"] = [{"queue": source.name, "reason": reason}] + list(headers.get("x-death", []))
+        dead = pika.BasicProperties(
+            content_type=properties.content_type,
+            content_encoding=properties.content_encoding,
+            delivery_mode=properties.delivery_mode,
+            headers=headers,
+        )
+        if exchange == "":
+            targets = [routing_key] if routing_key in self.queues else []
+        else:
+            targets = self._get_exchange(exchange).route(routing_key, headers)
+        for queue_name in targets:
+            self._enqueue(self.queues[queue_name], _Message(exchange, routing_key, message.body, dead))
+
+    # -- delivery
+
+    def _dispatch(self, target):
+        while target.messages and target.consumers:
+            consumer = None
+            for offset in range(len(target.consumers)):
+                candidate = target.consumers[(target.next_consumer + offset) % len(target.consumers)]
+                if candidate.channel.has_capacity():
+                    consumer = candidate
+                    target.next_consumer = (target.next_consumer + offset + 1) % len(target.consumers)
+                    break
+            if consumer is None:
+                return
+
+            message = target.messages.popleft()
+            if message.expires_at is not None and message.expires_at <= time.monotonic():
+                self.expired += 1
+                self._dead_letter(target, message, "expired")
+                continue
+            self.delivered += 1
+            consumer.channel.deliver(consumer, target, message)
+
+    def _expire(self):
+        while True:
+            time.sleep(0.05)
+            now = time.monotonic()
+            with self.lock:
+                for target in list(self.queues.values()):
+                    # messages of a queue share its TTL, so expired ones are at the head
+                    while target.messages and target.messages[0].expires_at is not None \
+                            and target.messages[0].expires_at <= now:
+                        self.expired += 1
+                        self._dead_letter(target, target.messages.popleft(), "expired")
+
+    def _start_ttl_thread(self):
+        if self.ttl_thread is None:
+            self.ttl_thread = threading.Thread(target=self._expire, name="memory-broker-ttl", daemon=True)
+            self.ttl_thread.start()
+
+    def add_consumer(self, consumer):
+        with self.lock:
+            target = self.queues.get(consumer.queue_name)
+            if target is None:
+                raise pika.exceptions.ChannelClosedByBroker(404, f"NOT_FOUND - no queue '{consumer.queue_name}'")
+            target.consumers.append(consumer)
+            self._dispatch(target)
+
+    def remove_consumer(self, consumer):
+        with self.lock:
+            target = self.queues.get(consumer.queue_name)
+            if target is not None and consumer in target.consumers:
+                target.consumers.remove(consumer)
+
+    def settle(self, target, message, requeue):
+        """Put back (requeue) or drop / dead-letter a rejected message."""
+        with self.lock:
+            if requeue:
+                message.redelivered = True
+                self._enqueue(target, message, front=True)
+            else:
+                self._dead_letter(target, message, "rejected")
+
+    def redispatch(self):
+        with self.lock:
+            for target in self.queues.values():
+                self._dispatch(target)
+
+    def stats(self):
+        with self.lock:
+            return {
+                "published": self.published,
+                "delivered": self.delivered,
+                "acked": self.acked,
+                "rejected": self.rejected,
+                "dead_lettered": self.dead_lettered,
+                "expired": self.expired,
+                "queues": {name: len(target.messages) for name, target in self.queues.items()},
+            }
+
+
+_broker = Broker()
+
+
+def get_broker():
+    return _broker
+
+
+def reset():
+    """Drop every exchange, queue and message, e.g. between benchmark runs."""
+    global _broker
+    _broker = Broker()
+
+
+class _DeclareOk:
+    def __init__(self, target):
+        self.method = pika.spec.Queue.DeclareOk(queue=target.name, message_count=len(target.messages))
+
+
+class BlockingChannel:
+    def __init__(self, connection, channel_number):
+        self.connection = connection
+        self.channel_number = channel_number
+        self.broker = connection.broker
+        self.prefetch_count = 0
+        self.delivery_tags = itertools.count(1)
+        self.unacked = {}
+        self.consumers = {}
+        self.confirming = False
+        self.consuming = False
+        self._open = True
+
+    @property
+    def is_open(self):
+        return self._open and self.connection.is_open
+
+    @property
+    def is_closed(self):
+        return not self.is_open
+
+    def _check_open(self):
+        if not self.is_open:
+            raise pika.exceptions.ChannelWrongStateError("Channel is closed.")
+
+    # -- declarations
+
+    def exchange_declare(self, exchange, exchange_type="direct", durable=False, **kwargs):
+        self._check_open()
+        self.broker.exchange_declare(exchange, exchange_type)
+
+    def queue_declare(self, queue, durable=False, arguments=None, **kwargs):
+        self._check_open()
+        return _DeclareOk(self.broker.queue_declare(queue, arguments))
+
+    def queue_bind(self, queue, exchange, routing_key=None, arguments=None):
+        self._check_open()
+        self.broker.queue_bind(exchange, queue, routing_key, arguments)
+
+    def basic_qos(self, prefetch_size=0, prefetch_count=0, global_qos=False):
+        self._check_open()
+        self.prefetch_count = prefetch_count
+
+    def confirm_delivery(self):
+        self.confirming = True
+
+    # -- publishing
+
+    def basic_publish(self, exchange, routing_key, body, properties=None, mandatory=False):
+        self._check_open()
+        if isinstance(body, str):
+            body = body.encode("utf-8")
+        accepted = self.broker.publish(exchange, routing_key, body, properties)
+        if not accepted and self.confirming:
+            raise pika.exceptions.NackError([body])
+
+    # -- consuming
+
+    def has_capacity(self):
+        return self.prefetch_count == 0 or len(self.unacked) < self.prefetch_count
+
+    def deliver(self, consumer, target, message):
+        """Called by the broker, under its lock, to hand a message to a consumer."""
+        delivery_tag = next(self.delivery_tags)
+        if consumer.auto_ack:
+            self.broker.acked += 1
+        else:
+            self.unacked[delivery_tag] = (target, message)
+        method = Basic.Deliver(
+            consumer_tag=consumer.tag,
+            delivery_tag=delivery_tag,
+            redelivered=message.redelivered,
+            exchange=message.exchange,
+            routing_key=message.routing_key,
+        )
+        self.connection.events.put((consumer, method, message.properties, message.body))
+
+    def basic_consume(self, queue, on_message_callback, auto_ack=False, consumer_tag=None, **kwargs):
+        self._check_open()
+        tag = consumer_tag or f"ctag{self.channel_number}.{next(self.broker.consumer_tags)}"
+        consumer = _Consumer(tag, self, queue, on_message_callback, auto_ack)
+        self.consumers[tag] = consumer
+        self.broker.add_consumer(consumer)
+        return tag
+
+    def basic_cancel(self, consumer_tag):
+        consumer = self.consumers.pop(consumer_tag, None)
+        if consumer is not None:
+            self.broker.remove_consumer(consumer)
+
+    def start_consuming(self):
+        self.consuming = True
+        while self.consuming and self.consumers and self.is_open:
+            self.connection.process_data_events(time_limit=0.1)
+
+    def stop_consuming(self, consumer_tag=None):
+        for tag in [consumer_tag] if consumer_tag else list(self.consumers):
+            self.basic_cancel(tag)
+        self.consuming = False
+
+    def consume(self, queue, auto_ack=False, inactivity_timeout=None):
+        """Generator of (method, properties, body), like BlockingChannel.consume."""
+        received = deque()
+        tag = self.basic_consume(
+            queue, lambda channel, method, properties, body: received.append((method, properties, body)),
+            auto_ack=auto_ack,
+        )
+        self._generator_tag = tag
+        self._generator_buffer = received
+        while tag in self.consumers or received:
+            if not received:
+                self.connection.process_data_events(
+                    time_limit=inactivity_timeout if inactivity_timeout is not None else 0.1
+                )
+            if received:
+                yield received.popleft()
+            elif inactivity_timeout is not None:
+                yield (None, None, None)
+
+    def cancel(self):
+        """Cancel the consume() generator, requeueing messages it did not yield."""
+        tag = getattr(self, "_generator_tag", None)
+        if tag is None:
+            return 0
+        self.basic_cancel(tag)
+        received = self._generator_buffer
+        count = len(received)
+        while received:
+            method, _, _ = received.popleft()
+            self.basic_nack(delivery_tag=method.delivery_tag, requeue=True)
+        self._generator_tag = None
+        return count
+
+    # -- acknowledgements
+
+    def _take(self, delivery_tag, multiple):
+        if multiple:
+            tags = sorted(tag for tag in self.unacked if tag <= delivery_tag)
+        else:
+            tags = [delivery_tag]
+        taken = []
+        for tag in tags:
+            if tag not in self.unacked:
+                raise pika.exceptions.ChannelClosedByBroker(406, f"PRECONDITION_FAILED - unknown delivery tag {tag}")
+            taken.append(self.unacked.pop(tag))
+        return taken
+
+    def basic_ack(self, delivery_tag=0, multiple=False):
+        self._check_open()
+        with self.broker.lock:
+            self.broker.acked += len(self._take(delivery_tag, multiple))
+        self.broker.redispatch()
+
+    def basic_nack(self, delivery_tag=0, multiple=False, requeue=True):
+        self._check_open()
+        with self.broker.lock:
+            for target, message in self._take(delivery_tag, multiple):
+                self.broker.settle(target, message, requeue)
+        self.broker.redispatch()
+
+    def basic_reject(self, delivery_tag, requeue=True):
+        self.basic_nack(delivery_tag=delivery_tag, requeue=requeue)
+
+    def close(self):
+        if not self._open:
+            raise pika.exceptions.ChannelWrongStateError("Channel is closed.")
+        self._release()
+
+    def _release(self):
+        self._open = False
+        for tag in list(self.consumers):
+            self.basic_cancel(tag)
+        # unacked messages of a closed channel are redelivered
+        with self.broker.lock:
+            for tag in sorted(self.unacked, reverse=True):
+                target, message = self.unacked.pop(tag)
+                self.broker.settle(target, message, requeue=True)
+        self.broker.redispatch()
+
+
+class BlockingConnection:
+    """In-memory replacement for pika.BlockingConnection."""
+
+    def __init__(self, parameters=None):
+        self.parameters = parameters
+        self.broker = get_broker()
+        self.events = queue.Queue()
+        self.channels = []
+        self.channel_numbers = itertools.count(1)
+        self._open = True
+
+    @property
+    def is_open(self):
+        return self._open
+
+    @property
+    def is_closed(self):
+        return not self._open
+
+    def channel(self, channel_number=None):
+        if not self._open:
+            raise pika.exceptions.ConnectionWrongStateError("Connection is closed.")
+        channel = BlockingChannel(self, channel_number or next(self.channel_numbers))
+        self.channels.append(channel)
+        return channel
+
+    def add_callback_threadsafe(self, callback):
+        if not self._open:
+            raise pika.exceptions.ConnectionWrongStateError("Connection is closed.")
+        self.events.put(callback)
+
+    def process_data_events(self, time_limit=0):
+        """Run delivered callbacks and threadsafe callbacks for up to time_limit seconds."""
+        if not self._open:
+            raise pika.exceptions.ConnectionWrongStateError("Connection is closed.")
+        deadline = time.monotonic() + (time_limit or 0)
+        while True:
+            remaining = deadline - time.monotonic()
+            try:
+                event = self.events.get(timeout=remaining) if remaining > 0 else self.events.get_nowait()
+            except queue.Empty:
+                return
+            if callable(event):
+                event()
+                continue
+            consumer, method, properties, body = event
+            if consumer.channel.is_open and consumer.tag in consumer.channel.consumers:
+                consumer.callback(consumer.channel, method, properties, body)
+            elif consumer.channel.is_open and method.delivery_tag in consumer.channel.unacked:
+                # delivered after the consumer was cancelled, give it back
+                consumer.channel.basic_nack(delivery_tag=method.delivery_tag, requeue=True)
+
+    def sleep(self, duration):
+        self.process_data_events(time_limit=duration)
+
+    def close(self):
+        if not self._open:
+            raise pika.exceptions.ConnectionWrongStateError("Connection is closed.")
+        for channel in self.channels:
+            if channel._open:
+                channel._release()
+        self._open = False
+
+
+class _IOLoop:
+    """Callback loop of a SelectConnection, run by ioloop.start() until stop()."""
+
+    def __init__(self):
+        self.callbacks = queue.Queue()
+        self.timers = []
+        self.timer_ids = itertools.count()
+        self.lock = threading.Lock()
+        self.running = False
+
+    def add_callback_threadsafe(self, callback):
+        self.callbacks.put(callback)
+
+    def call_later(self, delay, callback):
+        with self.lock:
+            heapq.heappush(self.timers, (time.monotonic() + delay, next(self.timer_ids), callback))
+
+    def stop(self):
+        self.running = False
+        self.callbacks.put(lambda: None)
+
+    def _due_timer(self):
+        with self.lock:
+            if self.timers and self.timers[0][0] <= time.monotonic():
+                return heapq.heappop(self.timers)[2]
+            return None
+
+    def _wait(self):
+        with self.lock:
+            if not self.timers:
+                return 0.1
+            return min(max(self.timers[0][0] - time.monotonic(), 0), 0.1)
+
+    def start(self):
+        self.running = True
+        while self.running:
+            try:
+                callback = self.callbacks.get(timeout=self._wait())
+            except queue.Empty:
+                callback = None
+            if callback is not None:
+                callback()
+            timer = self._due_timer()
+            while timer is not None and self.running:
+                timer()
+                timer = self._due_timer()
+
+
+class SelectChannel:
+    """Channel of a SelectConnection: results and confirms arrive as callbacks."""
+
+    def __init__(self, connection, channel_number):
+        self.connection = connection
+        self.channel_number = channel_number
+        self.broker = connection.broker
+        self.ack_nack_callback = None
+        self.delivery_tags = itertools.count(1)
+        self.close_callbacks = []
+        self._open = True
+
+    @property
+    def is_open(self):
+        return self._open
+
+    @property
+    def is_closed(self):
+        return not self._open
+
+    def _later(self, callback, *args):
+        self.connection.ioloop.add_callback_threadsafe(lambda: callback(*args))
+
+    def _frame(self, method):
+        return pika.frame.Method(self.channel_number, method)
+
+    def _check_open(self):
+        if not self._open:
+            raise pika.exceptions.ChannelWrongStateError("Channel is closed.")
+
+    def add_on_close_callback(self, callback):
+        self.close_callbacks.append(callback)
+
+    def confirm_delivery(self, ack_nack_callback, callback=None):
+        self._check_open()
+        self.ack_nack_callback = ack_nack_callback
+        if callback is not None:
+            self._later(callback, self._frame(pika.spec.Confirm.SelectOk()))
+
+    def exchange_declare(self, exchange, exchange_type="direct", durable=False, callback=None, **kwargs):
+        self._check_open()
+        try:
+            self.broker.exchange_declare(exchange, exchange_type)
+        except pika.exceptions.ChannelClosedByBroker as e:
+            self._closed(e)
+            return
+        if callback is not None:
+            self._later(callback, self._frame(pika.spec.Exchange.DeclareOk()))
+
+    def basic_publish(self, exchange, routing_key, body, properties=None, mandatory=False):
+        self._check_open()
+        if isinstance(body, str):
+            body = body.encode("utf-8")
+        try:
+            accepted = self.broker.publish(exchange, routing_key, body, properties)
+        except pika.exceptions.ChannelClosedByBroker as e:
+            self._closed(e)
+            return
+        if self.ack_nack_callback is not None:
+            method = Basic.Ack if accepted else Basic.Nack
+            self._later(self.ack_nack_callback, self._frame(method(delivery_tag=next(self.delivery_tags))))
+
+    def close(self):
+        self._check_open()
+        self._closed(pika.exceptions.ChannelClosedByClient(200, "Normal shutdown"))
+
+    def _closed(self, reason):
+        if not self._open:
+            return
+        self._open = False
+        for callback in self.close_callbacks:
+            self._later(callback, self, reason)
+
+
+class SelectConnection:
+    """In-memory replacement for pika.SelectConnection."""
+
+    def __init__(self, parameters=None, on_open_callback=None, on_open_error_callback=None,
+                 on_close_callback=None):
+        self.parameters = parameters
+        self.broker = get_broker()
+        self.ioloop = _IOLoop()
+        self.on_close_callback = on_close_callback
+        self.channels = []
+        self.channel_numbers = itertools.count(1)
+        self._open = True
+        if on_open_callback is not None:
+            self.ioloop.add_callback_threadsafe(lambda: on_open_callback(self))
+
+    @property
+    def is_open(self):
+        return self._open
+
+    @property
+    def is_closing(self):
+        return False
+
+    @property
+    def is_closed(self):
+        return not self._open
+
+    def channel(self, channel_number=None, on_open_callback=None):
+        if not self._open:
+            raise pika.exceptions.ConnectionWrongStateError("Connection is closed.")
+        channel = SelectChannel(self, channel_number or next(self.channel_numbers))
+        self.channels.append(channel)
+        if on_open_callback is not None:
+            self.ioloop.add_callback_threadsafe(lambda: on_open_callback(channel))
+        return channel
+
+    def close(self, reply_code=200, reply_text="Normal shutdown"):
+        if not self._open:
+            raise pika.exceptions.ConnectionWrongStateError("Connection is closed.")
+        self._open = False
+        reason = pika.exceptions.ConnectionClosedByClient(reply_code, reply_text)
+        for channel in self.channels:
+            channel._closed(reason)
+        if self.on_close_callback is not None:
+            self.ioloop.add_callback_threadsafe(lambda: self.on_close_callback(self, reason))
@@ -0,0 +1,83 @@
+"""
+BackgroundPublisher against the in-process broker. Run from backend/services:
+
+    python -m pytest rabbitmq/tests
+"""
+
+import time
+import unittest
+
+from rabbitmq import amqp_lib, memory_broker
+
+QUEUE = "publisher_test_queue"
+
+
+def wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            raise AssertionError("timed out")
+        time.sleep(0.01)
+
+
+class BackgroundPublisherTest(unittest.TestCase):
+
+    def setUp(self):
+        self.backend = amqp_lib.AMQP_BACKEND
+        amqp_lib.AMQP_BACKEND = "memory"
+        memory_broker.reset()
+        channel = memory_broker.BlockingConnection().channel()
+        channel.exchange_declare(exchange="test_topic", exchange_type="topic")
+        channel.queue_declare(queue=QUEUE)
+        channel.queue_bind(queue=QUEUE, exchange="test_topic", routing_key="test.#")
+        self.publisher = amqp_lib.BackgroundPublisher(
+            "localhost", 5672, batch_size=50, max_attempts=3, retry_interval=0
+        )
+
+    def tearDown(self):
+        self.publisher.close()
+        amqp_lib.AMQP_BACKEND = self.backend
+
+    def queued(self):
+        return len(memory_broker.get_broker().queues[QUEUE].messages)
+
+    def test_messages_are_published_with_confirms_in_flight_together(self):
+        for i in range(500):
+            self.assertTrue(self.publisher.enqueue("test_topic", "topic", "test.message", str(i).encode()))
+        wait_for(lambda: self.publisher.published == 500)
+
+        self.assertEqual(self.queued(), 500)
+        stats = self.publisher.stats()
+        self.assertEqual(stats["dropped"], 0)
+        # several messages are sent before their confirms come back
+        self.assertLess(stats["batches"], 500)
+
+    def test_message_failing_on_the_channel_is_dropped_after_max_attempts(self):
+        # redeclaring test_topic with another type closes the channel
+        self.publisher.enqueue("test_topic", "direct", "test.bad", b"bad")
+        wait_for(lambda: self.publisher.dropped == 1)
+
+        self.publisher.enqueue("test_topic", "topic", "test.good", b"good")
+        wait_for(lambda: self.publisher.published == 1)
+        self.assertEqual(self.queued(), 1)
+        self.assertEqual(self.publisher.stats()["buffer_depth"], 0)
+
+    def test_nacked_message_is_published_again_after_a_backoff(self):
+        self.publisher.retry_backoff = 0.2
+        channel = memory_broker.BlockingConnection().channel()
+        channel.queue_declare(queue="full_queue", arguments={"x-max-length": 1})
+        channel.queue_bind(queue="full_queue", exchange="test_topic", routing_key="full.#")
+        channel.basic_publish(exchange="test_topic", routing_key="full.first", body=b"first")
+
+        self.publisher.enqueue("test_topic", "topic", "full.second", b"second")
+        wait_for(lambda: self.publisher.nacked == 1 and self.publisher.stats()["buffer_depth"] == 1)
+        # an immediate retry would be nacked again, the backoff gives the queue time to drain
+        memory_broker.get_broker().queues["full_queue"].messages.clear()
+
+        wait_for(lambda: self.publisher.published == 1)
+        self.assertEqual(self.publisher.nacked, 1)
+        self.assertEqual(self.publisher.dropped, 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,77 @@
+"""
+BatchConsumer against the in-process broker. Run from backend/services:
+
+    python -m pytest rabbitmq/tests
+"""
+
+import threading
+import time
+import unittest
+
+from rabbitmq import amqp_lib, memory_broker
+
+QUEUE = "batch_test_queue"
+
+
+def wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            raise AssertionError("timed out")
+        time.sleep(0.01)
+
+
+class BatchConsumerReconnectTest(unittest.TestCase):
+
+    def setUp(self):
+        memory_broker.reset()
+        self.batches = []
+        self.consumer = amqp_lib.BatchConsumer(
+            lambda channel, messages: self.batches.append([body for _, _, body in messages]),
+            batch_size=6,
+            # the first connection must not flush its partial batch
+            batch_timeout_ms=60000,
+        )
+
+    def start(self):
+        """Consume on a new connection in a thread, like one pass of _run_consumer"""
+        connection = memory_broker.BlockingConnection()
+        channel = connection.channel()
+        channel.queue_declare(queue=QUEUE, durable=True)
+
+        def run():
+            try:
+                self.consumer.consume(connection, channel, QUEUE)
+            except Exception:
+                # the connection was closed under the consumer
+                pass
+
+        thread = threading.Thread(target=run, daemon=True)
+        thread.start()
+        return connection, thread
+
+    def test_partial_batch_is_not_flushed_again_after_reconnect(self):
+        connection, thread = self.start()
+        publisher = memory_broker.BlockingConnection().channel()
+        for i in range(3):
+            publisher.basic_publish(exchange="", routing_key=QUEUE, body=str(i))
+        wait_for(lambda: len(self.consumer.batch) == 3)
+
+        # the connection drops with a half-filled batch, which is redelivered
+        connection.close()
+        thread.join(timeout=5)
+
+        self.consumer.batch_timeout = 0.2
+        connection, thread = self.start()
+        wait_for(lambda: self.batches)
+        time.sleep(0.3)
+        connection.close()
+        thread.join(timeout=5)
+
+        self.assertEqual(self.batches, [[b"0", b"1", b"2"]])
+        broker = memory_broker.get_broker()
+        self.assertEqual(broker.acked, 3)
+
+
+if __name__ == "__main__":
+    unittest.main()
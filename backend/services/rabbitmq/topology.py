@@ -0,0 +1,156 @@
+"""
+Declarative RabbitMQ topology shared by amqp_setup.py and the consumers.
+
+Every queue listed in QUEUES gets:
+- bindings to the order_topic exchange for its routing keys;
+- a length limit, with publishers rejected (nacked) once the queue is full;
+- lazy mode, so bursts are paged to disk instead of held in broker memory;
+- one delayed-retry queue per entry of RETRY_DELAYS_MS. A failed message is
+  published to the retry exchange and waits in the retry queue until its TTL
+  expires. It is then dead-lettered back to its own queue only, through the
+  requeue exchange, and keeps its original routing key;
+- a parking-lot queue that receives messages that failed every retry tier.
+
+References:
+https://www.rabbitmq.com/docs/dlx
+https://www.rabbitmq.com/docs/ttl
+"""
+
+EXCHANGE_NAME = "order_topic"
+EXCHANGE_TYPE = "topic"
+
+# headers exchanges, so a retried message only goes back to the queue it came
+# from even when several queues are bound to its routing key
+RETRY_EXCHANGE = "order_topic.retry"
+REQUEUE_EXCHANGE = "order_topic.requeue"
+PARKING_EXCHANGE = "order_topic.parking"
+
+# headers exchanges ignore binding arguments starting with "x-", so these
+# routing headers must not use that prefix
+TARGET_QUEUE_HEADER = "target-queue"
+RETRY_TIER_HEADER = "retry-tier"
+
+# Delays before each redelivery attempt, in milliseconds
+RETRY_DELAYS_MS = [5000, 30000, 300000]
+
+QUEUES = {
+    "error_queue": {
+        "binding_keys": [
+            "order.*.error",
+            "payment.*.error",
+            "wallet.*.error",
+        ],
+        "max_length": 100000,
+    },
+    "notification_queue": {
+        "binding_keys": [
+            "wallet.payment.error",
+            "order.cancel.notification",
+            "driver.assigned.notification",
+        ],
+        "max_length": 50000,
+    },
+    "driver_available_queue": {
+        "binding_keys": [
+            "driver.available",
+        ],
+        "max_length": 10000,
+    },
+}
+
+
+def retry_queue_name(queue_name, tier):
+    return f"{queue_name}.retry.{tier}"
+
+
+def parking_queue_name(queue_name):
+    return f"{queue_name}.parking"
+
+
+def queue_arguments(queue_name):
+    return {
+        "x-queue-mode": "lazy",
+        "x-max-length": QUEUES[queue_name]["max_length"],
+        "x-overflow": "reject-publish",
+        # nacked messages that won't be retried go to the parking lot
+        "x-dead-letter-exchange": PARKING_EXCHANGE,
+        "x-dead-letter-routing-key": queue_name,
+    }
+
+
+def exchange_specs():
+    """Return (exchange, exchange_type) for every exchange of the topology."""
+    return [
+        (EXCHANGE_NAME, EXCHANGE_TYPE),
+        (RETRY_EXCHANGE, "headers"),
+        (REQUEUE_EXCHANGE, "headers"),
+        (PARKING_EXCHANGE, "direct"),
+    ]
+
+
+def queue_specs(queue_name):
+    """Return (queue, arguments, bindings) for queue_name, its retry queues and
+    its parking lot, each binding being (exchange, routing_key, arguments).
+    """
+    bindings = [(EXCHANGE_NAME, binding_key, None) for binding_key in QUEUES[queue_name]["binding_keys"]]
+    bindings.append((REQUEUE_EXCHANGE, None, {"x-match": "all", TARGET_QUEUE_HEADER: queue_name}))
+    specs = [(queue_name, queue_arguments(queue_name), bindings)]
+
+    for tier, delay_ms in enumerate(RETRY_DELAYS_MS):
+        specs.append((
+            retry_queue_name(queue_name, tier),
+            {
+                "x-queue-mode": "lazy",
+                "x-message-ttl": delay_ms,
+                "x-dead-letter-exchange": REQUEUE_EXCHANGE,
+            },
+            [(RETRY_EXCHANGE, None, {"x-match": "all", TARGET_QUEUE_HEADER: queue_name, RETRY_TIER_HEADER: tier})],
+        ))
+
+    specs.append((
+        parking_queue_name(queue_name),
+        {"x-queue-mode": "lazy"},
+        [(PARKING_EXCHANGE, queue_name, None)],
+    ))
+    return specs
+
+
+def declare_exchanges(channel):
+    for exchange, exchange_type in exchange_specs():
+        channel.exchange_declare(exchange=exchange, exchange_type=exchange_type, durable=True)
+
+
+def declare_queue(channel, queue_name):
+    """Declare queue_name with its bindings, retry queues and parking lot."""
+    declare_exchanges(channel)
+
+    for queue, arguments, bindings in queue_specs(queue_name):
+        print(f"Declaring queue: {queue}")
+        channel.queue_declare(queue=queue, durable=True, arguments=arguments)
+        for exchange, routing_key, binding_arguments in bindings:
+            print(f"Binding '{queue}' to '{exchange}' with key '{routing_key}'")
+            channel.queue_bind(
+                exchange=exchange, queue=queue, routing_key=routing_key, arguments=binding_arguments
+            )
+
+
+def declare_all(channel):
+    for queue_name in QUEUES:
+        declare_queue(channel, queue_name)
+
+
+def next_retry_tier(properties):
+    """Return the retry tier for a message that failed, or None once every
+    tier has been used up.
+    """
+    headers = (properties.headers or {}) if properties else {}
+    tier = headers.get(RETRY_TIER_HEADER)
+    tier = 0 if tier is None else int(tier) + 1
+    return tier if tier < len(RETRY_DELAYS_MS) else None
+
+
+def retry_headers(properties, queue_name, tier):
+    headers = dict((properties.headers or {}) if properties else {})
+    headers[TARGET_QUEUE_HEADER] = queue_name
+    headers[RETRY_TIER_HEADER] = tier
+    return headers
@@ -3,6 +3,9 @@ from flask_cors import CORS
 import os
 import json
 from invokes import invoke_http
+from invokes.stats import stats_blueprint
+import rabbitmq.amqp_lib as amqp_lib
+import pika
 from firebase_admin import credentials, firestore, initialize_app
 import time
 from datetime import datetime, timedelta
@@ -10,6 +13,7 @@ import threading
 
 app = Flask(__name__)
 CORS(app)
+app.register_blueprint(stats_blueprint)
 
 # Initialize Firebase
 firebase_config = os.environ.get('FIREBASE_CONFIG')
@@ -23,6 +27,13 @@ ORDER_URL = os.environ.get('orderURL') or "http://order-service:5001"
 DRIVERS_URL = os.environ.get('driversURL') or "https://personal-shkrtsry.outsystemscloud.com/DriverServiceModule/rest/NomNomGo"
 ASSIGN_DRIVER_URL = os.environ.get('assignDriverURL') or "http://assign-driver:5006"
 
+# Rabbit MQ variable
+RABBITMQ_PORT = int(os.environ.get('RABBITMQ_PORT', 5672))
+RABBITMQ_HOST = os.environ.get('RABBITMQ_HOST', 'rabbitmq')
+
+exchange_name = "order_topic"
+exchange_type = "topic"
+
 def update_driver_status(driver_id, status, driver_info=None):
     try:
         # Construct the request body with consistent status casing
@@ -45,7 +56,25 @@ def update_driver_status(driver_id, status, driver_info=None):
         print(f"Error updating driver status: {str(e)}")
         return {"error": str(e)}
 
-def set_driver_available_after_delay(driver_id, driver_info):
+def publish_driver_available(driver_id, restaurant_id):
+    """Tell assign-driver a driver is free so a pending order can take it right away"""
+    queued = amqp_lib.publish_async(
+        hostname=RABBITMQ_HOST,
+        port=RABBITMQ_PORT,
+        exchange_name=exchange_name,
+        exchange_type=exchange_type,
+        routing_key='driver.available',
+        body={
+            "driver_id": int(driver_id),
+            "restaurant_id": restaurant_id,
+            "available_at": datetime.now().isoformat()
+        },
+        properties=pika.BasicProperties(delivery_mode=2)
+    )
+    if not queued:
+        print(f"driver.available event for driver {driver_id} dropped, publish buffer is full")
+
+def set_driver_available_after_delay(driver_id, driver_info, restaurant_id=None):
     """Background task to update driver status after delay"""
     try:
         print(f"Starting 5-minute timer for driver {driver_id}")
@@ -66,6 +95,9 @@ def set_driver_available_after_delay(driver_id, driver_info):
             }
         )
         print(f"Update driver status response: {response}")
+
+        if response and response.get('Success', False):
+            publish_driver_available(driver_id, restaurant_id)
         
     except Exception as e:
         print(f"Error in set_driver_available_after_delay: {str(e)}")
@@ -99,7 +131,8 @@ def reject_delivery(order_id, driver_id):
                 "message": f"Driver information not found."
             }), 404
 
-        # Step 3: Update order status 
+        # Step 3: Update order status, unless the order changed since Step 1
+        version = order_result.get('version')
         order_update = invoke_http(
             f"{ORDER_URL}/orders/{order_id}/status",
             method="PUT",
@@ -107,13 +140,28 @@ def reject_delivery(order_id, driver_id):
                 "status": "PREPARING",
                 "driverId": None,
                 "driverStatus": "PENDING"
-            }
+            },
+            headers={"If-Match": version} if version else None
         )
                 
-        if 'error' in order_update:
+        # an empty reply is not a dict
+        if not isinstance(order_update, dict):
+            return jsonify({
+                "code": 500,
+                "message": f"Failed to update order: unexpected reply {order_update!r}"
+            }), 500
+
+        if order_update.get('code') == 412:
+            return jsonify({
+                "code": 409,
+                "message": f"Order {order_id} changed while the rejection was processed, please retry."
+            }), 409
+
+        # 'code': the order service could not be reached
+        if 'error' in order_update or 'code' in order_update:
             return jsonify({
                 "code": 500,
-                "message": f"Failed to update order: {order_update['error']}"
+                "message": f"Failed to update order: {order_update.get('error') or order_update.get('message')}"
             }), 500
 
         # Step 4: Set driver status to BUSY with consistent casing
@@ -141,7 +189,7 @@ def reject_delivery(order_id, driver_id):
         # Pass driver info to the background thread
         thread = threading.Thread(
             target=set_driver_available_after_delay,
-            args=(driver_id, driver_result.get('Driver', {})),
+            args=(driver_id, driver_result.get('Driver', {}), order_result.get('restaurantId')),
             daemon=True
         )
         thread.start()